@@ -1,51 +1,66 @@
 '''
 Hauling trade module and logic.
 '''
-import json
+import asyncio
+import heapq
+import math
 import os
+import struct
 import time
+import zlib
 from datetime import datetime
 import traceback
-import boto3
-import requests
-from elasticsearch import Elasticsearch
+from typing import Any, Callable, Dict, Iterator, List, Optional
+import numpy as np
 from api.utils.helpers import round_value, remove_mismatch_type_ids
+from api.utils import order_fetcher, reference_data, result_cache, route_engine, route_refresh, startup, trade_engine
+from api.utils.lru_cache import LRUCache
+from api.utils.order_book import OrderBook
 
-type_id_to_name: dict = requests.get(
-    'https://evetrade.s3.amazonaws.com/resources/typeIDToName.json', timeout=30
-    ).json()
-station_id_to_name: dict = requests.get(
-    'https://evetrade.s3.amazonaws.com/resources/stationIdToName.json', timeout=30
-    ).json()
-system_id_to_security = requests.get(
-    'https://evetrade.s3.amazonaws.com/resources/systemIdToSecurity.json', timeout=30
-    ).json()
-structure_info: dict = requests.get(
-    'https://evetrade.s3.amazonaws.com/resources/structureInfo.json', timeout=30
-    ).json()
-
+# Routes of the trades of the current request and their jump counts
 jump_count = {}
 
-es_client = Elasticsearch([os.getenv('ES_HOST')])
-
-# Load the SQS SDK for Python
-sqs = boto3.client('sqs')
-
-def send_message(payload: dict) -> None:
-    '''
-    Sends message to SQS queue to reprocess jump count data if stale.
-    '''
-    params = {
-        'MessageBody': json.dumps(payload),
-        'QueueUrl': os.getenv('SQS_QUEUE_URL')
-    }
-
-    sqs.send_message(**params)
-
-
-async def get_orders(location_string: str, order_type: str, structure_type: str) -> list:
+# Routes of the current request with missing, invalid or stale jump counts
+refresh_routes = set()
+
+# Jump counts of recently used routes keyed by (route safety, route)
+route_cache = LRUCache(
+    int(os.getenv('ROUTE_CACHE_SIZE', '50000')),
+    int(os.getenv('ROUTE_CACHE_TTL', '3600')),
+)
+
+ORDER_FIELDS = ['volume_remain', 'price', 'station_id', 'system_id', 'type_id']
+
+# Query parameters of a hauling request and their defaults, None when required or unset
+QUERY_DEFAULTS = {
+    'from': None,
+    'to': None,
+    'tax': 0.075,
+    'minProfit': 500000,
+    'minROI': 0.04,
+    'maxBudget': float('inf'),
+    'maxWeight': float('inf'),
+    'routeSafety': 'secure', # secure, shortest, insecure
+    'systemSecurity': 'high_sec',
+    'structureType': 'both', # citadel, npm, both
+    'limit': None,
+}
+
+JUMP_DATA_INDEX = 'evetrade_jump_data'
+
+# Exact keyword field of the route of a jump data document, used for routes without a route document ID
+ROUTE_KEYWORD_FIELD = 'route.keyword'
+TERMS_CHUNK = 10000
+
+# Parameters identifying a cached pair of order books
+ORDER_BOOK_KEYS = dict.fromkeys(['from', 'fromType', 'to', 'toType', 'structureType'])
+
+# Length of the encoded from order book in a cached pair of order books
+ORDER_BOOKS_HEADER = struct.Struct('<Q')
+
+def get_orders_query(location_string: str, order_type: str, structure_type: str) -> dict:
     '''
-    Get all orders for a given location and order type from ES.
+    Build the ES query for all orders of a given location and order type.
     '''
     locations = location_string.split(',')
 
@@ -105,97 +120,160 @@ async def get_orders(location_string: str, order_type: str, structure_type: str)
             }
         )
 
-    all_hits = []
-    response = es_client.search(  # pylint: disable=E1123
-        index='market_data', 
-        scroll='10s', 
-        size=10000, 
-        _source= ['volume_remain', 'price', 'station_id', 'system_id', 'type_id'], 
-        body={
-            'query': {
-                'bool': must_clause
-            }
-        }
-    )
+    return {'bool': must_clause}
 
-    all_hits = all_hits + response['hits']['hits']
 
-    scroll_id = response['_scroll_id']
-    print(f"Retrieved {len(all_hits)} of {response['hits']['total']['value']} total hits.")
+def stream_orders(location_string: str, order_type: str, structure_type: str) -> Iterator[List[dict]]:
+    '''
+    Yields batches of order hits for a given location and order type as pages arrive from ES.
+    The next page is fetched in the background while the current batch is processed.
+    '''
+    query = get_orders_query(location_string, order_type, structure_type)
+    yield from order_fetcher.stream_order_pages(startup.get_es_client(), query, ORDER_FIELDS)
+
+
+async def get_orders(location_string: str, order_type: str, structure_type: str) -> OrderBook:
+    '''
+    Get all orders for a given location and order type from ES grouped by type ID.
+    Orders are grouped while they stream in so the raw hits are never held all at once.
+    The blocking ES calls run in a worker thread so several retrievals can overlap.
+    '''
+    return await asyncio.to_thread(
+        order_fetcher.build_order_book, stream_orders(location_string, order_type, structure_type), ORDER_FIELDS
+    )
 
-    while response['hits']['total']['value'] != len(all_hits):
-        scroll_response = es_client.scroll(  # pylint: disable=E1123
-            scroll_id=scroll_id, scroll='10s'
-        )
-        all_hits = all_hits + scroll_response['hits']['hits']
-        print(f"Retrieved {len(all_hits)} of {scroll_response['hits']['total']['value']} total hits.")
 
-    all_orders = []
-    for hit in all_hits:
-        all_orders.append(hit['_source'])
+def encode_order_books(orders: dict) -> bytes:
+    '''
+    Compress the order books of both sides of a trade for the cache.
+    '''
+    from_bytes = orders['from'].to_bytes()
+    return zlib.compress(ORDER_BOOKS_HEADER.pack(len(from_bytes)) + from_bytes + orders['to'].to_bytes(), 1)
+
 
-    return all_orders
+def decode_order_books(payload: bytes) -> dict:
+    '''
+    Decompress the order books of both sides of a trade from the cache.
+    '''
+    payload = zlib.decompress(payload)
+    (from_length,) = ORDER_BOOKS_HEADER.unpack_from(payload, 0)
+    from_end = ORDER_BOOKS_HEADER.size + from_length
+    return {
+        'from': OrderBook.from_bytes(payload[ORDER_BOOKS_HEADER.size:from_end]),
+        'to': OrderBook.from_bytes(payload[from_end:]),
+    }
 
 
-def get_routes(route_safety):
+async def get_order_books(from_location: str, from_type: str, to_location: str, to_type: str,
+                          structure_type: str) -> dict:
     '''
-    Get all routes from ES.
+    Get the orders of both sides of a trade, keeping only type IDs found on both sides.
+    The books are cached per locations, order types and structure type, so requests
+    that only differ in their thresholds re-filter the cached orders instead of ES.
     '''
-    should_clause = []
+    async def retrieve() -> dict:
+        # Retrieve both sides of the trade concurrently
+        from_orders, to_orders = await asyncio.gather(
+            get_orders(from_location, from_type, structure_type),
+            get_orders(to_location, to_type, structure_type)
+        )
+        # Remove type Ids that do not exist in each side of the trade
+        return remove_mismatch_type_ids(from_orders, to_orders)
+
+    key = result_cache.get_key('orders', {
+        'from': from_location,
+        'fromType': from_type,
+        'to': to_location,
+        'toType': to_type,
+        'structureType': structure_type,
+    }, ORDER_BOOK_KEYS, result_cache.get_market_version(startup.get_es_client()))
+
+    # The cache may wait on another invocation, so it runs in a worker thread
+    return await asyncio.to_thread(
+        result_cache.get_or_compute, startup.get_redis_client(), key,
+        lambda: asyncio.run(retrieve()), encode_order_books, decode_order_books
+    )
 
-    for route in jump_count:
-        should_clause.append({
-            'match_phrase': {
-                'route': route
-            }
-        })
 
-    sqs_messages_to_send = []
-    chunk_size = 128
+def lookup_routes(routes: List[str], route_safety: str) -> Dict[str, dict]:
+    '''
+    Fetch the documents of the given routes such as '30000142-30002187' from ES.
+    Routes stored with their route as document ID are fetched with one multi-get and
+    the remaining ones with one exact keyword terms query per TERMS_CHUNK routes.
+    '''
+    documents = {}
+    if not routes:
+        return documents
 
-    for i in range(0, len(should_clause), chunk_size):
-        should_chunk = should_clause[i:i + chunk_size]
+    source = [route_safety, 'route', 'last_modified']
+    es_client = startup.get_es_client()
 
-        # first we do a search, and specify a scroll timeout
+    response = es_client.mget(body={'ids': routes}, index=JUMP_DATA_INDEX, _source=source)
+    for doc in response['docs']:
+        if doc.get('found'):
+            documents[doc['_source']['route']] = doc['_source']
+
+    missing = [route for route in routes if route not in documents]
+    for i in range(0, len(missing), TERMS_CHUNK):
         response = es_client.search( # pylint: disable=E1123
-            index='evetrade_jump_data', 
-            size=10000, 
-            _source=[route_safety, 'route', 'last_modified'], 
+            index=JUMP_DATA_INDEX,
+            size=10000,
+            _source=source,
             body={
                 'query': {
-                    'bool': {
-                        'should': should_chunk
+                    'terms': {
+                        ROUTE_KEYWORD_FIELD: missing[i:i + TERMS_CHUNK]
                     }
                 }
             }
         )
+        for hit in response['hits']['hits']:
+            documents.setdefault(hit['_source']['route'], hit['_source'])
+
+    return documents
 
-        all_hits = response['hits']['hits']
-        print(f"Retrieved {len(all_hits)} routes for route chunk.")
 
-        for hit in all_hits:
-            doc = hit['_source']
-            route = doc['route']
-            jumps = doc[route_safety]
+def get_routes(route_safety):
+    '''
+    Get the jump counts of all routes in jump_count, from the route cache, the local
+    stargate graph or ES, in that order.
+    '''
+    graph = route_engine.get_jump_graph()
+
+    missing_routes = []
+    for route in jump_count:
+        jumps = route_cache.get((route_safety, route))
+        if jumps is None and graph is not None:
+            start, end = route.split('-')
+            jumps = graph.count_jumps(int(start), int(end), route_safety)
+            if jumps is not None and jumps >= 0:
+                route_cache.set((route_safety, route), jumps)
+            else:
+                jumps = None
+
+        if jumps is None:
+            missing_routes.append(route)
+        else:
             jump_count[route] = jumps
 
-            # If last modified data is 30 days or older then send a message to SQS to check for update
-            last_modified = datetime.fromtimestamp(doc['last_modified']/1000)
-            now = datetime.now()
-            diff_days = (now - last_modified).days
+    documents = lookup_routes(missing_routes, route_safety)
+    print(f"Retrieved {len(documents)} of {len(missing_routes)} uncached routes from {len(jump_count)} routes.")
+
+    now = datetime.now()
 
-            if diff_days > 30:
-                if route not in sqs_messages_to_send:
-                    sqs_messages_to_send.append(route)
+    for route, doc in documents.items():
+        jump_count[route] = doc[route_safety]
 
-        print(f"Sending {len(sqs_messages_to_send)} messages to SQS to update routes.")
+        # Routes waiting to be computed (-1) are looked up again until they are known
+        if isinstance(doc[route_safety], (int, float)) and doc[route_safety] >= 0:
+            route_cache.set((route_safety, route), doc[route_safety])
 
-        for message in sqs_messages_to_send:
-            start, end = message.split('-')
-            send_message({
-                'start': start,
-                'end': end
-            })
+        # If last modified data is 30 days or older then refresh the route
+        last_modified = datetime.fromtimestamp(doc['last_modified']/1000)
+        diff_days = (now - last_modified).days
+
+        if diff_days > 30:
+            refresh_routes.add(route)
 
     return jump_count
 
@@ -205,17 +283,64 @@ def get_station_name(station_id: int) -> str:
     Returns the name of a station given its ID.
     '''
     if station_id > 99999999:
-        return structure_info[str(station_id)]['name']
-    return station_id_to_name[str(station_id)]
+        return reference_data.get_compact_resource('structureInfo').value(station_id, 'name')
+    return reference_data.get_compact_resource('stationIdToName').value(station_id, 'name')
 
 
 
-async def get_valid_trades(from_orders: dict, to_orders: dict, tax: float,
-                           min_profit: float, min_roi: float, max_budget: float, max_weight: float,
-                           system_security: list) -> list:
+def create_trade_record(initial_order: dict, closing_order: dict, tax: float, volume: float,
+                        quantity: float, weight: float, profit: float, roi: float) -> dict:
     '''
-    Returns a list of valid trades given a set of orders.
+    Creates the hauling trade record returned to the client for a matched pair of orders.
+    '''
+    types = reference_data.get_compact_resource('typeIDToName')
+    systems = reference_data.get_compact_resource('systemIdToSecurity')
+
+    initial_order_type_id = str(initial_order['type_id'])
+    initial_order_system_id = str(initial_order['system_id'])
+    closing_order_system_id = str(closing_order['system_id'])
+
+    return {
+        'Item ID': initial_order_type_id,
+        'Item': types.value(initial_order['type_id'], 'name'),
+        'From': {
+            'name': get_station_name(initial_order['station_id']),
+            'station_id': initial_order['station_id'],
+            'system_id': initial_order_system_id,
+            'rating': systems.value(initial_order['system_id'], 'rating'),
+            'citadel': initial_order['station_id'] > 99999999
+        },
+        'Quantity': round_value(quantity, 0),
+        'Buy Price': round_value(initial_order['price'], 2),
+        'Net Costs': round_value(volume * initial_order['price'], 2),
+        'Take To': {
+            'name': get_station_name(closing_order['station_id']),
+            'station_id': closing_order['station_id'],
+            'system_id': closing_order_system_id,
+            'rating': systems.value(closing_order['system_id'], 'rating'),
+            'citadel': closing_order['station_id'] > 99999999
+        },
+        'Sell Price': round_value(closing_order['price'], 2),
+        'Net Sales': round_value(volume * closing_order['price'], 2),
+        'Gross Margin': round_value(volume * (closing_order['price'] - initial_order['price']), 2),
+        'Sales Taxes': round_value(volume * (closing_order['price'] * tax / 100), 2),
+        'Net Profit': profit,
+        'Jumps': 0,
+        'Profit per Jump': 0,
+        'Profit Per Item': round_value(profit / volume, 2),
+        'ROI': f"{round_value(100 * roi, 2)}%",
+        'Total Volume (m3)': round_value(weight, 2),
+    }
+
+
+def get_valid_trades_loop(from_orders: OrderBook, to_orders: OrderBook, tax: float,
+                          min_profit: float, min_roi: float, max_budget: float, max_weight: float,
+                          system_security: list) -> list:
     '''
+    Returns a list of valid trades by comparing every pair of orders in pure Python.
+    '''
+    type_id_to_name = reference_data.get_resource('typeIDToName')
+    system_id_to_security = reference_data.get_resource('systemIdToSecurity')
     ids = list(from_orders.keys())
     valid_trades = []
 
@@ -257,37 +382,9 @@ async def get_valid_trades(from_orders: dict, to_orders: dict, tax: float,
                                       destination_security in system_security
 
                         if valid_trade:
-                            new_record = {
-                                'Item ID': initial_order_type_id,
-                                'Item': type_id_to_name[initial_order_type_id]['name'],
-                                'From': {
-                                    'name': get_station_name(initial_order['station_id']),
-                                    'station_id': initial_order['station_id'],
-                                    'system_id': initial_order_system_id,
-                                    'rating': system_id_to_security[initial_order_system_id]['rating'],
-                                    'citadel': initial_order['station_id'] > 99999999
-                                },
-                                'Quantity': round_value(quantity, 0),
-                                'Buy Price': round_value(initial_order['price'], 2),
-                                'Net Costs': round_value(volume * initial_order['price'], 2),
-                                'Take To': {
-                                    'name': get_station_name(closing_order['station_id']),
-                                    'station_id': closing_order['station_id'],
-                                    'system_id': closing_order_system_id,
-                                    'rating': system_id_to_security[closing_order_system_id]['rating'],
-                                    'citadel': closing_order['station_id'] > 99999999
-                                },
-                                'Sell Price': round_value(closing_order['price'], 2),
-                                'Net Sales': round_value(volume * closing_order['price'], 2),
-                                'Gross Margin': round_value(volume * (closing_order['price'] - initial_order['price']), 2),
-                                'Sales Taxes': round_value(volume * (closing_order['price'] * tax / 100), 2),
-                                'Net Profit': profit,
-                                'Jumps': 0,
-                                'Profit per Jump': 0,
-                                'Profit Per Item': round_value(profit / volume, 2),
-                                'ROI': f"{round_value(100 * roi, 2)}%",
-                                'Total Volume (m3)': round_value(weight, 2),
-                            }
+                            new_record = create_trade_record(
+                                initial_order, closing_order, tax, volume, quantity, weight, profit, roi
+                            )
 
                             valid_trades.append(new_record)
 
@@ -299,6 +396,137 @@ async def get_valid_trades(from_orders: dict, to_orders: dict, tax: float,
 
     return valid_trades
 
+
+def get_limit(value: Any) -> Optional[int]:
+    '''
+    Returns the number of trades to keep from a limit such as 25 or '25.0'.
+    Missing, infinite and limits below 1 keep every trade.
+    '''
+    if value is None or value == '':
+        return None
+    number = float(value)
+    if not math.isfinite(number) or number < 1:
+        return None
+    return int(number)
+
+
+def get_valid_trades_vectorized(from_orders: OrderBook, to_orders: OrderBook, tax: float,
+                                min_profit: float, min_roi: float, max_budget: float, max_weight: float,
+                                system_security: list, limit: Optional[int] = None,
+                                matcher: Callable = trade_engine.match_orders) -> list:
+    '''
+    Returns a list of valid trades by matching the orders of each type ID as NumPy arrays.
+    Only the surviving pairs are materialized as trade records.
+
+    When a limit is given only the most profitable trades are kept in a bounded heap and
+    type IDs or orders whose best possible profit cannot enter the heap are skipped.
+    A limit below 1 is no limit.
+    '''
+    limit = get_limit(limit)
+    types = reference_data.get_compact_resource('typeIDToName')
+    systems = reference_data.get_compact_resource('systemIdToSecurity')
+    allowed_system_ids = systems.ids[np.isin(
+        systems.column('security_code'), systems.category_codes('security_code', system_security)
+    )]
+    valid_trades = []
+    top_trades = []
+    sequence = 0
+
+    for item_id in from_orders:
+        item_row = types.row(item_id)
+        if item_row < 0:
+            continue
+
+        item_volume = types.value_at(item_row, 'volume')
+        if math.isnan(item_volume):
+            continue
+
+        initial_orders = from_orders[item_id]
+        closing_orders = to_orders[item_id]
+        from_arrays = trade_engine.to_order_arrays(initial_orders, allowed_system_ids)
+        to_arrays = trade_engine.to_order_arrays(closing_orders, allowed_system_ids)
+
+        profit_floor = min_profit
+        if limit is not None and limit > 0 and top_trades and len(top_trades) >= limit:
+            profit_floor = max(min_profit, top_trades[0][0])
+            upper_bound = trade_engine.profit_upper_bound(from_arrays, to_arrays, item_volume, tax, max_weight)
+            if upper_bound < profit_floor:
+                continue
+
+        matches = matcher(
+            from_arrays, to_arrays, item_volume, tax, profit_floor, min_roi, max_budget, max_weight
+        )
+
+        candidates = range(len(matches['profit']))
+        if limit is not None and len(candidates) > limit:
+            # Only the best trades of this type ID could enter the heap
+            candidates = sorted(np.argsort(-matches['profit'], kind='stable')[:limit])
+
+        for idx in candidates:
+            initial_order = initial_orders[matches['from_index'][idx]]
+            closing_order = closing_orders[matches['to_index'][idx]]
+            try:
+                new_record = create_trade_record(
+                    initial_order, closing_order, tax,
+                    float(matches['volume'][idx]), float(matches['quantity'][idx]),
+                    float(matches['weight'][idx]), float(matches['profit'][idx]), float(matches['roi'][idx])
+                )
+            except Exception: # pylint: disable=broad-except
+                traceback.print_exc()
+                print(f"Error processing trade {initial_order['type_id']} from {initial_order['station_id']} to {closing_order['station_id']}")
+                continue
+
+            route = f'{initial_order["system_id"]}-{closing_order["system_id"]}'
+
+            if limit is None:
+                valid_trades.append(new_record)
+                jump_count[route] = ''
+                continue
+
+            # Ties are broken in favour of the trade found first
+            sequence += 1
+            entry = (new_record['Net Profit'], -sequence, new_record, route)
+            if len(top_trades) < limit:
+                heapq.heappush(top_trades, entry)
+            elif entry[:2] > top_trades[0][:2]:
+                heapq.heapreplace(top_trades, entry)
+
+    if limit is not None:
+        for _, _, new_record, route in sorted(top_trades, key=lambda entry: -entry[1]):
+            valid_trades.append(new_record)
+            jump_count[route] = ''
+
+    return valid_trades
+
+
+async def get_valid_trades(from_orders: OrderBook, to_orders: OrderBook, tax: float,
+                           min_profit: float, min_roi: float, max_budget: float, max_weight: float,
+                           system_security: list, matching: str = 'vectorized',
+                           limit: Optional[int] = None) -> list:
+    '''
+    Returns a list of valid trades given a set of orders.
+
+    The `matching` mode selects the engine: 'vectorized' (default), 'sweep' or 'loop'.
+    When a limit is given only the `limit` most profitable trades are returned.
+    '''
+    limit = get_limit(limit)
+    if matching == 'loop':
+        valid_trades = get_valid_trades_loop(
+            from_orders, to_orders, tax, min_profit, min_roi, max_budget, max_weight, system_security
+        )
+        if limit is not None:
+            top_indexes = heapq.nlargest(
+                limit, range(len(valid_trades)), key=lambda idx: (valid_trades[idx]['Net Profit'], -idx)
+            )
+            valid_trades = [valid_trades[idx] for idx in sorted(top_indexes)]
+        return valid_trades
+
+    matcher = trade_engine.sweep_orders if matching == 'sweep' else trade_engine.match_orders
+
+    return get_valid_trades_vectorized(
+        from_orders, to_orders, tax, min_profit, min_roi, max_budget, max_weight, system_security, limit, matcher
+    )
+
 def get_nearby_regions(universe_list:dict, region_id: int) -> list:
     '''
     Returns a list of nearby regions given a region id.
@@ -327,14 +555,17 @@ async def get(request) -> list:
     '''
     startTime = time.time()
     queries = request['queryStringParameters']
-    SALES_TAX = float(queries.get('tax', 0.075))
-    MIN_PROFIT = float(queries.get('minProfit', 500000))
-    MIN_ROI = float(queries.get('minROI', 0.04))
-    MAX_BUDGET = float(queries.get('maxBudget', float('inf')))
-    MAX_WEIGHT = float(queries.get('maxWeight', float('inf')))
-    ROUTE_SAFETY = queries.get('routeSafety', 'secure') # secure, shortest, insecure
-    SYSTEM_SECURITY = queries.get('systemSecurity', 'high_sec').split(',')
-    STRUCTURE_TYPE = queries.get('structureType', 'both') # citadel, npm, both
+    jump_count.clear()
+    refresh_routes.clear()
+    SALES_TAX = float(queries.get('tax', QUERY_DEFAULTS['tax']))
+    MIN_PROFIT = float(queries.get('minProfit', QUERY_DEFAULTS['minProfit']))
+    MIN_ROI = float(queries.get('minROI', QUERY_DEFAULTS['minROI']))
+    MAX_BUDGET = float(queries.get('maxBudget', QUERY_DEFAULTS['maxBudget']))
+    MAX_WEIGHT = float(queries.get('maxWeight', QUERY_DEFAULTS['maxWeight']))
+    ROUTE_SAFETY = queries.get('routeSafety', QUERY_DEFAULTS['routeSafety'])
+    SYSTEM_SECURITY = queries.get('systemSecurity', QUERY_DEFAULTS['systemSecurity']).split(',')
+    STRUCTURE_TYPE = queries.get('structureType', QUERY_DEFAULTS['structureType'])
+    LIMIT = get_limit(queries.get('limit'))
 
     FROM = queries['from']
     TO = queries['to']
@@ -346,27 +577,24 @@ async def get(request) -> list:
     TO = TO.replace('buy-', '').replace('sell-', '')
 
     if TO == 'nearby':
-        universe_list = requests.get(
-            'https://evetrade.s3.amazonaws.com/resources/universeList.json', timeout=30
-        ).json()
+        universe_list = reference_data.get_resource('universeList')
         TO = ','.join(map(str, get_nearby_regions(universe_list, FROM))) + "," + str(FROM)
 
-    orders = {
-        'from': await get_orders(FROM, FROM_TYPE, STRUCTURE_TYPE),
-        'to': await get_orders(TO, TO_TYPE, STRUCTURE_TYPE)
-    }
+    # Multi-location queries have many more orders per type ID so sweep sorted orders instead
+    MATCHING = 'sweep' if ',' in TO else 'vectorized'
 
     # Grab one item per station in each each (cheaper for sell orders, expensive for buy orders)
-    # Remove type Ids that do not exist in each side of the trade
-    orders = remove_mismatch_type_ids(orders['from'], orders['to'])
+    # Only type Ids that exist in each side of the trade are kept
+    orders = await get_order_books(FROM, FROM_TYPE, TO, TO_TYPE, STRUCTURE_TYPE)
     print(f"Retrieval took: {time.time() - startTime} seconds to process.")
 
-    valid_trades = await get_valid_trades(orders['from'], orders['to'], SALES_TAX, MIN_PROFIT, MIN_ROI, MAX_BUDGET, MAX_WEIGHT, SYSTEM_SECURITY)
+    valid_trades = await get_valid_trades(orders['from'], orders['to'], SALES_TAX, MIN_PROFIT, MIN_ROI, MAX_BUDGET, MAX_WEIGHT, SYSTEM_SECURITY, matching=MATCHING, limit=LIMIT)
     print(f"Valid Trades = {len(valid_trades)}")
 
     print(f"Routes = {len(jump_count.keys())}")
 
-    route_data = get_routes(ROUTE_SAFETY)
+    with startup.timed('routes'):
+        route_data = get_routes(ROUTE_SAFETY)
 
     for _, valid_trade in enumerate(valid_trades):
         system_from = valid_trade['From']['system_id']
@@ -374,18 +602,8 @@ async def get(request) -> list:
 
         valid_trade['Jumps'] = route_data[f"{system_from}-{system_to}"]
 
-        if valid_trade['Jumps'] == '':
-            print(f"Sending message for empty jumps:{system_from}-{system_to}")
-            send_message({
-                'start': system_from,
-                'end': system_to,
-            })
-        elif valid_trade['Jumps'] == -1:
-            print(f"Sending message for invalid jumps (-1):{system_from}-{system_to}")
-            send_message({
-                'start': system_from,
-                'end': system_to,
-            })
+        if valid_trade['Jumps'] == '' or valid_trade['Jumps'] == -1:
+            refresh_routes.add(f"{system_from}-{system_to}")
         else:
             round_value(valid_trade['Jumps'], 0)
 
@@ -396,12 +614,14 @@ async def get(request) -> list:
 
         valid_trade['Net Profit'] = round_value(valid_trade['Net Profit'], 2)
 
-    valid_trades = sorted(valid_trades, key=lambda x: x['Net Profit'])
+    # Every missing, invalid or stale route is sent once, in batches
+    with startup.timed('route_refresh'):
+        route_refresh.publish_routes(refresh_routes)
 
-    json_size = len(json.dumps(valid_trades).encode('utf-8'))
+    valid_trades = sorted(valid_trades, key=lambda x: x['Net Profit'])
 
+    # The payload size is logged by the serializer from the body it produces
     print(f"Truncated Valid Trades = {len(valid_trades)}")
     print(f"Full analysis took {time.time() - startTime} seconds to process.")
-    print(f"Final payload size = {json_size/1024/1024} MB")
 
     return valid_trades
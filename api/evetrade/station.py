@@ -1,26 +1,29 @@
 '''
 Station trading module and logic.
 '''
-import os
+import asyncio
 from datetime import datetime
-from elasticsearch import Elasticsearch
-import redis
-import requests
-from api.utils.helpers import round_value, remove_mismatch_type_ids\
+from api.utils import order_fetcher, reference_data, startup
+from api.utils.helpers import round_value, remove_mismatch_type_ids
+from api.utils.compact_table import CompactTable
+from api.utils.order_book import OrderBook
 
+ORDER_FIELDS = ['volume_remain', 'price', 'region_id', 'type_id']
 
+# Query parameters of a station request and their defaults, None when required
+QUERY_DEFAULTS = {
+    'station': None,
+    'tax': 0.075,
+    'fee': 0.03,
+    'margins': '0.20,0.40',
+    'min_volume': 1000,
+    'profit': 1000,
+}
 
-redis_client = redis.Redis(
-    host=os.environ['REDIS_HOST'],
-    port=int(os.environ['REDIS_PORT']),
-    password=os.environ['REDIS_PASSWORD'],
-)
 
-es_client = Elasticsearch([os.getenv('ES_HOST')])
-
-async def get_orders(location, is_buy_order) -> list:
+async def get_orders(location, is_buy_order) -> OrderBook:
     '''
-    Get all orders for a given location and order type from ES.
+    Get all orders for a given location and order type from ES grouped by type ID.
     '''
     must_clause = {
         'must': [
@@ -42,34 +45,11 @@ async def get_orders(location, is_buy_order) -> list:
         ]
     }
 
-    response = es_client.search( # pylint: disable=E1123
-        index='market_data',
-        scroll='10s',
-        size=10000,
-        _source=['volume_remain', 'price', 'region_id', 'type_id'],
-        body={
-            'query': {
-                'bool': must_clause
-            }
-        }
+    # The blocking ES calls run in a worker thread so several retrievals can overlap
+    return await asyncio.to_thread(
+        order_fetcher.fetch_orders, startup.get_es_client(), {'bool': must_clause}, ORDER_FIELDS
     )
 
-    all_hits = response['hits']['hits']
-
-    scroll_id = response['_scroll_id']
-    print(f"Retrieved {len(all_hits)} of {response['hits']['total']['value']} total hits.")
-
-    while response['hits']['total']['value'] != len(all_hits):
-        scroll_response = es_client.scroll(scroll_id=scroll_id, scroll='10s') # pylint: disable=E1123
-        all_hits = all_hits + scroll_response['hits']['hits']
-        print(f"Retrieved {len(all_hits)} of {scroll_response['hits']['total']['value']} total hits.")
-
-    all_orders = []
-    for hit in all_hits:
-        all_orders.append(hit['_source'])
-
-    return all_orders
-
 async def find_station_trades(orders, sales_tax, broker_fee, margin_limit, profit_limit):
     '''
     Find all trades that meet the given criteria.
@@ -94,16 +74,16 @@ async def find_station_trades(orders, sales_tax, broker_fee, margin_limit, profi
         ROI = (sale_price - buy_price) / buy_price
 
         if margin_limit[0] <= item_margin <= margin_limit[1] and item_profit > profit_limit:
-            item_name = type_id_to_name.get(str(item_id))
-            if item_name:
-                item_volume = redis_client.get(f"{buy_order['region_id']}-{item_id}")
+            item_row = type_id_to_name.row(item_id)
+            if item_row >= 0:
+                item_volume = startup.get_redis_client().get(f"{buy_order['region_id']}-{item_id}")
                 avg_volume = 0
                 if item_volume is not None:
                     avg_volume = item_volume.decode()
 
                 row = {
                     'Item ID': item_id,
-                    'Item': item_name['name'],
+                    'Item': type_id_to_name.value_at(item_row, 'name'),
                     'Buy Price': round_value(buy_price, 2),
                     'Sell Price': round_value(sale_price, 2),
                     'Net Profit': round_value(item_profit, 2),
@@ -121,13 +101,11 @@ async def find_station_trades(orders, sales_tax, broker_fee, margin_limit, profi
 
     return station_trades
 
-def get_type_id_mappings() -> dict:
+def get_type_id_mappings() -> CompactTable:
     '''
-    Pulls from URL and converts json to dict
+    Returns the integer keyed type ID mappings from the shared reference data cache
     '''
-    url = 'https://evetrade.s3.amazonaws.com/resources/typeIDToName.json'
-    response = requests.get(url, timeout=30)
-    return response.json()
+    return reference_data.get_compact_resource('typeIDToName')
 
 
 async def get(event: dict) -> list:
@@ -138,14 +116,17 @@ async def get(event: dict) -> list:
     queries = event['queryStringParameters']
 
     STATION = queries['station']
-    SALES_TAX = float(queries.get('tax', 0.075))
-    BROKER_FEE = float(queries.get('fee', 0.03))
-    MARGINS = list(map(float, queries.get('margins', '0.20,0.40').split(',')))
-    MIN_VOLUME = int(queries.get('min_volume', 1000))
-    PROFIT_LIMIT = int(queries.get('profit', 1000))
-
-    buy_orders = await get_orders(STATION, True)
-    sell_orders = await get_orders(STATION, False)
+    SALES_TAX = float(queries.get('tax', QUERY_DEFAULTS['tax']))
+    BROKER_FEE = float(queries.get('fee', QUERY_DEFAULTS['fee']))
+    MARGINS = list(map(float, queries.get('margins', QUERY_DEFAULTS['margins']).split(',')))
+    MIN_VOLUME = int(queries.get('min_volume', QUERY_DEFAULTS['min_volume']))
+    PROFIT_LIMIT = int(queries.get('profit', QUERY_DEFAULTS['profit']))
+
+    # Retrieve buy and sell orders concurrently
+    buy_orders, sell_orders = await asyncio.gather(
+        get_orders(STATION, True),
+        get_orders(STATION, False)
+    )
     orders = remove_mismatch_type_ids(buy_orders, sell_orders)
 
     orders = await find_station_trades(orders, SALES_TAX, BROKER_FEE, MARGINS, PROFIT_LIMIT)
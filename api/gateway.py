@@ -2,34 +2,85 @@
 Gateway Lambda function for the evetrade.space API which validates requests
 and routes them to the appropriate modules.
 '''
-import os
-import json
 import asyncio
+import os
+import threading
+import time
 from typing import Any, Dict, List, Union, Literal
 
-import redis
+from api.utils import rate_limit, result_cache, serializer, startup
+from api.utils.ip_list import IPList
+
+# Routes that can respond with newline delimited JSON
+STREAMING_PATHS = ['/hauling', '/station']
+
+# Gateway settings stored in Redis, loaded on first use
+SETTING_KEYS = ['IP_WHITE_LIST', 'IP_BAN_LIST', 'RATE_LIMIT_COUNT', 'RATE_LIMIT_INTERVAL']
 
+# Seconds after which the settings are reloaded from Redis in the background
+SETTINGS_TTL = int(os.getenv('GATEWAY_SETTINGS_TTL', '30'))
 
-redis_client = redis.Redis(
-    host=os.environ['REDIS_HOST'],
-    port=int(os.environ['REDIS_PORT']),
-    password=os.environ['REDIS_PASSWORD'],
-)
+settings: Dict[str, Any] = {}
+settings_state = {'loaded_at': 0.0, 'refreshing': False}
+settings_lock = threading.Lock()
 
-def decode_env_redis(env_var: str) -> List[str]:
+def decode_env_redis(value: Union[bytes, None]) -> str:
     '''
     Decode a Redis environment variable.
     '''
     try: 
-        return redis_client.get(env_var).decode(encoding='utf-8')
-    except:
+        return value.decode(encoding='utf-8')
+    except AttributeError:
         return ''
 
-IP_WHITE_LIST: List[str] = decode_env_redis('IP_WHITE_LIST').replace('\n', '').split(',')
-IP_BAN_LIST: List[str] = decode_env_redis('IP_BAN_LIST').replace('\n', '').split(',')
+def load_settings() -> Dict[str, Any]:
+    '''
+    Load the IP lists and rate limit settings from Redis in a single round trip.
+    Keeps the current settings, or the defaults if there are none, when Redis fails.
+    '''
+    with startup.timed('settings'):
+        try:
+            values = startup.get_redis_client().mget(SETTING_KEYS)
+        except Exception as error: # pylint: disable=broad-except
+            print(f"Unable to load gateway settings: {error}")
+            if settings:
+                return dict(settings)
+            values = [None] * len(SETTING_KEYS)
+
+    ip_white_list, ip_ban_list, rate_limit_count, rate_limit_interval = map(decode_env_redis, values)
+
+    return {
+        'IP_WHITE_LIST': IPList.parse(ip_white_list),
+        'IP_BAN_LIST': IPList.parse(ip_ban_list),
+        'RATE_LIMIT_COUNT': int(rate_limit_count or 5),
+        'RATE_LIMIT_INTERVAL': int(rate_limit_interval or 60),
+    }
 
-RATE_LIMIT_COUNT = int(decode_env_redis('RATE_LIMIT_COUNT') or 5)
-RATE_LIMIT_INTERVAL = int(decode_env_redis('RATE_LIMIT_INTERVAL') or 60)
+def refresh_settings() -> None:
+    '''
+    Reload the settings from Redis and swap them in.
+    '''
+    try:
+        settings.update(load_settings())
+    finally:
+        settings_state['loaded_at'] = time.monotonic()
+        settings_state['refreshing'] = False
+
+def get_settings() -> Dict[str, Any]:
+    '''
+    Returns the gateway settings, loading them on first use.
+    Once they are older than SETTINGS_TTL they are refreshed in a background
+    thread while the current settings keep being served.
+    '''
+    if not settings:
+        settings_state['refreshing'] = True
+        refresh_settings()
+    elif time.monotonic() - settings_state['loaded_at'] >= SETTINGS_TTL:
+        with settings_lock:
+            if not settings_state['refreshing']:
+                settings_state['refreshing'] = True
+                threading.Thread(target=refresh_settings, daemon=True).start()
+    return settings
 
 # Def ENUM for HTTP status codes
 class HTTPStatus:
@@ -51,10 +102,10 @@ def check_authorization(headers: dict) -> int:
     if headers:
         if 'x-forwarded-for' in headers:
             ip_address = headers['x-forwarded-for']
-            if ip_address in IP_WHITE_LIST:
+            if ip_address in get_settings()['IP_WHITE_LIST']:
                 print(f"White Listed IP: {ip_address}")
                 return HTTPStatus.WHITELISTED
-            elif ip_address in IP_BAN_LIST:
+            elif ip_address in get_settings()['IP_BAN_LIST']:
                 print(f"Banned IP: {ip_address}")
                 return HTTPStatus.UNAUTHORIZED
 
@@ -82,54 +133,32 @@ def check_rate_limit(headers) -> Union[
     '''
     Check if the request exceeds the rate limit.
     '''
+    RATE_LIMIT_COUNT = get_settings()['RATE_LIMIT_COUNT']
+    RATE_LIMIT_INTERVAL = get_settings()['RATE_LIMIT_INTERVAL']
+
     receiving_ip = headers['x-forwarded-for']
-    rate_limit_key = f'rate_limit:{receiving_ip}'
-
-    # Get the current rate limit count for the IP address
-    current_count = redis_client.incr(rate_limit_key)
-   
-    # If the count is 1, set the expiration time for the key
-    if current_count == 1:
-        redis_client.expire(rate_limit_key, RATE_LIMIT_INTERVAL)
-
-    # Check if the current count exceeds the rate limit
-    print(f"{rate_limit_key} - Current Count: {current_count} of {RATE_LIMIT_COUNT}.")
-
-    concurrent_limit_key = f'concurrent_count_limit:{receiving_ip}'
-    concurrent_count = int( redis_client.get(concurrent_limit_key) or 0 )
-
-    # Concurrent Rate Limit (if numerous rate limit hit in short time)
-    if current_count > RATE_LIMIT_COUNT:
-        concurrent_count = redis_client.incr(concurrent_limit_key)
-        print(f"{concurrent_limit_key} - Current Count: {concurrent_count} of {RATE_LIMIT_COUNT * 2} today.")
-
-        if concurrent_count == 1:
-            redis_client.expire(concurrent_limit_key, RATE_LIMIT_INTERVAL * 60 * 24)
-
-        if concurrent_count == 10:
-            redis_client.expire(concurrent_limit_key, RATE_LIMIT_INTERVAL * 60 * 24 * 7)
-            return HTTPStatus.FORBIDDEN
-    
-    daily_count_key = f'daily_rate_limit:{receiving_ip}'
-    daily_count = redis_client.incr(daily_count_key)
-    if daily_count == 1:
-        redis_client.expire(daily_count_key, RATE_LIMIT_INTERVAL * 60 * 24 * 1)
-    print(f"{daily_count_key} - Current Count: {current_count} of {RATE_LIMIT_COUNT*RATE_LIMIT_INTERVAL}.")
-
-    # Daily Rate Limit
-    if daily_count > RATE_LIMIT_COUNT * RATE_LIMIT_INTERVAL:
-        redis_client.expire(concurrent_limit_key, RATE_LIMIT_INTERVAL * 60 * 24 * 1)
-        return HTTPStatus.TOO_MANY_REQUESTS
-
-    if concurrent_count >= 10:
-        print(f"{concurrent_limit_key} - Concurrent Rate Limit: {concurrent_count} of {RATE_LIMIT_COUNT*2} today.")
-        return HTTPStatus.FORBIDDEN
-        
-    # Standard Rate Limit in short time
-    if current_count > RATE_LIMIT_COUNT:
-        return HTTPStatus.TOO_MANY_REQUESTS
-    
-    return HTTPStatus.OK
+
+    # Update the rate limit, concurrent and daily counters in a single round trip,
+    # unless the IP is already throttled in this container
+    result = rate_limit.check(startup.get_redis_client(), receiving_ip, RATE_LIMIT_COUNT, RATE_LIMIT_INTERVAL)
+
+    if result.local:
+        print(f"rate_limit:{receiving_ip} - Rejected locally with {result.status}.")
+        return result.status
+
+    print(f"rate_limit:{receiving_ip} - Current Count: {result.current_count} of {RATE_LIMIT_COUNT}.")
+    print(f"concurrent_count_limit:{receiving_ip} - Current Count: {result.concurrent_count} of {rate_limit.STRIKE_LIMIT} today.")
+    print(f"daily_rate_limit:{receiving_ip} - Current Count: {result.daily_count} of {RATE_LIMIT_COUNT*RATE_LIMIT_INTERVAL}.")
+
+    return result.status
+
+def run_cached(request: Dict[str, Any], route) -> Any:
+    '''
+    Run a route, serving its result from the cache when an identical request was computed recently.
+    '''
+    version = result_cache.get_market_version(startup.get_es_client())
+    key = result_cache.get_key(request['rawPath'], request['queryStringParameters'], route.QUERY_DEFAULTS, version)
+    return result_cache.get_or_compute(startup.get_redis_client(), key, lambda: asyncio.run(route.get(request)))
 
 def gateway (
         request: Dict[str, Any]
@@ -137,7 +166,8 @@ def gateway (
     '''
     Gateway function that routes requests to the appropriate downstream method after validating request
     '''
-    authorization = check_authorization(request['headers'])
+    with startup.timed('authorization'):
+        authorization = check_authorization(request['headers'])
 
     if authorization == HTTPStatus.UNAUTHORIZED:
         return {
@@ -146,7 +176,8 @@ def gateway (
             'ip': request['headers']['x-forwarded-for']
         }
 
-    rate_limit_exceeded = HTTPStatus.OK if authorization == HTTPStatus.WHITELISTED else check_rate_limit(request['headers'])
+    with startup.timed('rate_limit'):
+        rate_limit_exceeded = HTTPStatus.OK if authorization == HTTPStatus.WHITELISTED else check_rate_limit(request['headers'])
 
     if rate_limit_exceeded == 429:
         print('Rate Limit Exceeded: ' + request['headers']['x-forwarded-for'])
@@ -167,41 +198,63 @@ def gateway (
     path = request['rawPath']
 
     if path == '/hauling':
-        import api.evetrade.hauling as hauling # pylint: disable=import-outside-toplevel
-        return asyncio.run(hauling.get(request))
+        with startup.timed('import'):
+            import api.evetrade.hauling as hauling # pylint: disable=import-outside-toplevel
+        with startup.timed('route'):
+            return run_cached(request, hauling)
     elif path == '/station':
-        import api.evetrade.station as station # pylint: disable=import-outside-toplevel
-        return asyncio.run(station.get(request))
+        with startup.timed('import'):
+            import api.evetrade.station as station # pylint: disable=import-outside-toplevel
+        with startup.timed('route'):
+            return run_cached(request, station)
     elif path == '/orders':
-        import api.evetrade.orders as orders # pylint: disable=import-outside-toplevel
-        return asyncio.run(orders.get(request))
+        with startup.timed('import'):
+            import api.evetrade.orders as orders # pylint: disable=import-outside-toplevel
+        with startup.timed('route'):
+            return asyncio.run(orders.get(request))
     else:
         return {
             'statusCode': HTTPStatus.NOT_FOUND,
             'body': 'Not found.'
         }
 
+def load_reference_data() -> None:
+    '''
+    Load the reference data used by the hauling and station routes.
+    '''
+    from api.utils import reference_data # pylint: disable=import-outside-toplevel
+
+    with startup.timed('reference_data'):
+        for name in ['typeIDToName', 'stationIdToName', 'systemIdToSecurity', 'structureInfo']:
+            reference_data.get_compact_resource(name)
+
 def lambda_handler(
     event: Dict[str, Any],
     context: Any # pylint: disable=unused-argument
-) -> str:
+) -> Dict[str, Any]:
     """
     AWS Lambda function that routes incoming requests to the appropriate
     downstream Lambda function based on the rawPath field of the event.
     """
     print(event)
 
-    # TODO implement streaming responses when released for python
+    # Python Lambda functions cannot stream responses, so large lists are
+    # compressed and can be sent as NDJSON instead
     response = gateway(event)
-    
-    MB_MAX_SIZE = 5 * 1024 * 1024
-    print(f'Original Size: {len(json.dumps(response).encode("utf-8")) / 1024 / 1024} MB')
-    
-    while len(json.dumps(response).encode("utf-8")) > MB_MAX_SIZE:
-        # If large remove last 10% of items
-        response = response[:-int(len(response)/10)] # type: ignore
-    
-    
-    print(f'New Size: {len(json.dumps(response).encode("utf-8")) / 1024 / 1024} MB')
-    
-    return json.dumps(response)
+
+    headers = {key.lower(): value for key, value in (event.get('headers') or {}).items()}
+
+    # Routes returning large lists can be requested as newline delimited JSON
+    content_type = serializer.JSON
+    if event.get('rawPath') in STREAMING_PATHS and serializer.NDJSON in headers.get('accept', ''):
+        content_type = serializer.NDJSON
+
+    with startup.timed('serialize'):
+        # Items past the size limit are dropped from the end of the response
+        encoded = serializer.encode_response(response, headers.get('accept-encoding', ''), content_type)
+
+    startup.report(event.get('rawPath'))
+
+    return encoded
+
+startup.prewarm(get_settings, load_reference_data)
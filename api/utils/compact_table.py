@@ -0,0 +1,204 @@
+'''
+Compact, integer keyed tables for reference data.
+
+A table is a single buffer that can be memory mapped and read without parsing:
+
+    magic (8 bytes) | header length (uint32) | JSON header | 8 byte aligned column blocks
+
+Row keys are stored sorted as int64 so lookups are a binary search on integers.
+Columns are float64 or int64 arrays, categorical strings stored as int16 codes or
+strings stored as int64 offsets into a UTF-8 blob. The encoder in
+event_driven_lambdas/synchronize_universe_resources.py writes the same format.
+'''
+import json
+import struct
+from typing import Any, Dict, Iterable, List, Tuple
+
+import numpy as np
+
+MAGIC = b'EVTRCT01'
+HEADER_LENGTH = struct.Struct('<I')
+
+# Columns compiled for each published resource as (column, field, kind).
+# A field of None uses the value itself rather than a key of the value.
+COMPACT_COLUMNS: Dict[str, List[Tuple[str, Any, str]]] = {
+    'typeIDToName': [('name', 'name', 'str'), ('volume', 'volume', 'float')],
+    'stationIdToName': [('name', None, 'str')],
+    'systemIdToSecurity': [('security_code', 'security_code', 'category'), ('rating', 'rating', 'float')],
+    'structureInfo': [('name', 'name', 'str')],
+}
+
+
+def align(size: int) -> int:
+    '''
+    Round a size up to the next multiple of 8 bytes.
+    '''
+    return (size + 7) & ~7
+
+
+def block_offsets(header_end: int, sizes: List[int]) -> List[int]:
+    '''
+    Returns the 8 byte aligned offset of each block following the header.
+    '''
+    offsets = []
+    position = header_end
+    for size in sizes:
+        position = align(position)
+        offsets.append(position)
+        position += size
+    return offsets
+
+
+def encode_table(mapping: dict, columns: List[Tuple[str, Any, str]]) -> bytes:
+    '''
+    Encode a mapping of stringified integer IDs into the compact table format.
+    '''
+    items = sorted((int(key), value) for key, value in mapping.items())
+    blocks = []
+
+    def add_block(block: bytes) -> int:
+        blocks.append(block)
+        return len(blocks) - 1
+
+    id_block = add_block(struct.pack(f'<{len(items)}q', *[key for key, _ in items]))
+    header = {'count': len(items), 'columns': {'id': {'kind': 'int', 'block': id_block}}}
+
+    for column, field, kind in columns:
+        values = [value if field is None else (value.get(field) if isinstance(value, dict) else None)
+                  for _, value in items]
+        spec = {'kind': kind}
+
+        if kind == 'float':
+            spec['block'] = add_block(struct.pack(
+                f'<{len(values)}d', *[float('nan') if value is None else float(value) for value in values]
+            ))
+        elif kind == 'category':
+            spec['categories'] = sorted({str(value) for value in values if value is not None})
+            codes = {category: code for code, category in enumerate(spec['categories'])}
+            spec['block'] = add_block(struct.pack(
+                f'<{len(values)}h', *[-1 if value is None else codes[str(value)] for value in values]
+            ))
+        else:
+            encoded = [b'' if value is None else str(value).encode('utf-8') for value in values]
+            offsets = [0]
+            for value in encoded:
+                offsets.append(offsets[-1] + len(value))
+            spec['block'] = add_block(struct.pack(f'<{len(offsets)}q', *offsets))
+            spec['blob_block'] = add_block(b''.join(encoded))
+
+        header['columns'][column] = spec
+
+    header['blocks'] = [len(block) for block in blocks]
+    encoded_header = json.dumps(header).encode('utf-8')
+    header_end = len(MAGIC) + HEADER_LENGTH.size + len(encoded_header)
+
+    parts = [MAGIC, HEADER_LENGTH.pack(len(encoded_header)), encoded_header]
+    position = header_end
+    for offset, block in zip(block_offsets(header_end, header['blocks']), blocks):
+        parts.append(b'\0' * (offset - position))
+        parts.append(block)
+        position = offset + len(block)
+
+    return b''.join(parts)
+
+
+class CompactTable:
+    '''
+    Read-only view over an encoded table, keyed by integer ID.
+    '''
+    DTYPES = {'int': '<i8', 'float': '<f8', 'category': '<i2', 'str': '<i8'}
+
+    def __init__(self, buffer):
+        if bytes(buffer[:len(MAGIC)]) != MAGIC:
+            raise ValueError('Not a compact reference table.')
+
+        header_size = len(MAGIC) + HEADER_LENGTH.size
+        (header_length,) = HEADER_LENGTH.unpack_from(buffer, len(MAGIC))
+        header = json.loads(bytes(buffer[header_size:header_size + header_length]))
+        offsets = block_offsets(header_size + header_length, header['blocks'])
+
+        self.buffer = buffer
+        self.count = header['count']
+        self.specs = header['columns']
+        self.columns = {}
+        self.blobs = {}
+
+        for column, spec in self.specs.items():
+            count = self.count + 1 if spec['kind'] == 'str' else self.count
+            self.columns[column] = np.frombuffer(
+                buffer, dtype=self.DTYPES[spec['kind']], count=count, offset=offsets[spec['block']]
+            )
+            if spec['kind'] == 'str':
+                blob_offset = offsets[spec['blob_block']]
+                blob_size = header['blocks'][spec['blob_block']]
+                self.blobs[column] = memoryview(buffer)[blob_offset:blob_offset + blob_size]
+
+        self.ids = self.columns['id']
+
+    @classmethod
+    def from_mapping(cls, mapping: dict, columns: List[Tuple[str, Any, str]]) -> 'CompactTable':
+        '''
+        Build a table in memory from a parsed JSON resource.
+        '''
+        return cls(encode_table(mapping, columns))
+
+    def row(self, key: int) -> int:
+        '''
+        Returns the row of an ID, or -1 if it is not in the table.
+        '''
+        idx = int(np.searchsorted(self.ids, key))
+        if idx < self.count and self.ids[idx] == key:
+            return idx
+        return -1
+
+    def rows(self, keys: np.ndarray) -> np.ndarray:
+        '''
+        Returns the rows of an array of IDs, with -1 for IDs that are not in the table.
+        '''
+        idx = np.searchsorted(self.ids, keys)
+        found = idx < self.count
+        found[found] = self.ids[idx[found]] == np.asarray(keys)[found]
+        return np.where(found, idx, -1)
+
+    def value_at(self, row: int, column: str) -> Any:
+        '''
+        Returns the value of a column at a given row.
+        '''
+        spec = self.specs[column]
+        values = self.columns[column]
+
+        if spec['kind'] == 'str':
+            return bytes(self.blobs[column][values[row]:values[row + 1]]).decode('utf-8')
+        if spec['kind'] == 'category':
+            return spec['categories'][values[row]] if values[row] >= 0 else None
+        if spec['kind'] == 'float':
+            return float(values[row])
+        return int(values[row])
+
+    def value(self, key: int, column: str) -> Any:
+        '''
+        Returns the value of a column for an ID, raising KeyError if the ID is missing.
+        '''
+        row = self.row(key)
+        if row < 0:
+            raise KeyError(key)
+        return self.value_at(row, column)
+
+    def category_codes(self, column: str, categories: Iterable[str]) -> np.ndarray:
+        '''
+        Returns the codes of the given categories of a categorical column.
+        '''
+        known = self.specs[column]['categories']
+        return np.array([known.index(category) for category in categories if category in known], dtype=np.int16)
+
+    def column(self, column: str) -> np.ndarray:
+        '''
+        Returns the raw array of a column.
+        '''
+        return self.columns[column]
+
+    def __contains__(self, key: int) -> bool:
+        return self.row(key) >= 0
+
+    def __len__(self) -> int:
+        return self.count
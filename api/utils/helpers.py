@@ -1,6 +1,7 @@
 '''
 Helper functions for the project
 '''
+from api.utils.order_book import OrderBook
 
 def round_value(value: float, amount: int) -> str:
     '''
@@ -16,37 +17,18 @@ def round_value(value: float, amount: int) -> str:
         return f"{rounded_value:,.{amount}f}"
 
 
-def remove_mismatch_type_ids(list_one: list, list_two: list) -> dict:
+def remove_mismatch_type_ids(book_one: OrderBook, book_two: OrderBook) -> dict:
     '''
-    Remove all type IDs that are not in both lists.
+    Remove all type IDs that are not in both order books.
     '''
-    from_orders = {}
-    to_orders = {}
-    
-    for order in list_one:
-        if order['type_id'] not in from_orders:
-            from_orders[order['type_id']] = []
-        from_orders[order['type_id']].append(order)
-        
-    for order in list_two:
-        if order['type_id'] not in to_orders:
-            to_orders[order['type_id']] = []
-        to_orders[order['type_id']].append(order)
-    
-    from_ids = list(from_orders.keys())
-    to_ids = list(to_orders.keys())
-    
-    for item_id in from_ids:
-        if item_id not in to_orders:
-            del from_orders[item_id]
-            
-    for item_id in to_ids:
-        if item_id not in from_orders:
-            del to_orders[item_id]
+    shared_ids = book_one.keys() & book_two.keys()
+
+    book_one.retain(shared_ids)
+    book_two.retain(shared_ids)
     
-    print(f"After: Buy ID Count = {len(from_orders)} and Sell ID Count = {len(to_orders)}") # pylint: disable=logging-fstring-interpolation
+    print(f"After: Buy ID Count = {len(book_one)} and Sell ID Count = {len(book_two)}") # pylint: disable=logging-fstring-interpolation
     
     return {
-        'from': from_orders,
-        'to': to_orders
-    }
\ No newline at end of file
+        'from': book_one,
+        'to': book_two
+    }
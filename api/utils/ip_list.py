@@ -0,0 +1,81 @@
+'''
+Constant time matching of IP addresses against lists of addresses and CIDR ranges.
+'''
+import ipaddress
+from typing import Dict, Iterable, Set, Tuple
+
+
+class IPList:
+    '''
+    Set of IP addresses and CIDR ranges such as '10.0.0.1' or '10.0.0.0/8'.
+
+    Ranges are stored as integer network addresses grouped by version and prefix
+    length, so a lookup costs one set probe per distinct prefix length in the list.
+    Entries that are not valid addresses are matched as exact strings.
+    '''
+    __slots__ = ('addresses', 'networks', 'others')
+
+    def __init__(self, entries: Iterable[str] = ()):
+        self.addresses: Set[Tuple[int, int]] = set()
+        self.networks: Dict[Tuple[int, int], Set[int]] = {}
+        self.others: Set[str] = set()
+
+        for entry in entries:
+            self.add(entry)
+
+    @classmethod
+    def parse(cls, value: str) -> 'IPList':
+        '''
+        Build a list from a comma separated string as stored in Redis.
+        '''
+        return cls(value.replace('\n', '').split(','))
+
+    def add(self, entry: str) -> None:
+        '''
+        Add an address or CIDR range to the list.
+        '''
+        entry = entry.strip()
+        if not entry:
+            return
+
+        try:
+            if '/' in entry:
+                network = ipaddress.ip_network(entry, strict=False)
+                if network.prefixlen < network.max_prefixlen:
+                    key = (network.version, network.prefixlen)
+                    self.networks.setdefault(key, set()).add(int(network.network_address))
+                    return
+                address = network.network_address
+            else:
+                address = ipaddress.ip_address(entry)
+        except ValueError:
+            self.others.add(entry)
+            return
+
+        self.addresses.add((address.version, int(address)))
+
+    def __contains__(self, value: str) -> bool:
+        if not value:
+            return False
+
+        value = value.strip()
+        try:
+            address = ipaddress.ip_address(value)
+        except ValueError:
+            return value in self.others
+
+        number = int(address)
+        if (address.version, number) in self.addresses:
+            return True
+
+        for (version, prefix_length), network_addresses in self.networks.items():
+            if version != address.version:
+                continue
+            host_bits = address.max_prefixlen - prefix_length
+            if (number >> host_bits) << host_bits in network_addresses:
+                return True
+
+        return False
+
+    def __len__(self) -> int:
+        return len(self.addresses) + len(self.others) + sum(len(networks) for networks in self.networks.values())
@@ -0,0 +1,56 @@
+'''
+Bounded in-process cache kept for the life of a warm container.
+'''
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+class LRUCache:
+    '''
+    Cache holding at most `max_size` entries for up to `ttl` seconds each.
+    The least recently used entry is evicted first once the cache is full.
+    '''
+    __slots__ = ('max_size', 'ttl', 'entries')
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries: OrderedDict = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        '''
+        Returns the value of a key, or the default if it is missing or expired.
+        '''
+        entry = self.entries.get(key)
+        if entry is None:
+            return default
+
+        value, expires_at = entry
+        if time.monotonic() >= expires_at:
+            del self.entries[key]
+            return default
+
+        self.entries.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        '''
+        Store a value, evicting the least recently used entries beyond the maximum size.
+        '''
+        self.entries[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def clear(self) -> None:
+        '''
+        Remove every entry.
+        '''
+        self.entries.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, self) is not self
+
+    def __len__(self) -> int:
+        return len(self.entries)
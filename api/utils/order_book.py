@@ -0,0 +1,172 @@
+'''
+Compact order containers grouped by type ID.
+'''
+import json
+import struct
+from array import array
+from typing import Dict, Iterable, Iterator, List
+
+import numpy as np
+
+# Array typecode used to store each order field
+COLUMN_TYPES = {
+    'price': 'd',
+    'volume_remain': 'q',
+    'station_id': 'q',
+    'system_id': 'q',
+    'region_id': 'q',
+}
+
+# Length of the JSON header at the start of an encoded order book
+HEADER_LENGTH = struct.Struct('<I')
+
+NUMPY_TYPES = {
+    'd': np.float64,
+    'q': np.int64,
+}
+
+
+class TypeOrders:
+    '''
+    Orders of a single type ID stored as one typed array per field.
+    '''
+    __slots__ = ('type_id', 'columns')
+
+    def __init__(self, type_id: int, fields: Iterable[str]):
+        self.type_id = type_id
+        self.columns = {field: array(COLUMN_TYPES[field]) for field in fields}
+
+    def append(self, source: dict) -> None:
+        '''
+        Append the fields of an order document to the columns.
+        '''
+        for field, column in self.columns.items():
+            column.append(source[field])
+
+    def column(self, field: str) -> np.ndarray:
+        '''
+        Returns a zero-copy NumPy view of a column.
+        '''
+        column = self.columns[field]
+        return np.frombuffer(column, dtype=NUMPY_TYPES[column.typecode])
+
+    def __len__(self) -> int:
+        return len(next(iter(self.columns.values())))
+
+    def __getitem__(self, idx: int) -> dict:
+        '''
+        Materializes a single order as a dictionary.
+        '''
+        order = {'type_id': self.type_id}
+        for field, column in self.columns.items():
+            order[field] = column[idx]
+        return order
+
+    def __iter__(self) -> Iterator[dict]:
+        for idx in range(len(self)):
+            yield self[idx]
+
+
+class OrderBook:
+    '''
+    Orders grouped by type ID, built in a single pass over Elasticsearch hits.
+    '''
+    __slots__ = ('fields', 'types')
+
+    def __init__(self, fields: Iterable[str]):
+        self.fields: List[str] = [field for field in fields if field != 'type_id']
+        self.types: Dict[int, TypeOrders] = {}
+
+    @classmethod
+    def from_hits(cls, hits: Iterable[dict], fields: Iterable[str]) -> 'OrderBook':
+        '''
+        Build an order book from Elasticsearch hits.
+        '''
+        book = cls(fields)
+        book.extend(hits)
+        return book
+
+    def extend(self, hits: Iterable[dict]) -> None:
+        '''
+        Add the `_source` of each Elasticsearch hit to the book.
+        '''
+        for hit in hits:
+            self.add(hit['_source'])
+
+    def add(self, source: dict) -> None:
+        '''
+        Add a single order document to the book.
+        '''
+        type_id = source['type_id']
+        orders = self.types.get(type_id)
+        if orders is None:
+            orders = self.types[type_id] = TypeOrders(type_id, self.fields)
+        orders.append(source)
+
+    def to_bytes(self) -> bytes:
+        '''
+        Encode the book as a JSON header of type IDs and order counts followed by
+        each field's column, concatenated across all type IDs.
+        '''
+        header = {
+            'fields': self.fields,
+            'types': [[type_id, len(orders)] for type_id, orders in self.types.items()],
+        }
+        encoded_header = json.dumps(header).encode('utf-8')
+        parts = [HEADER_LENGTH.pack(len(encoded_header)), encoded_header]
+        for field in self.fields:
+            for orders in self.types.values():
+                parts.append(orders.columns[field].tobytes())
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, payload: bytes) -> 'OrderBook':
+        '''
+        Decode a book encoded with `to_bytes`.
+        '''
+        (header_length,) = HEADER_LENGTH.unpack_from(payload, 0)
+        header = json.loads(payload[HEADER_LENGTH.size:HEADER_LENGTH.size + header_length])
+        book = cls(header['fields'])
+        for type_id, _ in header['types']:
+            book.types[type_id] = TypeOrders(type_id, book.fields)
+
+        position = HEADER_LENGTH.size + header_length
+        for field in book.fields:
+            for type_id, count in header['types']:
+                column = book.types[type_id].columns[field]
+                size = count * column.itemsize
+                column.frombytes(payload[position:position + size])
+                position += size
+        return book
+
+    def retain(self, type_ids: Iterable[int]) -> None:
+        '''
+        Drop every type ID that is not in the given collection.
+        '''
+        keep = set(type_ids)
+        for type_id in [type_id for type_id in self.types if type_id not in keep]:
+            del self.types[type_id]
+
+    def order_count(self) -> int:
+        '''
+        Returns the number of orders across all type IDs.
+        '''
+        return sum(len(orders) for orders in self.types.values())
+
+    def keys(self):
+        '''
+        Returns the type IDs in the book.
+        '''
+        return self.types.keys()
+
+    def __len__(self) -> int:
+        return len(self.types)
+
+    def __contains__(self, type_id: int) -> bool:
+        return type_id in self.types
+
+    def __getitem__(self, type_id: int) -> TypeOrders:
+        return self.types[type_id]
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.types)
@@ -0,0 +1,135 @@
+'''
+Paginated retrieval of market orders from Elasticsearch.
+'''
+import queue
+import threading
+from typing import Iterable, Iterator, List
+
+from elasticsearch import Elasticsearch
+
+from api.utils.order_book import OrderBook
+
+PAGE_SIZE = 10000
+KEEP_ALIVE = '1m'
+
+# Number of pages fetched ahead of the consumer
+PREFETCH_DEPTH = 1
+
+# Stable, unique sort key required to page with search_after
+ORDER_SORT = [{'order_id': 'asc'}]
+
+
+def iterate_order_pages(es_client: Elasticsearch, query: dict, source: List[str],
+                        index: str = 'market_data', page_size: int = PAGE_SIZE) -> Iterator[List[dict]]:
+    '''
+    Yields pages of hits for a query using a point in time and search_after.
+    The point in time is always released once iteration stops.
+    '''
+    pit_id = es_client.open_point_in_time(index=index, keep_alive=KEEP_ALIVE)['id']
+
+    try:
+        search_after = None
+        while True:
+            body = {
+                'size': page_size,
+                '_source': source,
+                'query': query,
+                'pit': {'id': pit_id, 'keep_alive': KEEP_ALIVE},
+                'sort': ORDER_SORT,
+                'track_total_hits': False,
+            }
+            if search_after is not None:
+                body['search_after'] = search_after
+
+            response = es_client.search(body=body) # pylint: disable=E1123
+            pit_id = response.get('pit_id', pit_id)
+            hits = response['hits']['hits']
+
+            if hits:
+                yield hits
+
+            if len(hits) < page_size:
+                break
+
+            search_after = hits[-1]['sort']
+    finally:
+        es_client.close_point_in_time(body={'id': pit_id})
+
+
+def prefetch_pages(pages: Iterator[List[dict]], depth: int = PREFETCH_DEPTH) -> Iterator[List[dict]]:
+    '''
+    Iterate pages while up to `depth` following pages are fetched in a background thread.
+    Errors raised while fetching are re-raised to the consumer.
+    '''
+    buffer = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def offer(item: tuple) -> bool:
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce() -> None:
+        try:
+            for page in pages:
+                if not offer(('page', page)):
+                    break
+        except Exception as error: # pylint: disable=broad-except
+            offer(('error', error))
+        finally:
+            # Release the point in time if the consumer stopped early
+            if hasattr(pages, 'close'):
+                pages.close()
+            offer(('done', None))
+
+    worker = threading.Thread(target=produce, daemon=True)
+    worker.start()
+
+    try:
+        while True:
+            kind, value = buffer.get()
+            if kind == 'page':
+                yield value
+            elif kind == 'error':
+                raise value
+            else:
+                break
+    finally:
+        stop.set()
+        worker.join()
+
+
+def stream_order_pages(es_client: Elasticsearch, query: dict, source: List[str],
+                       index: str = 'market_data', page_size: int = PAGE_SIZE) -> Iterator[List[dict]]:
+    '''
+    Yields pages of hits as they arrive, prefetching the next page in the background.
+    '''
+    yield from prefetch_pages(iterate_order_pages(es_client, query, source, index, page_size))
+
+
+def build_order_book(pages: Iterable[List[dict]], fields: Iterable[str]) -> OrderBook:
+    '''
+    Group streamed pages of hits into an order book as they arrive.
+    '''
+    book = OrderBook(fields)
+    retrieved = 0
+
+    for hits in pages:
+        book.extend(hits)
+        retrieved += len(hits)
+        print(f"Retrieved {retrieved} hits.")
+
+    return book
+
+
+def fetch_orders(es_client: Elasticsearch, query: dict, fields: Iterable[str],
+                 index: str = 'market_data', page_size: int = PAGE_SIZE) -> OrderBook:
+    '''
+    Retrieve all orders matching a query into an order book, one page at a time.
+    '''
+    fields = list(fields)
+    return build_order_book(stream_order_pages(es_client, query, fields, index, page_size), fields)
@@ -0,0 +1,198 @@
+'''
+Redis backed rate limiting of requests by IP address.
+
+The per interval, concurrent strike and daily counters are updated by a single
+server side script, so each request costs one atomic round trip to Redis.
+
+Set LOCAL_RATE_LIMIT=true to also keep a denylist inside the warm container.
+IPs that Redis throttled or forbade are then rejected locally until the current
+window ends, and the requests rejected locally are added to the Redis counters
+in one batch with the next check that reaches Redis. The request that would
+reach the strike limit always reaches Redis, so the IP is forbidden on time.
+'''
+import os
+import time
+from typing import Dict, NamedTuple, Union
+
+# Number of times the per interval limit may be exceeded before the IP is forbidden
+STRIKE_LIMIT = 10
+
+LOCAL_RATE_LIMIT = os.getenv('LOCAL_RATE_LIMIT', '').lower() == 'true'
+
+# Locally rejected requests of an IP after which its counters are synced to Redis
+SYNC_BATCH = 100
+
+# Maximum number of IPs held in the local denylist
+MAX_DENIED = 10000
+
+denied: Dict[str, dict] = {}
+
+# KEYS: rate limit, concurrent strike and daily counters
+# ARGV: requests allowed per interval, interval in seconds, the strike limit and the
+#       strikes and requests rejected locally since the last check
+# Returns the status, the three counters and the milliseconds left in the interval
+RATE_LIMIT_SCRIPT = '''
+local limit = tonumber(ARGV[1])
+local interval = tonumber(ARGV[2])
+local strike_limit = tonumber(ARGV[3])
+local pending_strikes = tonumber(ARGV[4])
+local pending_requests = tonumber(ARGV[5])
+local day = interval * 60 * 24
+
+if pending_strikes > 0 then
+    local strikes = redis.call('INCRBY', KEYS[2], pending_strikes)
+    if strikes == pending_strikes then
+        redis.call('EXPIRE', KEYS[2], day)
+    end
+    if strikes >= strike_limit and strikes - pending_strikes < strike_limit then
+        redis.call('EXPIRE', KEYS[2], day * 7)
+    end
+end
+
+if pending_requests > 0 then
+    if redis.call('INCRBY', KEYS[3], pending_requests) == pending_requests then
+        redis.call('EXPIRE', KEYS[3], day)
+    end
+end
+
+local current = redis.call('INCR', KEYS[1])
+if current == 1 then
+    redis.call('EXPIRE', KEYS[1], interval)
+end
+
+local concurrent = tonumber(redis.call('GET', KEYS[2]) or '0')
+if current > limit then
+    concurrent = redis.call('INCR', KEYS[2])
+    if concurrent == 1 then
+        redis.call('EXPIRE', KEYS[2], day)
+    end
+    if concurrent == strike_limit then
+        redis.call('EXPIRE', KEYS[2], day * 7)
+        return {403, current, concurrent, 0, redis.call('PTTL', KEYS[1])}
+    end
+end
+
+local daily = redis.call('INCR', KEYS[3])
+if daily == 1 then
+    redis.call('EXPIRE', KEYS[3], day)
+end
+
+if daily > limit * interval then
+    redis.call('EXPIRE', KEYS[2], day)
+    return {429, current, concurrent, daily, redis.call('PTTL', KEYS[1])}
+end
+
+if concurrent >= strike_limit then
+    return {403, current, concurrent, daily, redis.call('PTTL', KEYS[1])}
+end
+
+if current > limit then
+    return {429, current, concurrent, daily, redis.call('PTTL', KEYS[1])}
+end
+
+return {200, current, concurrent, daily, 0}
+'''
+
+
+class RateLimitResult(NamedTuple):
+    '''
+    Decision and counter values of a single rate limit check.
+    '''
+    status: int
+    current_count: int
+    concurrent_count: int
+    daily_count: int
+    window_ms: int = 0
+    local: bool = False
+
+
+def get_keys(ip_address: str) -> list:
+    '''
+    Returns the rate limit, concurrent strike and daily counter keys of an IP address.
+    '''
+    return [
+        f'rate_limit:{ip_address}',
+        f'concurrent_count_limit:{ip_address}',
+        f'daily_rate_limit:{ip_address}',
+    ]
+
+
+def check_locally(ip_address: str, limit: int) -> Union[RateLimitResult, None]:
+    '''
+    Reject a request from the local denylist while its IP is known to be throttled.
+    Returns None when the request has to be checked against Redis.
+    '''
+    entry = denied.get(ip_address)
+    if entry is None or time.monotonic() >= entry['until'] or entry['requests'] >= SYNC_BATCH:
+        return None
+
+    # The strike that reaches the limit forbids the IP for a week, which only Redis can do,
+    # so that request is checked against Redis together with the pending counts
+    strike = entry['current'] + 1 > limit
+    if strike and entry['concurrent'] + entry['strikes'] + 1 == STRIKE_LIMIT:
+        return None
+
+    # Count the request as Redis would, to be synced with the next check
+    entry['requests'] += 1
+    entry['current'] += 1
+    if strike:
+        entry['strikes'] += 1
+
+    return RateLimitResult(
+        entry['status'], entry['current'], entry['concurrent'] + entry['strikes'],
+        entry['daily'] + entry['requests'], local=True
+    )
+
+
+def remember(ip_address: str, result: RateLimitResult) -> None:
+    '''
+    Add a throttled or forbidden IP to the local denylist until the current window ends.
+    '''
+    if result.status == 200 or result.window_ms <= 0:
+        return
+
+    if ip_address not in denied and len(denied) >= MAX_DENIED:
+        now = time.monotonic()
+        for expired in [ip for ip, entry in denied.items() if now >= entry['until'] and not entry['requests']]:
+            del denied[expired]
+        if len(denied) >= MAX_DENIED:
+            return
+
+    denied[ip_address] = {
+        'status': result.status,
+        'until': time.monotonic() + result.window_ms / 1000,
+        'current': result.current_count,
+        'concurrent': result.concurrent_count,
+        'daily': result.daily_count,
+        'strikes': 0,
+        'requests': 0,
+    }
+
+
+def check(redis_client, ip_address: str, limit: int, interval: int,
+          local: bool = LOCAL_RATE_LIMIT) -> RateLimitResult:
+    '''
+    Count a request from an IP address and return the rate limit decision.
+    The script is sent by SHA, so only the first call on a new Redis server loads it.
+    With `local` enabled, IPs throttled in the current window are rejected without Redis.
+    '''
+    if local:
+        result = check_locally(ip_address, limit)
+        if result is not None:
+            return result
+
+    pending = denied.pop(ip_address, None) or {'strikes': 0, 'requests': 0}
+
+    script = redis_client.register_script(RATE_LIMIT_SCRIPT)
+    status, current_count, concurrent_count, daily_count, window_ms = script(
+        keys=get_keys(ip_address),
+        args=[limit, interval, STRIKE_LIMIT, pending['strikes'], pending['requests']],
+    )
+    result = RateLimitResult(
+        int(status), int(current_count), int(concurrent_count), int(daily_count), int(window_ms)
+    )
+
+    if local:
+        remember(ip_address, result)
+
+    return result
@@ -0,0 +1,241 @@
+'''
+Lazily loaded reference data shared by all modules for the life of the container.
+
+Each resource is downloaded on first use, kept in memory and revalidated with
+ETag / Last-Modified once its TTL expires. A snapshot is written to local disk
+so later cold starts in the same environment can skip the download.
+
+Resources are published both as JSON and as compact integer keyed tables
+(see api/utils/compact_table.py) which are memory mapped from the snapshot.
+
+The sync job also publishes a manifest of content hashed, immutable copies of
+each resource. Resources listed in it are downloaded gzip encoded from their
+hashed key and never revalidated, only the manifest is. Resources missing from
+the manifest, or all of them while it is unavailable, use the plain files.
+'''
+import json
+import mmap
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+import requests
+
+from api.utils.compact_table import COMPACT_COLUMNS, CompactTable
+
+RESOURCE_URL = 'https://evetrade.s3.amazonaws.com/resources/{file_name}'
+SNAPSHOT_DIRECTORY = os.getenv('REFERENCE_DATA_DIRECTORY', '/tmp/evetrade_resources')
+REVALIDATE_SECONDS = int(os.getenv('REFERENCE_DATA_TTL', '900'))
+
+MANIFEST = 'manifest.json'
+
+resource_cache: Dict[str, dict] = {}
+resource_lock = threading.Lock()
+manifest_state = {'unavailable_until': 0.0}
+
+
+def get_snapshot_paths(file_name: str) -> tuple:
+    '''
+    Returns the data and metadata paths of the local snapshot of a resource.
+    '''
+    return (
+        os.path.join(SNAPSHOT_DIRECTORY, file_name),
+        os.path.join(SNAPSHOT_DIRECTORY, f'{file_name}.meta.json'),
+    )
+
+
+def read_snapshot_body(path: str, memory_map: bool):
+    '''
+    Read a snapshot file, memory mapping it instead of copying it when requested.
+    '''
+    with open(path, 'rb') as data_file:
+        if memory_map:
+            return mmap.mmap(data_file.fileno(), 0, access=mmap.ACCESS_READ)
+        return data_file.read()
+
+
+def load_snapshot(file_name: str, parse: Callable, memory_map: bool = False) -> Optional[dict]:
+    '''
+    Load a resource from its local snapshot if one exists.
+    '''
+    data_path, meta_path = get_snapshot_paths(file_name)
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as meta_file:
+            entry = json.load(meta_file)
+        entry['data'] = parse(read_snapshot_body(data_path, memory_map))
+    except (OSError, ValueError):
+        return None
+
+    print(f"Loaded {file_name} from local snapshot.")
+    return entry
+
+
+def save_snapshot(file_name: str, body: bytes, entry: dict) -> bool:
+    '''
+    Write the raw body and validators of a resource to the local snapshot.
+    '''
+    data_path, meta_path = get_snapshot_paths(file_name)
+    metadata = {key: value for key, value in entry.items() if key != 'data'}
+    try:
+        os.makedirs(SNAPSHOT_DIRECTORY, exist_ok=True)
+        for path, content in [(data_path, body), (meta_path, json.dumps(metadata).encode('utf-8'))]:
+            # Write to a temporary file first so concurrent readers never see a partial file
+            temporary_path = f'{path}.{os.getpid()}.tmp'
+            with open(temporary_path, 'wb') as snapshot_file:
+                snapshot_file.write(content)
+            os.replace(temporary_path, path)
+    except OSError as error:
+        print(f"Unable to write snapshot for {file_name}: {error}")
+        return False
+    return True
+
+
+def save_snapshot_metadata(file_name: str, entry: dict) -> None:
+    '''
+    Refresh the validators of an existing local snapshot.
+    '''
+    _, meta_path = get_snapshot_paths(file_name)
+    if not os.path.exists(meta_path):
+        return
+    metadata = {key: value for key, value in entry.items() if key != 'data'}
+    try:
+        with open(meta_path, 'w', encoding='utf-8') as meta_file:
+            json.dump(metadata, meta_file)
+    except OSError as error:
+        print(f"Unable to write snapshot for {file_name}: {error}")
+
+
+def fetch_resource(file_name: str, entry: Optional[dict], parse: Callable, memory_map: bool = False,
+                   key: Optional[str] = None) -> dict:
+    '''
+    Download a resource, or revalidate the given entry with a conditional request.
+    Resources with a content hashed key are downloaded from it instead.
+    '''
+    headers = {}
+    if entry is not None and entry.get('key') == key:
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+
+    try:
+        response = requests.get(RESOURCE_URL.format(file_name=key or file_name), headers=headers, timeout=30)
+        if response.status_code == 304 and entry is not None:
+            print(f"{file_name} has not changed.")
+            entry['checked_at'] = time.time()
+            save_snapshot_metadata(file_name, entry)
+            return entry
+
+        response.raise_for_status()
+    except requests.exceptions.RequestException as error:
+        if entry is None:
+            raise
+        # Keep serving the stale copy rather than failing the request
+        print(f"Unable to revalidate {file_name}, using cached copy: {error}")
+        entry['checked_at'] = time.time()
+        entry['unavailable_key'] = key
+        return entry
+
+    new_entry = {
+        'key': key,
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'checked_at': time.time(),
+    }
+    saved = save_snapshot(file_name, response.content, new_entry)
+    if saved and memory_map:
+        new_entry['data'] = parse(read_snapshot_body(get_snapshot_paths(file_name)[0], memory_map))
+    else:
+        new_entry['data'] = parse(response.content)
+    print(f"Downloaded {file_name}.")
+
+    return new_entry
+
+
+def is_fresh(entry: Optional[dict]) -> bool:
+    '''
+    Returns whether a cached entry is still within its TTL.
+    '''
+    return entry is not None and time.time() - entry['checked_at'] < REVALIDATE_SECONDS
+
+
+def is_current(entry: Optional[dict], key: Optional[str]) -> bool:
+    '''
+    Returns whether a cached entry can be served.
+    Content hashed keys never change, so an entry of the current key is always current.
+    '''
+    if key is None or entry is None:
+        return is_fresh(entry)
+    # A failed download of a new key is only retried once the cached copy is stale
+    return entry.get('key') == key or (entry.get('unavailable_key') == key and is_fresh(entry))
+
+
+def get_manifest_key(file_name: str) -> Optional[str]:
+    '''
+    Returns the gzip encoded, content hashed key of a resource from the published manifest.
+    Returns None if the resource is not listed or the manifest is unavailable.
+    '''
+    if file_name == MANIFEST or time.time() < manifest_state['unavailable_until']:
+        return None
+
+    try:
+        manifest = load_resource(MANIFEST, json.loads)
+    except (requests.exceptions.RequestException, ValueError) as error:
+        print(f"Resource manifest unavailable: {error}")
+        manifest_state['unavailable_until'] = time.time() + REVALIDATE_SECONDS
+        return None
+
+    resource = manifest.get('resources', {}).get(file_name)
+    if resource is None:
+        return None
+    return resource.get('encodings', {}).get('gzip', resource['key'])
+
+
+def load_resource(file_name: str, parse: Callable, memory_map: bool = False) -> Any:
+    '''
+    Returns a parsed resource from memory, the local snapshot or the network, in that order.
+    '''
+    key = get_manifest_key(file_name)
+    entry = resource_cache.get(file_name)
+    if is_current(entry, key):
+        return entry['data']
+
+    with resource_lock:
+        entry = resource_cache.get(file_name)
+        if is_current(entry, key):
+            return entry['data']
+
+        if entry is None:
+            entry = load_snapshot(file_name, parse, memory_map)
+
+        if not is_current(entry, key):
+            entry = fetch_resource(file_name, entry, parse, memory_map, key)
+
+        resource_cache[file_name] = entry
+
+    return entry['data']
+
+
+def get_resource(name: str) -> Any:
+    '''
+    Returns the parsed contents of a published JSON resource such as 'typeIDToName'.
+    '''
+    return load_resource(f'{name}.json', json.loads)
+
+
+def get_compact_resource(name: str) -> CompactTable:
+    '''
+    Returns the compact integer keyed table of a published resource such as 'typeIDToName'.
+    Falls back to compiling the JSON resource if the compact table is not published.
+    '''
+    try:
+        return load_resource(f'{name}.bin', CompactTable, memory_map=True)
+    except (requests.exceptions.RequestException, ValueError) as error:
+        print(f"Compact {name} unavailable, compiling from JSON: {error}")
+
+    table = CompactTable.from_mapping(get_resource(name), COMPACT_COLUMNS[name])
+    resource_cache[f'{name}.bin'] = {
+        'data': table, 'etag': None, 'last_modified': None, 'checked_at': time.time()
+    }
+    return table
@@ -0,0 +1,190 @@
+'''
+Cache of route results in Redis keyed by normalized query parameters.
+
+Results are stored as zlib compressed JSON, or with the given encoding for
+intermediate results such as order books. Keys include a version of the market
+data taken from the indexing statistics of its Elasticsearch index, so results
+are never served once new orders have been written. Entries also expire after
+RESULT_CACHE_TTL seconds. Concurrent identical requests are de-duplicated with
+a lock: one invocation computes the result while the others wait for it to be
+stored.
+'''
+import hashlib
+import json
+import os
+import time
+import uuid
+import zlib
+from typing import Any, Callable, Dict, Optional
+
+# Seconds a result is kept, 0 disables the cache
+RESULT_CACHE_TTL = int(os.getenv('RESULT_CACHE_TTL', '300'))
+
+MARKET_DATA_INDEX = 'market_data'
+
+# Seconds the market data version is reused before the index is checked again
+MARKET_VERSION_TTL = 10
+
+market_version_state = {'version': None, 'checked_at': 0.0}
+
+# Seconds a computation may hold the lock and other invocations wait for it
+LOCK_SECONDS = 60
+WAIT_SECONDS = 30
+POLL_SECONDS = 0.1
+
+# Deletes the lock only if it is still held by the given token
+RELEASE_SCRIPT = '''
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+'''
+
+
+def normalize_value(value: Any) -> str:
+    '''
+    Normalize a query parameter so equivalent spellings of a value are equal,
+    such as '0.075' and '0.0750' or ' 500000' and '500000.0'.
+    '''
+    parts = []
+    for part in str(value).split(','):
+        part = part.strip()
+        try:
+            number = float(part)
+        except ValueError:
+            parts.append(part)
+            continue
+        parts.append(str(int(number)) if number.is_integer() else repr(number))
+    return ','.join(parts)
+
+
+def get_market_version(es_client) -> Optional[str]:
+    '''
+    Returns a version of the market data that changes whenever orders are written,
+    deleted or the index is replaced. Returns None if it cannot be read.
+    '''
+    now = time.time()
+    if market_version_state['version'] is not None and now - market_version_state['checked_at'] < MARKET_VERSION_TTL:
+        return market_version_state['version']
+
+    try:
+        stats = es_client.indices.stats(index=MARKET_DATA_INDEX, metric='indexing')
+        indexing = {index: totals['primaries']['indexing'] for index, totals in stats['indices'].items()}
+        version = ','.join(
+            f"{index}:{indexing[index]['index_total']}:{indexing[index]['delete_total']}" for index in sorted(indexing)
+        )
+    except Exception as error: # pylint: disable=broad-except
+        print(f"Market data version unavailable: {error}")
+        return None
+
+    market_version_state.update(version=version, checked_at=now)
+    return version
+
+
+def get_key(path: str, queries: Optional[Dict[str, Any]], defaults: Dict[str, Any],
+            version: Optional[str]) -> Optional[str]:
+    '''
+    Returns the cache key of a request for a market data version, or None without a version.
+    Only parameters read by the route are used and missing ones take their default.
+    '''
+    if version is None:
+        return None
+
+    queries = queries or {}
+    parameters = {}
+    for name, default in defaults.items():
+        value = queries.get(name, default)
+        if value is not None:
+            parameters[name] = normalize_value(value)
+
+    digest = hashlib.sha256(json.dumps([version, parameters], sort_keys=True).encode('utf-8')).hexdigest()
+    return f'result:{path}:{digest}'
+
+
+def encode_result(result: Any) -> bytes:
+    '''
+    Compress a result for storage.
+    '''
+    return zlib.compress(json.dumps(result).encode('utf-8'), 6)
+
+
+def decode_result(payload: bytes) -> Any:
+    '''
+    Decompress a stored result.
+    '''
+    return json.loads(zlib.decompress(payload))
+
+
+def wait_for_result(redis_client, key: str, lock_key: str) -> Optional[bytes]:
+    '''
+    Wait for the invocation holding the lock to store the result.
+    Returns None if the lock is released or times out without a result.
+    '''
+    deadline = time.monotonic() + WAIT_SECONDS
+    while time.monotonic() < deadline:
+        time.sleep(POLL_SECONDS)
+        payload = redis_client.get(key)
+        if payload is not None:
+            return payload
+        if not redis_client.exists(lock_key):
+            return None
+    return None
+
+
+def store_result(redis_client, key: str, payload: bytes) -> None:
+    '''
+    Store an encoded result for RESULT_CACHE_TTL seconds.
+    '''
+    try:
+        redis_client.set(key, payload, ex=RESULT_CACHE_TTL)
+    except Exception as error: # pylint: disable=broad-except
+        print(f"Unable to store {key}: {error}")
+
+
+def release_lock(redis_client, lock_key: str, token: str) -> None:
+    '''
+    Release the computation lock if it is still held by this invocation.
+    '''
+    try:
+        redis_client.register_script(RELEASE_SCRIPT)(keys=[lock_key], args=[token])
+    except Exception as error: # pylint: disable=broad-except
+        print(f"Unable to release {lock_key}: {error}")
+
+
+def get_or_compute(redis_client, key: Optional[str], compute: Callable[[], Any],
+                   encode: Callable[[Any], bytes] = encode_result,
+                   decode: Callable[[bytes], Any] = decode_result) -> Any:
+    '''
+    Returns the cached result of a key, computing and storing it on a miss.
+    Results of None are not stored. Without a key, or on Redis errors, the
+    result is computed directly.
+    '''
+    if RESULT_CACHE_TTL <= 0 or key is None:
+        return compute()
+
+    lock_key = f'{key}:lock'
+    token = uuid.uuid4().hex
+
+    try:
+        payload = redis_client.get(key)
+        if payload is None and not redis_client.set(lock_key, token, nx=True, ex=LOCK_SECONDS):
+            print(f"Waiting for {key} to be computed.")
+            payload = wait_for_result(redis_client, key, lock_key)
+            if payload is None:
+                redis_client.set(lock_key, token, nx=True, ex=LOCK_SECONDS)
+    except Exception as error: # pylint: disable=broad-except
+        print(f"Result cache unavailable: {error}")
+        return compute()
+
+    if payload is not None:
+        print(f"Result cache hit for {key}.")
+        return decode(payload)
+
+    try:
+        result = compute()
+        if result is not None:
+            store_result(redis_client, key, encode(result))
+    finally:
+        release_lock(redis_client, lock_key, token)
+
+    return result
@@ -0,0 +1,146 @@
+'''
+Local jump counts over the stargate graph of the universe.
+
+The graph is built from the published 'systemJumps' resource, a mapping of each
+system ID to the IDs of the systems its stargates lead to that the resource sync
+job generates from the static data export, and the security of
+each system from 'systemIdToSecurity'. Routes are solved the way the ESI route
+endpoint chooses them:
+
+    shortest    fewest jumps
+    secure      fewest systems outside high security space, then fewest jumps
+    insecure    fewest high security systems, then fewest jumps
+
+Counts are returned as the length of the ESI route, which includes the origin,
+so they can be used in place of the counts stored in evetrade_jump_data.
+'''
+import time
+from typing import Iterable, Optional
+
+import numpy as np
+import requests
+
+from api.utils import reference_data
+from api.utils.lru_cache import LRUCache
+
+RESOURCE = 'systemJumps'
+
+# Cost of entering a system avoided by a route safety, larger than any route length
+AVOIDED_COST = 10000
+
+# Origins whose distances to every system are kept per graph
+DISTANCE_CACHE_SIZE = 256
+
+graph_state = {'graph': None, 'sources': None, 'unavailable_until': 0.0}
+
+
+class JumpGraph:
+    '''
+    Stargate graph stored as compressed sparse rows over the sorted system IDs.
+    '''
+    def __init__(self, system_jumps: dict, high_sec_ids: Iterable[int]):
+        adjacency = {int(system_id): [int(neighbor) for neighbor in neighbors]
+                     for system_id, neighbors in system_jumps.items()}
+        system_ids = set(adjacency)
+        for neighbors in adjacency.values():
+            system_ids.update(neighbors)
+
+        self.system_ids = np.array(sorted(system_ids), dtype=np.int64)
+        rows = {system_id: row for row, system_id in enumerate(self.system_ids.tolist())}
+
+        counts = np.zeros(len(self.system_ids), dtype=np.int64)
+        for system_id, neighbors in adjacency.items():
+            counts[rows[system_id]] = len(neighbors)
+        self.indptr = np.concatenate(([0], np.cumsum(counts)))
+        self.indices = np.zeros(self.indptr[-1], dtype=np.int64)
+        for system_id, neighbors in adjacency.items():
+            start = self.indptr[rows[system_id]]
+            self.indices[start:start + len(neighbors)] = [rows[neighbor] for neighbor in neighbors]
+
+        high_sec = np.isin(self.system_ids, np.fromiter(high_sec_ids, dtype=np.int64))
+        self.costs = {
+            'shortest': np.ones(len(self.system_ids), dtype=np.int64),
+            'secure': np.where(high_sec, 1, AVOIDED_COST + 1),
+            'insecure': np.where(high_sec, AVOIDED_COST + 1, 1),
+        }
+        self.distances = LRUCache(DISTANCE_CACHE_SIZE, float('inf'))
+
+    def row(self, system_id: int) -> int:
+        '''
+        Returns the row of a system, or -1 if it has no stargates.
+        '''
+        idx = int(np.searchsorted(self.system_ids, system_id))
+        if idx < len(self.system_ids) and self.system_ids[idx] == system_id:
+            return idx
+        return -1
+
+    def distances_from(self, origin: int, route_safety: str) -> np.ndarray:
+        '''
+        Returns the cost of the best route from an origin row to every row.
+
+        Costs are relaxed one frontier at a time over all its stargates at once,
+        until no cost improves. Unreachable rows keep the maximum int64 value.
+        '''
+        cached = self.distances.get((origin, route_safety))
+        if cached is not None:
+            return cached
+
+        costs = self.costs[route_safety]
+        unreachable = np.iinfo(np.int64).max
+        distances = np.full(len(self.system_ids), unreachable, dtype=np.int64)
+        distances[origin] = 0
+        frontier = np.array([origin], dtype=np.int64)
+
+        while frontier.size:
+            starts = self.indptr[frontier]
+            counts = self.indptr[frontier + 1] - starts
+            offsets = np.repeat(starts - np.concatenate(([0], np.cumsum(counts)[:-1])), counts)
+            targets = self.indices[offsets + np.arange(counts.sum())]
+            candidates = np.repeat(distances[frontier], counts) + costs[targets]
+
+            improved = candidates < distances[targets]
+            targets, candidates = targets[improved], candidates[improved]
+            np.minimum.at(distances, targets, candidates)
+            frontier = np.unique(targets)
+
+        self.distances.set((origin, route_safety), distances)
+        return distances
+
+    def count_jumps(self, start: int, end: int, route_safety: str) -> Optional[int]:
+        '''
+        Returns the ESI route length between two systems, -1 if there is no route,
+        or None if either system is not in the graph.
+        '''
+        origin, destination = self.row(start), self.row(end)
+        if origin < 0 or destination < 0:
+            return None
+
+        distance = self.distances_from(origin, route_safety)[destination]
+        if distance == np.iinfo(np.int64).max:
+            return -1
+        # Each system entered costs one jump plus the penalty of avoided systems
+        return int(distance % AVOIDED_COST) + 1
+
+
+def get_jump_graph() -> Optional[JumpGraph]:
+    '''
+    Returns the stargate graph, rebuilding it when its resources change.
+    Returns None while the graph resource is not published.
+    '''
+    if time.time() < graph_state['unavailable_until']:
+        return None
+
+    try:
+        system_jumps = reference_data.get_resource(RESOURCE)
+        systems = reference_data.get_compact_resource('systemIdToSecurity')
+    except (requests.exceptions.RequestException, ValueError) as error:
+        print(f"Jump graph unavailable: {error}")
+        graph_state['unavailable_until'] = time.time() + reference_data.REVALIDATE_SECONDS
+        return None
+
+    if graph_state['sources'] != (id(system_jumps), id(systems)):
+        high_sec = systems.ids[np.isin(systems.column('security_code'), systems.category_codes('security_code', ['high_sec']))]
+        graph_state['graph'] = JumpGraph(system_jumps, high_sec.tolist())
+        graph_state['sources'] = (id(system_jumps), id(systems))
+
+    return graph_state['graph']
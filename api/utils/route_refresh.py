@@ -0,0 +1,88 @@
+'''
+Publishing of routes whose jump counts need to be (re)computed by the jump count processor.
+
+Routes are de-duplicated within a request and, with a Redis marker per route,
+across requests for ROUTE_REFRESH_WINDOW seconds. The remaining routes are sent
+to SQS in batches of up to 10 messages.
+'''
+import json
+import os
+from typing import Iterable, List
+
+from api.utils import startup
+
+ROUTE_REFRESH_WINDOW = int(os.getenv('ROUTE_REFRESH_WINDOW', '600'))
+
+# Largest number of messages accepted by a single SQS send_message_batch call
+BATCH_SIZE = 10
+
+
+def get_marker_key(route: str) -> str:
+    '''
+    Returns the Redis key marking a route as recently published.
+    '''
+    return f'route_refresh:{route}'
+
+
+def claim_routes(redis_client, routes: List[str]) -> List[str]:
+    '''
+    Mark routes as published in a single round trip and return the ones that were not already.
+    If Redis is unavailable every route is returned, as a duplicate is better than a missed route.
+    '''
+    try:
+        pipeline = redis_client.pipeline(transaction=False)
+        for route in routes:
+            pipeline.set(get_marker_key(route), 1, nx=True, ex=ROUTE_REFRESH_WINDOW)
+        claimed = pipeline.execute()
+    except Exception as error: # pylint: disable=broad-except
+        print(f"Unable to de-duplicate route refreshes: {error}")
+        return routes
+
+    return [route for route, is_new in zip(routes, claimed) if is_new]
+
+
+def release_routes(redis_client, routes: List[str]) -> None:
+    '''
+    Remove the markers of routes that could not be published so a later request retries them.
+    '''
+    try:
+        redis_client.delete(*[get_marker_key(route) for route in routes])
+    except Exception as error: # pylint: disable=broad-except
+        print(f"Unable to release route refreshes: {error}")
+
+
+def publish_routes(routes: Iterable[str]) -> int:
+    '''
+    Send each route such as '30000142-30002187' to the jump count processor once.
+    Returns the number of routes sent.
+    '''
+    routes = sorted(set(routes))
+    if not routes:
+        return 0
+
+    redis_client = startup.get_redis_client()
+    routes = claim_routes(redis_client, routes)
+    print(f"Sending {len(routes)} routes to SQS to update.")
+
+    sent = 0
+    for i in range(0, len(routes), BATCH_SIZE):
+        batch = routes[i:i + BATCH_SIZE]
+        entries = []
+        for idx, route in enumerate(batch):
+            start, end = route.split('-')
+            entries.append({'Id': str(idx), 'MessageBody': json.dumps({'start': start, 'end': end})})
+
+        try:
+            response = startup.get_sqs_client().send_message_batch(
+                QueueUrl=os.getenv('SQS_QUEUE_URL'), Entries=entries
+            )
+            failed = [batch[int(entry['Id'])] for entry in response.get('Failed', [])]
+        except Exception as error: # pylint: disable=broad-except
+            print(f"Unable to send route refreshes: {error}")
+            failed = batch
+
+        if failed:
+            release_routes(redis_client, failed)
+        sent += len(batch) - len(failed)
+
+    return sent
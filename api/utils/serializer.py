@@ -0,0 +1,188 @@
+'''
+Size aware serialization and compression of API responses.
+
+List responses can be encoded as a JSON array or as newline delimited JSON, one
+item per line, and are compressed with brotli or gzip as negotiated from the
+Accept-Encoding header. Items are encoded and compressed one at a time, so the
+body is produced in a single pass.
+'''
+import base64
+import json
+import zlib
+from typing import Any, Dict, Iterator, NamedTuple, Optional
+
+import brotli
+
+# Largest response body returned by the Lambda function
+MAX_BODY_BYTES = 5 * 1024 * 1024
+
+JSON = 'application/json'
+NDJSON = 'application/x-ndjson'
+
+# Opening, item separator, closing and item terminator of each list format.
+# The JSON separator is the one json.dumps writes, so bodies are unchanged.
+FORMATS = {
+    JSON: ('[', ', ', ']', ''),
+    NDJSON: ('', '', '', '\n'),
+}
+
+# Supported content encodings in order of preference
+CONTENT_ENCODINGS = ['br', 'gzip']
+
+encoder = json.JSONEncoder()
+
+
+class SerializedBody(NamedTuple):
+    '''
+    Encoded response body and the number of items it holds.
+    '''
+    body: str
+    total_items: int
+    dropped_items: int
+
+
+def serialize(response: Any, max_bytes: int = MAX_BODY_BYTES, content_type: str = JSON) -> SerializedBody:
+    '''
+    Encode a response in a single pass.
+
+    List responses are written one item at a time and stop at the last item that
+    fits in `max_bytes`, so the items that do not fit are dropped from the end.
+    The encoder escapes non ASCII characters, so characters and bytes are the same.
+    '''
+    if not isinstance(response, list):
+        return SerializedBody(encoder.encode(response), 1, 0)
+
+    opening, separator, closing, terminator = FORMATS[content_type]
+    parts = [opening]
+    size = len(opening) + len(closing)
+
+    for idx, item in enumerate(response):
+        encoded = encoder.encode(item) + terminator
+        item_size = len(encoded) + (len(separator) if idx else 0)
+        if size + item_size > max_bytes:
+            parts.append(closing)
+            return SerializedBody(''.join(parts), len(response), len(response) - idx)
+
+        if idx:
+            parts.append(separator)
+        parts.append(encoded)
+        size += item_size
+
+    parts.append(closing)
+    return SerializedBody(''.join(parts), len(response), 0)
+
+
+def iter_chunks(response: Any, content_type: str = JSON) -> Iterator[str]:
+    '''
+    Yields the encoded response one list item at a time.
+    '''
+    if not isinstance(response, list):
+        yield encoder.encode(response)
+        return
+
+    opening, separator, closing, terminator = FORMATS[content_type]
+    yield opening
+    for idx, item in enumerate(response):
+        yield (separator if idx else '') + encoder.encode(item) + terminator
+    yield closing
+
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    '''
+    Returns the preferred content encoding accepted by the client, if any.
+    '''
+    accepted = {}
+    for part in (accept_encoding or '').split(','):
+        name, _, parameters = part.partition(';')
+        quality = 1.0
+        for parameter in parameters.split(';'):
+            key, _, value = parameter.strip().partition('=')
+            if key == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if name.strip():
+            accepted[name.strip().lower()] = quality
+
+    for encoding in CONTENT_ENCODINGS:
+        if accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+    return None
+
+
+def compress_chunks(chunks: Iterator[str], encoding: str) -> bytes:
+    '''
+    Compress encoded chunks as they are produced.
+    '''
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=5)
+        parts = [compressor.process(chunk.encode('utf-8')) for chunk in chunks]
+        parts.append(compressor.finish())
+    else:
+        # A window of 16 + 15 bits writes a gzip header and trailer
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        parts = [compressor.compress(chunk.encode('utf-8')) for chunk in chunks]
+        parts.append(compressor.flush())
+    return b''.join(parts)
+
+
+def decompress(body: bytes, encoding: str) -> bytes:
+    '''
+    Decompress a body compressed with the given content encoding.
+    '''
+    if encoding == 'br':
+        return brotli.decompress(body)
+    return zlib.decompress(body, 31)
+
+
+def compress(response: Any, encoding: str, max_bytes: int = MAX_BODY_BYTES,
+             content_type: str = JSON) -> SerializedBody:
+    '''
+    Encode and compress a response into a base64 body of at most `max_bytes`.
+
+    The whole response is compressed first. In the rare case it still does not
+    fit, the number of items kept is scaled down by the overshoot until it does.
+    '''
+    total = len(response) if isinstance(response, list) else 1
+    keep = total
+
+    while True:
+        items = response[:keep] if isinstance(response, list) else response
+        body = base64.b64encode(compress_chunks(iter_chunks(items, content_type), encoding)).decode('ascii')
+        if len(body) <= max_bytes or keep == 0:
+            return SerializedBody(body, total, total - keep)
+        keep = min(keep - 1, int(keep * max_bytes / len(body) * 0.95))
+
+
+def encode_response(response: Any, accept_encoding: str = '', content_type: str = JSON,
+                    max_bytes: int = MAX_BODY_BYTES) -> Dict[str, Any]:
+    '''
+    Returns the Lambda proxy response for a result, compressed when the client accepts it.
+    '''
+    encoding = negotiate_encoding(accept_encoding)
+    if not isinstance(response, list):
+        content_type = JSON
+
+    if encoding is None:
+        serialized = serialize(response, max_bytes, content_type)
+    else:
+        serialized = compress(response, encoding, max_bytes, content_type)
+
+    headers = {
+        'Content-Type': content_type,
+        'Vary': 'Accept, Accept-Encoding',
+        'X-Total-Items': str(serialized.total_items),
+        'X-Dropped-Items': str(serialized.dropped_items),
+    }
+    if encoding is not None:
+        headers['Content-Encoding'] = encoding
+
+    print(f'Size: {len(serialized.body) / 1024 / 1024} MB ({encoding or "identity"}). Dropped {serialized.dropped_items} of {serialized.total_items} items.')
+
+    return {
+        'statusCode': 200,
+        'headers': headers,
+        'isBase64Encoded': encoding is not None,
+        'body': serialized.body,
+    }
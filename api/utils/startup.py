@@ -0,0 +1,134 @@
+'''
+Lazily created clients shared by all modules and timing of the start up path.
+
+Clients are only created the first time a route needs them, and every phase of
+an invocation is timed so cold start latency can be measured per route.
+Set PREWARM_ON_INIT=true to create the clients during Lambda initialization.
+'''
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator
+
+clients: Dict[str, Any] = {}
+client_lock = threading.Lock()
+
+phase_timings: Dict[str, float] = {}
+cold_start = True
+
+
+@contextmanager
+def timed(phase: str) -> Iterator[None]:
+    '''
+    Time a phase of the current invocation in milliseconds.
+    '''
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        phase_timings[phase] = phase_timings.get(phase, 0) + (time.perf_counter() - start) * 1000
+
+
+def get_client(name: str, factory) -> Any:
+    '''
+    Returns the shared client of the given name, creating it on first use.
+    '''
+    client = clients.get(name)
+    if client is not None:
+        return client
+
+    with client_lock:
+        if name not in clients:
+            with timed(f'client:{name}'):
+                clients[name] = factory()
+
+    return clients[name]
+
+
+def create_redis_client():
+    '''
+    Create the Redis client.
+    '''
+    import redis # pylint: disable=import-outside-toplevel
+
+    return redis.Redis(
+        host=os.environ['REDIS_HOST'],
+        port=int(os.environ['REDIS_PORT']),
+        password=os.environ['REDIS_PASSWORD'],
+    )
+
+
+def create_es_client():
+    '''
+    Create the Elasticsearch client.
+    '''
+    from elasticsearch import Elasticsearch # pylint: disable=import-outside-toplevel
+
+    return Elasticsearch([os.getenv('ES_HOST')])
+
+
+def create_sqs_client():
+    '''
+    Create the SQS client.
+    '''
+    import boto3 # pylint: disable=import-outside-toplevel
+
+    return boto3.client('sqs')
+
+
+def get_redis_client():
+    '''
+    Returns the shared Redis client.
+    '''
+    return get_client('redis', create_redis_client)
+
+
+def get_es_client():
+    '''
+    Returns the shared Elasticsearch client.
+    '''
+    return get_client('elasticsearch', create_es_client)
+
+
+def get_sqs_client():
+    '''
+    Returns the shared SQS client.
+    '''
+    return get_client('sqs', create_sqs_client)
+
+
+def prewarm(*loaders) -> None:
+    '''
+    Create the shared clients and run the given loaders during Lambda initialization
+    when PREWARM_ON_INIT is enabled.
+    '''
+    if os.getenv('PREWARM_ON_INIT', '').lower() != 'true':
+        return
+
+    with timed('prewarm'):
+        for factory in [get_redis_client, get_es_client, get_sqs_client, *loaders]:
+            try:
+                factory()
+            except Exception as error: # pylint: disable=broad-except
+                print(f"Prewarm of {factory.__name__} failed: {error}")
+
+
+def report(route: str) -> Dict[str, Any]:
+    '''
+    Emit the phase timings of the current invocation and reset them for the next one.
+    '''
+    global cold_start # pylint: disable=global-statement
+
+    timings = {
+        'route': route,
+        'cold_start': cold_start,
+        'phases_ms': {phase: round(duration, 2) for phase, duration in phase_timings.items()},
+    }
+    print(json.dumps({'timings': timings}))
+
+    phase_timings.clear()
+    cold_start = False
+
+    return timings
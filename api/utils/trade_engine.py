@@ -0,0 +1,229 @@
+'''
+Array backed trade matching engine used by the hauling module.
+'''
+from typing import Dict
+
+import numpy as np
+
+from api.utils.order_book import TypeOrders
+
+# Relative slack applied to profit upper bounds so floating point rounding never prunes a valid pair
+BOUND_TOLERANCE = 1e-9
+
+
+def to_order_arrays(orders: TypeOrders, allowed_system_ids: np.ndarray) -> Dict[str, np.ndarray]:
+    '''
+    Returns the columnar arrays used for matching the orders of a single type ID.
+    '''
+    return {
+        'price': orders.column('price'),
+        'volume': orders.column('volume_remain').astype(np.float64),
+        'allowed': np.isin(orders.column('system_id'), allowed_system_ids),
+    }
+
+
+def max_tradable_volume(item_volume: float, max_weight: float) -> float:
+    '''
+    Returns the largest volume of an item that fits within the max weight.
+    '''
+    if item_volume <= 0:
+        return float('inf')
+    return max_weight / item_volume
+
+
+def inflate_bound(bound):
+    '''
+    Inflate a profit upper bound by the tolerance so it stays a true upper bound.
+    '''
+    return bound + np.abs(bound) * BOUND_TOLERANCE
+
+
+def profit_upper_bound(from_arrays: Dict[str, np.ndarray], to_arrays: Dict[str, np.ndarray],
+                       item_volume: float, tax: float, max_weight: float) -> float:
+    '''
+    Returns an upper bound on the profit of any pair of orders of a single type ID.
+
+    The bound buys at the lowest initial price, sells at the highest closing price and
+    moves the largest volume available on either side that fits within the max weight.
+    '''
+    from_price = from_arrays['price'][from_arrays['allowed']]
+    to_price = to_arrays['price'][to_arrays['allowed']]
+
+    if from_price.size == 0 or to_price.size == 0:
+        return float('-inf')
+
+    margin = max(to_price.max() * (1 - tax) - from_price.min(), 0)
+    volume = min(
+        from_arrays['volume'][from_arrays['allowed']].max(),
+        to_arrays['volume'][to_arrays['allowed']].max(),
+        max_tradable_volume(item_volume, max_weight),
+    )
+
+    return float(inflate_bound(margin * volume))
+
+
+def match_orders(from_arrays: Dict[str, np.ndarray], to_arrays: Dict[str, np.ndarray], item_volume: float,
+                 tax: float, min_profit: float, min_roi: float, max_budget: float,
+                 max_weight: float) -> Dict[str, np.ndarray]:
+    '''
+    Match every initial order against every closing order of a single type ID.
+
+    Returns the indices of the valid (initial, closing) pairs in row-major order along
+    with the computed volume, quantity, weight, profit and ROI for each of them.
+    '''
+    # Only keep orders located in a permitted system before broadcasting
+    from_index = np.flatnonzero(from_arrays['allowed'])
+    to_index = np.flatnonzero(to_arrays['allowed'])
+
+    # Skip orders whose best possible pairing cannot reach the minimum profit
+    volume_cap = max_tradable_volume(item_volume, max_weight)
+    if from_index.size and to_index.size:
+        best_sale = to_arrays['price'][to_index].max() * (1 - tax)
+        from_bound = np.maximum(best_sale - from_arrays['price'][from_index], 0) * np.minimum(
+            np.minimum(from_arrays['volume'][from_index], to_arrays['volume'][to_index].max()), volume_cap
+        )
+        from_index = from_index[inflate_bound(from_bound) >= min_profit]
+
+    if from_index.size and to_index.size:
+        best_cost = from_arrays['price'][from_index].min()
+        to_bound = np.maximum(to_arrays['price'][to_index] * (1 - tax) - best_cost, 0) * np.minimum(
+            np.minimum(to_arrays['volume'][to_index], from_arrays['volume'][from_index].max()), volume_cap
+        )
+        to_index = to_index[inflate_bound(to_bound) >= min_profit]
+
+    pairs = evaluate_pairs(
+        from_arrays['price'][from_index][:, None], from_arrays['volume'][from_index][:, None],
+        to_arrays['price'][to_index][None, :], to_arrays['volume'][to_index][None, :],
+        item_volume, tax, min_profit, min_roi, max_budget, max_weight
+    )
+
+    rows, columns = np.nonzero(pairs['valid'])
+
+    return {
+        'from_index': from_index[rows],
+        'to_index': to_index[columns],
+        'volume': pairs['volume'][rows, columns],
+        'quantity': pairs['quantity'][rows, columns],
+        'weight': pairs['weight'][rows, columns],
+        'profit': pairs['profit'][rows, columns],
+        'roi': pairs['roi'][rows, columns],
+    }
+
+
+def sweep_orders(from_arrays: Dict[str, np.ndarray], to_arrays: Dict[str, np.ndarray], item_volume: float,
+                 tax: float, min_profit: float, min_roi: float, max_budget: float,
+                 max_weight: float) -> Dict[str, np.ndarray]:
+    '''
+    Match the orders of a single type ID with a sorted sweep instead of every pair.
+
+    Initial orders are visited by ascending price and closing orders by descending price.
+    The sweep of each initial order stops at the first closing order whose net margin
+    after tax falls below the minimum profit or ROI, found by binary search. Returns the
+    same pairs, in the same row-major order, as `match_orders`.
+    '''
+    if tax >= 1:
+        # Net sale prices are no longer ordered like prices so there is nothing to sweep
+        return match_orders(
+            from_arrays, to_arrays, item_volume, tax, min_profit, min_roi, max_budget, max_weight
+        )
+
+    from_index = np.flatnonzero(from_arrays['allowed'])
+    to_index = np.flatnonzero(to_arrays['allowed'])
+
+    from_index = from_index[np.argsort(from_arrays['price'][from_index], kind='stable')]
+    to_index = to_index[np.argsort(to_arrays['price'][to_index], kind='stable')]
+
+    # Closing orders by ascending net sale price, swept from the most expensive down
+    net_sale = to_arrays['price'][to_index] * (1 - tax)
+    to_volume_max = to_arrays['volume'][to_index].max() if to_index.size else 0
+    volume_cap = max_tradable_volume(item_volume, max_weight)
+
+    matched = []
+    for from_idx in from_index:
+        price = from_arrays['price'][from_idx]
+        best_volume = min(from_arrays['volume'][from_idx], to_volume_max, volume_cap)
+        if price <= 0 or best_volume <= 0:
+            continue
+
+        # Lowest net sale price that could still satisfy the ROI and profit thresholds
+        roi_cutoff = price * (1 + min_roi)
+        cutoff = roi_cutoff
+        if min_profit > 0:
+            cutoff = max(roi_cutoff, price + min_profit / best_volume)
+        start = np.searchsorted(net_sale, cutoff - abs(cutoff) * BOUND_TOLERANCE, side='left')
+
+        if start == net_sale.size:
+            # Later initial orders are more expensive so their ROI cutoff can only be higher
+            if 1 + min_roi > 0 and roi_cutoff - abs(roi_cutoff) * BOUND_TOLERANCE > net_sale[-1]:
+                break
+            continue
+
+        candidates = to_index[start:][::-1]
+        pairs = evaluate_pairs(
+            price, from_arrays['volume'][from_idx],
+            to_arrays['price'][candidates], to_arrays['volume'][candidates],
+            item_volume, tax, min_profit, min_roi, max_budget, max_weight
+        )
+        valid = pairs['valid']
+        if valid.any():
+            matched.append({
+                'from_index': np.full(np.count_nonzero(valid), from_idx),
+                'to_index': candidates[valid],
+                'volume': pairs['volume'][valid],
+                'quantity': pairs['quantity'][valid],
+                'weight': pairs['weight'][valid],
+                'profit': pairs['profit'][valid],
+                'roi': pairs['roi'][valid],
+            })
+
+    keys = ['from_index', 'to_index', 'volume', 'quantity', 'weight', 'profit', 'roi']
+    if not matched:
+        return {key: np.empty(0, dtype=np.int64 if key.endswith('index') else np.float64) for key in keys}
+
+    matches = {key: np.concatenate([match[key] for match in matched]) for key in keys}
+
+    # Restore the row-major order of the original order lists
+    order = np.lexsort((matches['to_index'], matches['from_index']))
+    return {key: values[order] for key, values in matches.items()}
+
+
+def evaluate_pairs(from_price, from_volume, to_price, to_volume, item_volume: float, tax: float,
+                   min_profit: float, min_roi: float, max_budget: float, max_weight: float) -> Dict[str, np.ndarray]:
+    '''
+    Compute volume, weight, profit and ROI of broadcastable initial and closing order arrays.
+
+    The arithmetic mirrors the pure-Python loop operation for operation so both produce
+    identical floating point results.
+    '''
+    volume = np.minimum(to_volume, from_volume)
+    weight = item_volume * volume
+
+    # Rearrange volume to be less than max weight
+    over_weight = weight > max_weight
+    if over_weight.any():
+        volume = np.where(over_weight, (max_weight / np.where(over_weight, weight, 1)) * volume, volume)
+        weight = item_volume * volume
+
+    quantity = np.round(volume, 0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        initial_price = from_price * volume
+        sale_price = to_price * volume * (1 - tax)
+        profit = sale_price - initial_price
+        roi = (sale_price - initial_price) / initial_price
+
+    valid = (volume > 0) & (weight > 0) & (quantity > 0) & \
+            (initial_price != 0) & \
+            (profit >= min_profit) & \
+            (roi >= min_roi) & \
+            (initial_price <= max_budget) & \
+            (weight <= max_weight)
+
+    return {
+        'valid': valid,
+        'volume': volume,
+        'quantity': quantity,
+        'weight': weight,
+        'profit': profit,
+        'roi': roi,
+    }
@@ -1,14 +1,50 @@
 import os
 import json
+import time
 import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import requests
+from requests.adapters import HTTPAdapter
 from elasticsearch import Elasticsearch
 
 # Create an Elasticsearch client
 
 es = Elasticsearch(os.environ['ES_HOST'])
 
+JUMP_DATA_INDEX = 'evetrade_jump_data'
+ROUTE_FLAGS = ['insecure', 'secure', 'shortest']
+
+# Process the whole SQS batch at once unless BATCH_MODE=false
+BATCH_MODE = os.getenv('BATCH_MODE', 'true').lower() != 'false'
+
+ESI_BASE_URL = os.getenv('ESI_BASE_URL', 'https://esi.evetech.net')
+ESI_CONCURRENCY = int(os.getenv('ESI_CONCURRENCY', '20'))
+ESI_MAX_ATTEMPTS = 3
+
+# Pause every request when fewer errors than this remain in the ESI error limit window
+ESI_ERROR_LIMIT_THRESHOLD = 10
+
+# Pooled ESI session shared by all worker threads
+session = requests.Session()
+session.headers.update({'User-Agent': 'evetrade-jump-count-processor'})
+session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=ESI_CONCURRENCY))
+session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=ESI_CONCURRENCY))
+
+# Fill in every part of each fetched route and skip flags that match the shortest route
+# unless ROUTE_REUSE=false
+ROUTE_REUSE = os.getenv('ROUTE_REUSE', 'true').lower() != 'false'
+SECURITY_URL = 'https://evetrade.s3.amazonaws.com/resources/systemIdToSecurity.json'
+
+system_security = {}
+
+# Returned by fetch_route when ESI did not answer after every attempt
+FETCH_FAILED = object()
+
+esi_error_limit = {'paused_until': 0.0}
+esi_error_limit_lock = threading.Lock()
+
 def get_route_data_from_esi(start, end, route_type):
     esi_api_route = f'https://esi.evetech.net/latest/route/{start}/{end}/?datasource=tranquility&flag={route_type}'
     print(f'Sending: {esi_api_route}')
@@ -51,8 +87,10 @@ def get_doc_ids_from_elasticsearch(start, end):
     for route_str in [f"{start}-{end}", f"{end}-{start}"]:
         if route_ids.get(route_str) is None:
             print(f'Route ID not found for {route_str}. Creating new route in Elasticsearch')
+            # The route is the document ID so the API can fetch routes with a multi-get
             response = es.index(
                 index="evetrade_jump_data",
+                id=route_str,
                 body={
                     "route": route_str,
                     "insecure": -1,
@@ -82,9 +120,225 @@ async def update_elasticsearch_record(doc_id, start, end, insecure, secure, shor
     # Update the document
     es.update(index=params["index"], id=params["id"], body=params["body"])
 
+def wait_for_error_limit():
+    with esi_error_limit_lock:
+        paused_until = esi_error_limit['paused_until']
+    delay = paused_until - time.monotonic()
+    if delay > 0:
+        time.sleep(delay)
+
+def track_error_limit(response):
+    # ESI blocks every request once too many errors are made, so pause until the window resets
+    remain = response.headers.get('X-ESI-Error-Limit-Remain')
+    reset = response.headers.get('X-ESI-Error-Limit-Reset')
+    if response.status_code == 420 or (remain is not None and int(remain) < ESI_ERROR_LIMIT_THRESHOLD):
+        pause = int(reset or 60)
+        print(f'ESI error limit reached, pausing for {pause} seconds.')
+        with esi_error_limit_lock:
+            esi_error_limit['paused_until'] = max(esi_error_limit['paused_until'], time.monotonic() + pause)
+        return True
+    return False
+
+def fetch_route(start, end, route_type):
+    # Returns the systems of the route including both ends, None if there is no route,
+    # or FETCH_FAILED if ESI could not answer, so the route is not overwritten
+    url = f'{ESI_BASE_URL}/latest/route/{start}/{end}/'
+    params = {'datasource': 'tranquility', 'flag': route_type}
+
+    for _ in range(ESI_MAX_ATTEMPTS):
+        wait_for_error_limit()
+        try:
+            response = session.get(url, params=params, timeout=10)
+        except requests.exceptions.RequestException as e:
+            print(f'Error fetching {url} ({route_type}): {e}')
+            continue
+
+        track_error_limit(response)
+        if response.status_code == 200:
+            data = response.json()
+            if isinstance(data, list):
+                return data
+            print(f'Unexpected response from {url} ({route_type}): {data}')
+            continue
+        if 400 <= response.status_code < 500 and response.status_code != 420:
+            # No route exists between the systems
+            return None
+    return FETCH_FAILED
+
+def fetch_route_length(start, end, route_type):
+    # Returns the route length, -1 if there is no route or None if ESI could not answer
+    route = fetch_route(start, end, route_type)
+    if route is FETCH_FAILED:
+        return None
+    return len(route) if route is not None else -1
+
+def fetch_route_lengths(pairs):
+    tasks = [(start, end, route_type) for start, end in pairs for route_type in ROUTE_FLAGS]
+    with ThreadPoolExecutor(max_workers=ESI_CONCURRENCY) as executor:
+        lengths = list(executor.map(lambda task: fetch_route_length(*task), tasks))
+
+    routes = {}
+    for (start, end, route_type), length in zip(tasks, lengths):
+        if length is not None:
+            routes.setdefault((start, end), {})[route_type] = length
+    return routes
+
+def get_high_sec_systems():
+    if 'high_sec' not in system_security:
+        try:
+            response = session.get(SECURITY_URL, timeout=30)
+            response.raise_for_status()
+            system_security['high_sec'] = {
+                int(system_id) for system_id, system in response.json().items()
+                if system.get('security_code') == 'high_sec'
+            }
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f'Unable to load system security, fetching every route flag: {e}')
+            return None
+    return system_security['high_sec']
+
+def is_same_as_shortest(path, route_type, high_sec):
+    # The shortest route is also the secure route when it only enters high security systems,
+    # and the insecure route when it never enters one
+    entered = path[1:]
+    if route_type == 'secure':
+        return all(system in high_sec for system in entered)
+    return not any(system in high_sec for system in entered)
+
+def fetch_route_paths(pairs):
+    high_sec = get_high_sec_systems()
+
+    with ThreadPoolExecutor(max_workers=ESI_CONCURRENCY) as executor:
+        shortest = list(executor.map(lambda pair: fetch_route(*pair, 'shortest'), pairs))
+
+        paths = {}
+        tasks = []
+        for pair, path in zip(pairs, shortest):
+            paths[pair] = {'shortest': path}
+            for route_type in ['secure', 'insecure']:
+                # Without a shortest route there is no route at all
+                if path is FETCH_FAILED:
+                    tasks.append((*pair, route_type))
+                elif path is None or (high_sec is not None and is_same_as_shortest(path, route_type, high_sec)):
+                    paths[pair][route_type] = path
+                else:
+                    tasks.append((*pair, route_type))
+
+        for (start, end, route_type), path in zip(tasks, executor.map(lambda task: fetch_route(*task), tasks)):
+            paths[(start, end)][route_type] = path
+
+    print(f'Fetched {len(pairs) + len(tasks)} of {len(pairs) * len(ROUTE_FLAGS)} routes from ESI.')
+    return paths
+
+def set_route_length(lengths, route_type, length):
+    # Keeps the shortest known length, a route found elsewhere wins over no route
+    known = lengths.get(route_type)
+    if known is None or known == -1 or (length != -1 and length < known):
+        lengths[route_type] = length
+
+def collect_route_lengths(paths):
+    # Every part of a best route is itself a best route, so each pair of systems
+    # on a returned route gets the length of the part between them.
+    # Routes ESI failed to answer are left out so their stored counts are kept.
+    routes = {}
+    for (start, end), route_paths in paths.items():
+        for route_type, path in route_paths.items():
+            if path is FETCH_FAILED:
+                continue
+            if path is None:
+                set_route_length(routes.setdefault((start, end), {}), route_type, -1)
+                continue
+
+            systems = [str(system) for system in path]
+            for i in range(len(systems)):
+                for j in range(i + 1, len(systems)):
+                    pair = get_unordered_pair(systems[i], systems[j])
+                    set_route_length(routes.setdefault(pair, {}), route_type, j - i + 1)
+    return routes
+
+def get_unordered_pair(start, end):
+    return (start, end) if int(start) <= int(end) else (end, start)
+
+def get_legacy_doc_ids(routes):
+    # Routes created before documents were keyed by route have generated IDs
+    legacy_ids = {}
+    response = es.search(
+        index=JUMP_DATA_INDEX,
+        size=10000,
+        _source=['route'],
+        body={'query': {'terms': {'route.keyword': routes}}},
+    )
+    for hit in response['hits']['hits']:
+        route = hit['_source']['route']
+        if hit['_id'] != route:
+            legacy_ids.setdefault(route, []).append(hit['_id'])
+    return legacy_ids
+
+def build_bulk_body(routes, requested_routes):
+    last_modified = int(datetime.now().timestamp() * 1000)
+    documents = {}
+    for (start, end), lengths in routes.items():
+        # Routes are symmetric so both directions get the same values
+        for new_start, new_end in [(start, end), (end, start)]:
+            route = f'{new_start}-{new_end}'
+            doc = {'route': route, **lengths}
+            # Routes with only some flags known keep their age so the others are still refreshed
+            if all(route_type in lengths for route_type in ROUTE_FLAGS):
+                doc['last_modified'] = last_modified
+            upsert = {'route': route, **{route_type: -1 for route_type in ROUTE_FLAGS}, **doc,
+                      'last_modified': last_modified}
+            documents[route] = (doc, upsert)
+
+    legacy_ids = get_legacy_doc_ids(requested_routes)
+
+    body = []
+    for route, (doc, upsert) in documents.items():
+        body.append({'update': {'_index': JUMP_DATA_INDEX, '_id': route}})
+        body.append({'doc': doc, 'upsert': upsert})
+        for doc_id in legacy_ids.get(route, []):
+            body.append({'update': {'_index': JUMP_DATA_INDEX, '_id': doc_id}})
+            body.append({'doc': doc})
+    return body
+
+def process_batch(records):
+    pairs = []
+    requested_routes = []
+    for record in records:
+        payload = json.loads(record['body'])
+        start, end = str(payload['start']), str(payload['end'])
+        requested_routes.extend([f'{start}-{end}', f'{end}-{start}'])
+
+        # Both directions of a route have the same length so each pair is fetched once
+        pair = get_unordered_pair(start, end)
+        if pair not in pairs:
+            pairs.append(pair)
+
+    if ROUTE_REUSE:
+        routes = collect_route_lengths(fetch_route_paths(pairs))
+    else:
+        print(f'Fetching {len(pairs)} routes from ESI.')
+        routes = fetch_route_lengths(pairs)
+
+    if routes:
+        body = build_bulk_body(routes, list(dict.fromkeys(requested_routes)))
+        response = es.bulk(body=body)
+        if response.get('errors'):
+            failed = [item for item in response['items'] if item['update'].get('error')]
+            print(f'Failed to update {len(failed)} routes: {failed[:10]}')
+
+    print(f'Updated {len(routes)} routes from {len(pairs)} requested routes.')
+    for pair in pairs:
+        print({'start': pair[0], 'end': pair[1], **routes.get(pair, {})})
+
+    return routes
+
 def lambda_handler(event, context):
     print(event)
 
+    if BATCH_MODE:
+        process_batch(event["Records"])
+        return
+
     # Loop through each record in the event["Records"]
     for record in event["Records"]:
         payload = json.loads(record["body"])
@@ -1,13 +1,59 @@
+import io
+import os
+import bz2
+import csv
 import json
+import zlib
+import struct
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 import requests
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
 from statistics import mean
+import brotli
 
 # Initialize AWS S3 and CloudWatch clients
 s3 = boto3.client('s3')
 cloudwatch = boto3.client('cloudwatch', region_name='us-east-1')
 
+RESOURCE_BUCKET = 'evetrade'
+SYNC_CONCURRENCY = int(os.getenv('SYNC_CONCURRENCY', '8'))
+
+# Files above the threshold are uploaded in parts, several at a time
+transfer_config = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=8 * 1024 * 1024,
+    max_concurrency=4,
+)
+
+# Consumers look up the content hashed key of each resource in the manifest
+MANIFEST_KEY = 'resources/manifest.json'
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+VARIANT_SUFFIXES = {'gzip': '.gz', 'br': '.br'}
+BROTLI_QUALITY = 9
+
+# Stargate jumps of the static data export, published as the systemJumps resource
+# that api/utils/route_engine.py solves jump counts over
+SYSTEM_JUMPS_URL = os.getenv('SYSTEM_JUMPS_URL', 'https://www.fuzzwork.co.uk/dump/latest/mapSolarSystemJumps.csv.bz2')
+SYSTEM_JUMPS_RESOURCE = 'systemJumps.json'
+
+# S3 metadata holding the GitHub blob SHA a resource was synchronized from
+SHA_METADATA = 'github-sha'
+
+# Resources also published as compact integer keyed tables, as (column, field, kind).
+# The format must match api/utils/compact_table.py which reads these files. This job is
+# deployed on its own, so tests/test_synchronize_universe_resources.py checks both stay equal.
+COMPACT_MAGIC = b'EVTRCT01'
+COMPACT_COLUMNS = {
+    'typeIDToName': [('name', 'name', 'str'), ('volume', 'volume', 'float')],
+    'stationIdToName': [('name', None, 'str')],
+    'systemIdToSecurity': [('security_code', 'security_code', 'category'), ('rating', 'rating', 'float')],
+    'structureInfo': [('name', 'name', 'str')],
+}
+
 def get_request(url):
     headers = {'User-Agent': 'evetrade-api-lambda'}
 
@@ -28,11 +74,61 @@ def get_security_code(security):
     else:
         return -1
 
+def compile_compact_table(mapping, columns):
+    items = sorted((int(key), value) for key, value in mapping.items())
+    blocks = []
+
+    def add_block(block):
+        blocks.append(block)
+        return len(blocks) - 1
+
+    id_block = add_block(struct.pack(f'<{len(items)}q', *[key for key, _ in items]))
+    header = {'count': len(items), 'columns': {'id': {'kind': 'int', 'block': id_block}}}
+
+    for column, field, kind in columns:
+        values = [value if field is None else (value.get(field) if isinstance(value, dict) else None)
+                  for _, value in items]
+        spec = {'kind': kind}
+
+        if kind == 'float':
+            spec['block'] = add_block(struct.pack(
+                f'<{len(values)}d', *[float('nan') if value is None else float(value) for value in values]
+            ))
+        elif kind == 'category':
+            spec['categories'] = sorted({str(value) for value in values if value is not None})
+            codes = {category: code for code, category in enumerate(spec['categories'])}
+            spec['block'] = add_block(struct.pack(
+                f'<{len(values)}h', *[-1 if value is None else codes[str(value)] for value in values]
+            ))
+        else:
+            encoded = [b'' if value is None else str(value).encode('utf-8') for value in values]
+            offsets = [0]
+            for value in encoded:
+                offsets.append(offsets[-1] + len(value))
+            spec['block'] = add_block(struct.pack(f'<{len(offsets)}q', *offsets))
+            spec['blob_block'] = add_block(b''.join(encoded))
+
+        header['columns'][column] = spec
+
+    header['blocks'] = [len(block) for block in blocks]
+    encoded_header = json.dumps(header).encode('utf-8')
+
+    # Every block starts on an 8 byte boundary so it can be read in place
+    parts = [COMPACT_MAGIC, struct.pack('<I', len(encoded_header)), encoded_header]
+    position = len(COMPACT_MAGIC) + 4 + len(encoded_header)
+    for block in blocks:
+        padding = (8 - position % 8) % 8
+        parts.append(b'\0' * padding)
+        parts.append(block)
+        position += padding + len(block)
+
+    return b''.join(parts)
+
 def upload_to_s3(bucket, key, body, content_type):
     upload_params = {
         'Bucket': bucket,
         'Key': key,
-        'Body': json.dumps(body),
+        'Body': body if isinstance(body, bytes) else json.dumps(body),
         'ContentType': content_type
     }
 
@@ -44,6 +140,188 @@ def upload_to_s3(bucket, key, body, content_type):
     except Exception as e:
         print(f'Failed: {e}')
 
+def get_synced_sha(bucket, key):
+    try:
+        return s3.head_object(Bucket=bucket, Key=key)['Metadata'].get(SHA_METADATA)
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+            return None
+        raise
+
+class PublishingReader:
+    # Passes a stream through to S3 while hashing and compressing it in the same pass.
+    # It has no seek, so S3 reads the parts in order.
+    def __init__(self, stream):
+        self.stream = stream
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+        # A window of 16 + 15 bits writes a gzip header and trailer
+        self.compressors = {
+            'gzip': zlib.compressobj(9, zlib.DEFLATED, 31),
+            'br': brotli.Compressor(quality=BROTLI_QUALITY),
+        }
+        self.compressed = {encoding: [] for encoding in self.compressors}
+
+    def read(self, size=-1):
+        chunk = self.stream.read(size)
+        if chunk:
+            self.sha256.update(chunk)
+            self.size += len(chunk)
+            self.compressed['gzip'].append(self.compressors['gzip'].compress(chunk))
+            self.compressed['br'].append(self.compressors['br'].process(chunk))
+        return chunk
+
+    def variants(self):
+        self.compressed['gzip'].append(self.compressors['gzip'].flush())
+        self.compressed['br'].append(self.compressors['br'].finish())
+        return {encoding: b''.join(parts) for encoding, parts in self.compressed.items()}
+
+def upload_stream(bucket, key, stream, content_type, sha):
+    s3.upload_fileobj(
+        stream, bucket, key,
+        ExtraArgs={'ContentType': content_type, 'Metadata': {SHA_METADATA: sha}},
+        Config=transfer_config,
+    )
+
+def publish_resource(bucket, file_name, stream, content_type, sha):
+    # Uploads a resource with its compressed variants and content hashed copies,
+    # and returns its manifest entry
+    reader = PublishingReader(stream)
+    upload_stream(bucket, f'resources/{file_name}', reader, content_type, sha)
+    variants = reader.variants()
+
+    stem, extension = file_name.rsplit('.', 1)
+    hashed_name = f'hashed/{stem}.{reader.sha256.hexdigest()[:16]}.{extension}'
+    s3.copy_object(
+        Bucket=bucket, Key=f'resources/{hashed_name}',
+        CopySource={'Bucket': bucket, 'Key': f'resources/{file_name}'},
+        MetadataDirective='REPLACE', ContentType=content_type, CacheControl=IMMUTABLE_CACHE_CONTROL,
+    )
+
+    encodings = {}
+    for encoding, body in variants.items():
+        suffix = VARIANT_SUFFIXES[encoding]
+        encodings[encoding] = f'{hashed_name}{suffix}'
+        for key, cache_control in [(f'resources/{file_name}{suffix}', None),
+                                   (f'resources/{hashed_name}{suffix}', IMMUTABLE_CACHE_CONTROL)]:
+            upload_params = {'Bucket': bucket, 'Key': key, 'Body': body,
+                             'ContentType': content_type, 'ContentEncoding': encoding}
+            if cache_control:
+                upload_params['CacheControl'] = cache_control
+            s3.put_object(**upload_params)
+
+    return {
+        'key': hashed_name,
+        'sha256': reader.sha256.hexdigest(),
+        'size': reader.size,
+        'encodings': encodings,
+    }
+
+def load_manifest(bucket):
+    try:
+        return json.loads(s3.get_object(Bucket=bucket, Key=MANIFEST_KEY)['Body'].read())
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+            return {'resources': {}}
+        raise
+
+def save_manifest(bucket, manifest):
+    # Consumers revalidate the manifest and cache the content hashed keys it points to forever
+    s3.put_object(
+        Bucket=bucket, Key=MANIFEST_KEY, Body=json.dumps(manifest, sort_keys=True).encode('utf-8'),
+        ContentType='application/json', CacheControl='no-cache',
+    )
+
+def sync_resource(bucket, resource, manifest):
+    key = f"resources/{resource['name']}"
+    resource_name = resource['name'].rsplit('.', 1)[0]
+    compact = resource_name in COMPACT_COLUMNS
+    published = [resource['name']] + ([f'{resource_name}.bin'] if compact else [])
+
+    # The GitHub blob SHA changes with the file content, so a matching SHA means nothing changed
+    if all(name in manifest['resources'] for name in published) and get_synced_sha(bucket, key) == resource['sha'] and (
+        not compact or get_synced_sha(bucket, f'resources/{resource_name}.bin') == resource['sha']
+    ):
+        print(f'Skipping unchanged {key}')
+        return False
+
+    headers = {'User-Agent': 'evetrade-api-lambda'}
+    with requests.get(resource['download_url'], headers=headers, stream=True, timeout=60) as response:
+        response.raise_for_status()
+
+        entries = {}
+        if compact:
+            # Compact tables are compiled from the parsed file, so it is read whole
+            content = response.content
+            compact_body = compile_compact_table(json.loads(content), COMPACT_COLUMNS[resource_name])
+            entries[f'{resource_name}.bin'] = publish_resource(
+                bucket, f'{resource_name}.bin', io.BytesIO(compact_body), 'application/octet-stream', resource['sha']
+            )
+            entries[resource['name']] = publish_resource(
+                bucket, resource['name'], io.BytesIO(content), 'application/json', resource['sha']
+            )
+        else:
+            # The raw bytes are uploaded as they are downloaded, without parsing
+            response.raw.decode_content = True
+            entries[resource['name']] = publish_resource(
+                bucket, resource['name'], response.raw, 'application/json', resource['sha']
+            )
+
+    manifest['resources'].update(entries)
+    print(f'Uploaded {key}')
+    return True
+
+def sync_resources(bucket, resources):
+    manifest = load_manifest(bucket)
+
+    def sync(resource):
+        try:
+            return sync_resource(bucket, resource, manifest)
+        except Exception as e:
+            print(f"Error synchronizing {resource['name']}: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=SYNC_CONCURRENCY) as executor:
+        results = list(executor.map(sync, resources))
+
+    if True in results:
+        save_manifest(bucket, manifest)
+
+    print(f'Uploaded {results.count(True)}, skipped {results.count(False)} and failed {results.count(None)} of {len(resources)} resources.')
+    return results
+
+def build_system_jumps(rows):
+    # Maps each system ID to the sorted IDs of the systems its stargates lead to
+    system_jumps = {}
+    for row in rows:
+        system_jumps.setdefault(int(row['fromSolarSystemID']), set()).add(int(row['toSolarSystemID']))
+    return {str(system_id): sorted(neighbors) for system_id, neighbors in sorted(system_jumps.items())}
+
+def sync_system_jumps(bucket):
+    headers = {'User-Agent': 'evetrade-api-lambda'}
+    response = requests.get(SYSTEM_JUMPS_URL, headers=headers, timeout=60)
+    response.raise_for_status()
+
+    content = bz2.decompress(response.content) if SYSTEM_JUMPS_URL.endswith('.bz2') else response.content
+    system_jumps = build_system_jumps(csv.DictReader(io.StringIO(content.decode('utf-8'))))
+    if not system_jumps:
+        raise RuntimeError(f'No stargate jumps found in {SYSTEM_JUMPS_URL}')
+
+    body = json.dumps(system_jumps, separators=(',', ':')).encode('utf-8')
+    sha = hashlib.sha256(body).hexdigest()
+
+    manifest = load_manifest(bucket)
+    if manifest['resources'].get(SYSTEM_JUMPS_RESOURCE, {}).get('sha256') == sha:
+        print(f'Skipping unchanged resources/{SYSTEM_JUMPS_RESOURCE}')
+        return False
+
+    manifest['resources'][SYSTEM_JUMPS_RESOURCE] = publish_resource(
+        bucket, SYSTEM_JUMPS_RESOURCE, io.BytesIO(body), 'application/json', sha
+    )
+    save_manifest(bucket, manifest)
+    print(f'Uploaded resources/{SYSTEM_JUMPS_RESOURCE} with {len(system_jumps)} systems')
+    return True
+
 def calculate_p95(arr):
     mean_value = mean(arr)
     squared_diff = [(k - mean_value) ** 2 for k in arr]
@@ -91,7 +369,7 @@ def lambda_handler(event, context):
         function_durations[function_name] = round(duration, 2)
         print(f'{function_name} average is {round(duration, 2)} seconds')
 
-    upload_to_s3('evetrade', 'resources/functionDurations.json', function_durations, 'application/json')
+    upload_to_s3(RESOURCE_BUCKET, 'resources/functionDurations.json', function_durations, 'application/json')
 
     # Get data from GitHub resources
     res_endpoint = 'https://api.github.com/repos/awhipp/evetrade_resources/contents/resources'
@@ -100,9 +378,12 @@ def lambda_handler(event, context):
 
     try:
         data = get_request(res_endpoint)
-
-        for resource in data:
-            body = get_request(resource['download_url'])
-            upload_to_s3('evetrade', f"resources/{resource['name']}", body, 'application/json')
+        sync_resources(RESOURCE_BUCKET, [resource for resource in data if resource['type'] == 'file'])
     except RuntimeError as e:
-        print(f"Error: {e}")
\ No newline at end of file
+        print(f"Error: {e}")
+
+    # The manifest is written by the GitHub sync first, so the stargate graph is published after it
+    try:
+        sync_system_jumps(RESOURCE_BUCKET)
+    except (RuntimeError, requests.exceptions.RequestException, ClientError) as e:
+        print(f"Error synchronizing {SYSTEM_JUMPS_RESOURCE}: {e}")
@@ -23,3 +23,66 @@ def mock_boto_sqs(mocker):
     sqs = mocker.patch('boto3.client')
     sqs.return_value = mocker.MagicMock()
     sqs.return_value.send_message.return_value = {}
+
+
+@pytest.fixture()
+def reference_resources(monkeypatch):
+    '''
+    Seed the reference data cache with small resources so no download happens.
+    '''
+    from api.utils import reference_data # pylint: disable=import-outside-toplevel
+    from api.utils.compact_table import COMPACT_COLUMNS, CompactTable # pylint: disable=import-outside-toplevel
+
+    resources = {
+        'typeIDToName': {
+            '34': {'name': 'Tritanium', 'volume': 0.01},
+            '587': {'name': 'Rifter', 'volume': 27289},
+        },
+        'stationIdToName': {
+            '60003760': 'Jita IV - Moon 4 - Caldari Navy Assembly Plant',
+            '60008494': 'Amarr VIII (Oris) - Emperor Family Academy',
+            '60011866': 'Dodixie IX - Moon 20 - Federation Navy Assembly Plant',
+        },
+        'structureInfo': {
+            '1022734985679': {'name': 'Perimeter - Tranquility Trading Tower'},
+        },
+        'systemIdToSecurity': {
+            '30000142': {'security_code': 'high_sec', 'rating': 0.9},
+            '30000144': {'security_code': 'high_sec', 'rating': 1.0},
+            '30002187': {'security_code': 'high_sec', 'rating': 1.0},
+            '30002659': {'security_code': 'high_sec', 'rating': 0.9},
+            '30002813': {'security_code': 'low_sec', 'rating': 0.4},
+        },
+    }
+
+    for name, data in resources.items():
+        monkeypatch.setitem(reference_data.resource_cache, f'{name}.json', {
+            'data': data, 'etag': None, 'last_modified': None, 'checked_at': float('inf')
+        })
+        monkeypatch.setitem(reference_data.resource_cache, f'{name}.bin', {
+            'data': CompactTable.from_mapping(data, COMPACT_COLUMNS[name]),
+            'etag': None, 'last_modified': None, 'checked_at': float('inf')
+        })
+    monkeypatch.setattr(reference_data, 'manifest_state', {'unavailable_until': float('inf')})
+
+    return resources
+
+
+@pytest.fixture()
+def hauling_module(monkeypatch, reference_resources): # pylint: disable=unused-argument
+    '''
+    Import the hauling module with small reference data sets.
+    '''
+    import api.evetrade.hauling as hauling # pylint: disable=import-outside-toplevel
+    from api.utils import route_engine # pylint: disable=import-outside-toplevel
+    from api.utils.lru_cache import LRUCache # pylint: disable=import-outside-toplevel
+
+    monkeypatch.setattr(hauling, 'jump_count', {})
+    monkeypatch.setattr(hauling, 'refresh_routes', set())
+    monkeypatch.setattr(hauling, 'route_cache', LRUCache(100, 60))
+    # Routes are looked up in ES unless a test provides a stargate graph
+    monkeypatch.setattr(route_engine, 'graph_state', {
+        'graph': None, 'sources': None, 'unavailable_until': float('inf')
+    })
+
+    return hauling
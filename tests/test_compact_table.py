@@ -0,0 +1,52 @@
+'''
+Tests for the compact integer keyed reference tables.
+'''
+import math
+
+import numpy as np
+
+from api.utils.compact_table import COMPACT_COLUMNS, CompactTable
+
+
+def test_compact_table_lookups() -> None:
+    '''
+    Values are looked up by integer ID and missing fields or IDs are reported.
+    '''
+    # ASSIGN
+    mapping = {
+        '587': {'name': 'Rifter', 'volume': 27289},
+        '34': {'name': 'Tritanium', 'volume': 0.01},
+        '35': {'name': 'Pyérite'},
+    }
+
+    # ACT
+    table = CompactTable.from_mapping(mapping, COMPACT_COLUMNS['typeIDToName'])
+
+    # ASSERT
+    assert len(table) == 3
+    assert table.value(587, 'name') == 'Rifter'
+    assert table.value(35, 'name') == 'Pyérite'
+    assert table.value(34, 'volume') == 0.01
+    assert math.isnan(table.value(35, 'volume'))
+    assert 36 not in table
+    assert table.rows(np.array([34, 36, 587])).tolist() == [0, -1, 2]
+
+
+def test_compact_table_categories() -> None:
+    '''
+    Categorical columns are stored as codes that can be matched without strings.
+    '''
+    # ASSIGN
+    mapping = {
+        '30000142': {'security_code': 'high_sec', 'rating': 0.9},
+        '30002813': {'security_code': 'low_sec', 'rating': 0.4},
+        '30004759': {'security_code': 'null_sec', 'rating': -0.5},
+    }
+
+    # ACT
+    table = CompactTable.from_mapping(mapping, COMPACT_COLUMNS['systemIdToSecurity'])
+    codes = table.category_codes('security_code', ['high_sec', 'low_sec'])
+
+    # ASSERT
+    assert table.ids[np.isin(table.column('security_code'), codes)].tolist() == [30000142, 30002813]
+    assert table.value(30004759, 'security_code') == 'null_sec'
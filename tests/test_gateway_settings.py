@@ -0,0 +1,71 @@
+'''
+Tests for loading and refreshing the gateway settings from Redis.
+'''
+import fakeredis
+import pytest
+
+from api import gateway
+from api.utils import startup
+
+
+@pytest.fixture()
+def redis_settings(monkeypatch):
+    '''
+    Serve the gateway settings from a local stand-in for Redis.
+    '''
+    redis_client = fakeredis.FakeRedis()
+    redis_client.mset({'IP_WHITE_LIST': '127.0.0.1', 'IP_BAN_LIST': '10.0.0.0/8'})
+    monkeypatch.setattr(startup, 'clients', {'redis': redis_client})
+    monkeypatch.setattr(gateway, 'settings', {})
+    monkeypatch.setattr(gateway, 'settings_state', {'loaded_at': 0.0, 'refreshing': False})
+    return redis_client
+
+
+def test_authorization_uses_ip_ranges(redis_settings) -> None:
+    '''
+    White listed addresses and banned ranges are matched.
+    '''
+    # ACT
+    white_listed = gateway.check_authorization({'x-forwarded-for': '127.0.0.1'})
+    banned = gateway.check_authorization({'x-forwarded-for': '10.1.2.3', 'origin': 'https://evetrade.space'})
+    allowed = gateway.check_authorization({'x-forwarded-for': '11.1.2.3', 'origin': 'https://evetrade.space'})
+
+    # ASSERT
+    assert white_listed == gateway.HTTPStatus.WHITELISTED
+    assert banned == gateway.HTTPStatus.UNAUTHORIZED
+    assert allowed == gateway.HTTPStatus.OK
+
+
+def test_settings_refresh_in_background(mocker, monkeypatch, redis_settings) -> None:
+    '''
+    Stale settings are reloaded from Redis without blocking the request.
+    '''
+    # ASSIGN
+    gateway.get_settings()
+    redis_settings.set('IP_BAN_LIST', '11.0.0.0/8')
+    monkeypatch.setattr(gateway, 'SETTINGS_TTL', 0)
+    thread = mocker.patch('threading.Thread')
+    thread.return_value.start.side_effect = gateway.refresh_settings
+
+    # ACT
+    gateway.get_settings()
+
+    # ASSERT
+    assert thread.call_count == 1
+    assert '11.1.2.3' in gateway.settings['IP_BAN_LIST']
+    assert '10.1.2.3' not in gateway.settings['IP_BAN_LIST']
+
+
+def test_settings_are_kept_when_redis_fails(mocker, redis_settings) -> None:
+    '''
+    A failed refresh keeps serving the last loaded settings.
+    '''
+    # ASSIGN
+    gateway.get_settings()
+    mocker.patch.object(redis_settings, 'mget', side_effect=ConnectionError())
+
+    # ACT
+    gateway.refresh_settings()
+
+    # ASSERT
+    assert '10.1.2.3' in gateway.settings['IP_BAN_LIST']
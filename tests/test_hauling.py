@@ -0,0 +1,293 @@
+'''
+Tests for the hauling trade matching logic.
+'''
+import asyncio
+import random
+import threading
+import time
+
+import fakeredis
+import pytest
+
+from api.utils import result_cache, route_engine, startup
+from api.utils.order_book import OrderBook
+from api.utils.route_engine import JumpGraph
+
+STATIONS = [
+    (60003760, 30000142),
+    (60008494, 30002187),
+    (60011866, 30002659),
+    (1022734985679, 30000144),
+    (60008494, 30002813),
+]
+
+
+def generate_hits(seed: int, count: int) -> list:
+    '''
+    Generate deterministic order hits spread over a few stations and type IDs.
+    '''
+    generator = random.Random(seed)
+    orders = []
+    for _ in range(count):
+        station_id, system_id = generator.choice(STATIONS)
+        type_id = generator.choice([34, 587])
+        base_price = 5.0 if type_id == 34 else 500000.0
+        orders.append({'_source': {
+            'type_id': type_id,
+            'station_id': station_id,
+            'system_id': system_id,
+            'price': round(base_price * generator.uniform(0.5, 1.5), 2),
+            'volume_remain': generator.randint(0, 5000000 if type_id == 34 else 40),
+        }})
+    return orders
+
+
+def generate_orders(seed: int, count: int) -> OrderBook:
+    '''
+    Generate a deterministic book of orders spread over a few stations and type IDs.
+    '''
+    return OrderBook.from_hits(
+        generate_hits(seed, count), ['volume_remain', 'price', 'station_id', 'system_id', 'type_id']
+    )
+
+
+@pytest.mark.parametrize('thresholds', [
+    {'min_profit': 0, 'min_roi': 0, 'max_budget': float('inf'), 'max_weight': float('inf')},
+    {'min_profit': 500000, 'min_roi': 0.04, 'max_budget': float('inf'), 'max_weight': 30000},
+    {'min_profit': 100000, 'min_roi': 0.1, 'max_budget': 5000000, 'max_weight': 60000},
+])
+@pytest.mark.parametrize('matching', ['vectorized', 'sweep'])
+def test_vectorized_matches_loop(hauling_module, thresholds, matching) -> None:
+    '''
+    The vectorized and sweep engines return exactly the same trades as the pure-Python loop.
+    '''
+    # ASSIGN
+    orders = hauling_module.remove_mismatch_type_ids(generate_orders(1, 150), generate_orders(2, 150))
+    arguments = (
+        orders['from'], orders['to'], 0.075,
+        thresholds['min_profit'], thresholds['min_roi'], thresholds['max_budget'], thresholds['max_weight'],
+        ['high_sec'],
+    )
+
+    # ACT
+    loop_trades = asyncio.run(hauling_module.get_valid_trades(*arguments, matching='loop'))
+    loop_routes = dict(hauling_module.jump_count)
+    hauling_module.jump_count.clear()
+    vectorized_trades = asyncio.run(hauling_module.get_valid_trades(*arguments, matching=matching))
+
+    # ASSERT
+    assert len(loop_trades) > 0
+    assert vectorized_trades == loop_trades
+    assert hauling_module.jump_count == loop_routes
+
+
+@pytest.mark.parametrize('limit', [1, 25, 100000, 0, -5])
+def test_limit_keeps_most_profitable_trades(hauling_module, limit) -> None:
+    '''
+    The top-K mode returns the same trades as taking the K most profitable of all trades.
+    A limit below 1 returns every trade.
+    '''
+    # ASSIGN
+    orders = hauling_module.remove_mismatch_type_ids(generate_orders(3, 200), generate_orders(4, 200))
+    arguments = (orders['from'], orders['to'], 0.075, 100000, 0.04, float('inf'), 30000, ['high_sec'])
+
+    # ACT
+    all_trades = asyncio.run(hauling_module.get_valid_trades(*arguments))
+    hauling_module.jump_count.clear()
+    top_trades = asyncio.run(hauling_module.get_valid_trades(*arguments, limit=limit))
+    loop_top_trades = asyncio.run(hauling_module.get_valid_trades(*arguments, matching='loop', limit=limit))
+    sweep_top_trades = asyncio.run(hauling_module.get_valid_trades(*arguments, matching='sweep', limit=limit))
+
+    # ASSERT
+    kept = limit if limit > 0 else len(all_trades)
+    expected = sorted(all_trades, key=lambda trade: trade['Net Profit'], reverse=True)[:kept]
+    assert len(top_trades) == min(kept, len(all_trades))
+    assert sorted(top_trades, key=lambda trade: trade['Net Profit'], reverse=True) == expected
+    assert top_trades == loop_top_trades
+    assert top_trades == sweep_top_trades
+
+
+def test_get_limit_parses_query_values(hauling_module) -> None:
+    '''
+    Limits are parsed the way the result cache normalizes them, so equal keys give equal results.
+    '''
+    # ACT / ASSERT
+    assert hauling_module.get_limit('10') == hauling_module.get_limit('10.0') == 10
+    assert hauling_module.get_limit(None) is None
+    assert hauling_module.get_limit('0') is None
+    assert hauling_module.get_limit('-3') is None
+    assert hauling_module.get_limit('inf') is None
+
+
+def test_get_orders_runs_concurrently(hauling_module, monkeypatch) -> None:
+    '''
+    Both sides of a hauling trade are retrieved at the same time.
+    '''
+    # ASSIGN
+    barrier = threading.Barrier(2, timeout=5)
+
+    def stream_orders(location_string, order_type, structure_type): # pylint: disable=unused-argument
+        # Only returns once both retrievals are in flight
+        barrier.wait()
+        yield [{'_source': {
+            'type_id': 34, 'station_id': 60003760, 'system_id': 30000142, 'price': 5.0, 'volume_remain': 10
+        }}]
+
+    monkeypatch.setattr(hauling_module, 'stream_orders', stream_orders)
+
+    async def retrieve_both():
+        return await asyncio.gather(
+            hauling_module.get_orders('10000002', 'sell', 'both'),
+            hauling_module.get_orders('10000043', 'buy', 'both'),
+        )
+
+    # ACT
+    from_orders, to_orders = asyncio.run(retrieve_both())
+
+    # ASSERT
+    assert from_orders.order_count() == 1
+    assert to_orders.order_count() == 1
+
+
+def test_order_books_are_cached_across_thresholds(hauling_module, monkeypatch) -> None:
+    '''
+    Order books are retrieved once per locations and order types and re-used by later requests.
+    '''
+    # ASSIGN
+    retrievals = []
+
+    def stream_orders(location_string, order_type, structure_type): # pylint: disable=unused-argument
+        retrievals.append((location_string, order_type))
+        yield generate_hits(1 if order_type == 'sell' else 2, 50)
+
+    monkeypatch.setattr(hauling_module, 'stream_orders', stream_orders)
+    # The market data version is known, so Elasticsearch is not queried for it
+    monkeypatch.setattr(startup, 'clients', {'redis': fakeredis.FakeRedis(), 'elasticsearch': object()})
+    monkeypatch.setattr(result_cache, 'market_version_state', {'version': 'market_data:10:0', 'checked_at': float('inf')})
+
+    # ACT
+    first = asyncio.run(hauling_module.get_order_books('10000002', 'sell', '10000043', 'buy', 'both'))
+    second = asyncio.run(hauling_module.get_order_books('10000002', 'sell', '10000043', 'buy', 'both'))
+    asyncio.run(hauling_module.get_order_books('10000002', 'sell', '10000043', 'sell', 'both'))
+
+    # ASSERT
+    assert sorted(retrievals) == [
+        ('10000002', 'sell'), ('10000002', 'sell'), ('10000043', 'buy'), ('10000043', 'sell')
+    ]
+    for side in ['from', 'to']:
+        assert list(second[side]) == list(first[side])
+        assert [list(second[side][type_id]) for type_id in second[side]] == \
+            [list(first[side][type_id]) for type_id in first[side]]
+
+
+class FakeJumpData:
+    '''
+    Elasticsearch stand-in holding jump data documents, some stored under generated IDs.
+    '''
+    def __init__(self, documents: dict, generated: set):
+        self.documents = documents
+        self.generated = generated
+        self.requests = []
+
+    def mget(self, body, index, _source): # pylint: disable=unused-argument
+        '''
+        Fetch documents by ID.
+        '''
+        self.requests.append('mget')
+        return {'docs': [
+            {'_id': route, 'found': True, '_source': self.documents[route]}
+            if route in self.documents and route not in self.generated else {'_id': route, 'found': False}
+            for route in body['ids']
+        ]}
+
+    def search(self, index, size, _source, body): # pylint: disable=unused-argument
+        '''
+        Fetch documents by exact route.
+        '''
+        self.requests.append('search')
+        routes = body['query']['terms']['route.keyword']
+        return {'hits': {'hits': [
+            {'_source': self.documents[route]} for route in routes if route in self.documents
+        ]}}
+
+
+def test_get_routes_uses_ids_then_terms(hauling_module, monkeypatch) -> None:
+    '''
+    Routes are fetched with one multi-get and one terms query, and stale routes are refreshed.
+    '''
+    # ASSIGN
+    now = time.time() * 1000
+    es_client = FakeJumpData({
+        '30000142-30002187': {'route': '30000142-30002187', 'secure': 9, 'last_modified': now},
+        '30000142-30002659': {'route': '30000142-30002659', 'secure': 12, 'last_modified': now},
+        '30002187-30002659': {'route': '30002187-30002659', 'secure': 4, 'last_modified': now - 40 * 86400000},
+    }, generated={'30000142-30002659'})
+    monkeypatch.setattr(startup, 'clients', {'elasticsearch': es_client})
+    for route in ['30000142-30002187', '30000142-30002659', '30002187-30002659', '30000142-30000144']:
+        hauling_module.jump_count[route] = ''
+
+    # ACT
+    routes = hauling_module.get_routes('secure')
+
+    # ASSERT
+    assert es_client.requests == ['mget', 'search']
+    assert routes == {
+        '30000142-30002187': 9,
+        '30000142-30002659': 12,
+        '30002187-30002659': 4,
+        '30000142-30000144': '',
+    }
+    assert hauling_module.refresh_routes == {'30002187-30002659'}
+
+
+def test_get_routes_reuses_cached_routes(hauling_module, monkeypatch) -> None:
+    '''
+    Known routes are answered from the route cache, separately per route safety.
+    '''
+    # ASSIGN
+    now = time.time() * 1000
+    es_client = FakeJumpData({
+        '30000142-30002187': {'route': '30000142-30002187', 'secure': 9, 'shortest': 7, 'last_modified': now},
+        '30000142-30002659': {'route': '30000142-30002659', 'secure': -1, 'shortest': -1, 'last_modified': now},
+    }, generated=set())
+    monkeypatch.setattr(startup, 'clients', {'elasticsearch': es_client})
+
+    def resolve(route_safety: str) -> dict:
+        hauling_module.jump_count.clear()
+        hauling_module.jump_count.update(dict.fromkeys(['30000142-30002187', '30000142-30002659'], ''))
+        return dict(hauling_module.get_routes(route_safety))
+
+    # ACT
+    first = resolve('secure')
+    requests_after_first = len(es_client.requests)
+    second = resolve('secure')
+    shortest = resolve('shortest')
+
+    # ASSERT
+    assert first == second == {'30000142-30002187': 9, '30000142-30002659': -1}
+    assert shortest == {'30000142-30002187': 7, '30000142-30002659': -1}
+    assert requests_after_first == 1
+    assert hauling_module.route_cache.get(('secure', '30000142-30002187')) == 9
+    assert ('secure', '30000142-30002659') not in hauling_module.route_cache
+
+
+def test_get_routes_uses_local_graph(hauling_module, monkeypatch) -> None:
+    '''
+    Routes within the stargate graph are solved locally and only the others are looked up in ES.
+    '''
+    # ASSIGN
+    graph = JumpGraph({'30000142': [30000144], '30000144': [30000142, 30002187], '30002187': [30000144]},
+                      [30000142, 30000144, 30002187])
+    monkeypatch.setattr(route_engine, 'get_jump_graph', lambda: graph)
+    es_client = FakeJumpData({
+        '30002187-30002813': {'route': '30002187-30002813', 'secure': 6, 'last_modified': time.time() * 1000},
+    }, generated=set())
+    monkeypatch.setattr(startup, 'clients', {'elasticsearch': es_client})
+    hauling_module.jump_count.update(dict.fromkeys(['30000142-30002187', '30002187-30002813'], ''))
+
+    # ACT
+    routes = hauling_module.get_routes('secure')
+
+    # ASSERT
+    assert routes == {'30000142-30002187': 3, '30002187-30002813': 6}
+    assert es_client.requests == ['mget']
@@ -0,0 +1,39 @@
+'''
+Tests for matching IP addresses against allow and ban lists.
+'''
+from api.utils.ip_list import IPList
+
+
+def test_parse_matches_addresses_and_ranges() -> None:
+    '''
+    Addresses, IPv4 and IPv6 ranges are parsed from the comma separated Redis value.
+    '''
+    # ACT
+    ip_list = IPList.parse('1.2.3.4,\n10.0.0.0/8, 192.168.1.0/24,2001:db8::/32,::1,1.1.1.1/32')
+
+    # ASSERT
+    assert '1.2.3.4' in ip_list
+    assert '1.1.1.1' in ip_list
+    assert '10.255.0.3' in ip_list
+    assert '192.168.1.77' in ip_list
+    assert '192.168.2.1' not in ip_list
+    assert '2001:db8:ffff::1' in ip_list
+    assert '::1' in ip_list
+    assert '11.0.0.1' not in ip_list
+    assert len(ip_list) == 6
+
+
+def test_empty_and_invalid_entries() -> None:
+    '''
+    Empty values never match and invalid entries only match themselves.
+    '''
+    # ACT
+    empty = IPList.parse('')
+    invalid = IPList.parse('not-an-ip,')
+
+    # ASSERT
+    assert len(empty) == 0
+    assert '' not in empty
+    assert '1.2.3.4' not in empty
+    assert 'not-an-ip' in invalid
+    assert '' not in invalid
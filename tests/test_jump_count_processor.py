@@ -0,0 +1,235 @@
+'''
+Tests for the jump count processor against a local stub of the ESI route endpoint.
+'''
+import importlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+# Systems of each stubbed route per flag, keyed by (start, end)
+ESI_ROUTES = {
+    ('30000142', '30002187'): {
+        'shortest': [30000142, 30000144, 30002187],
+        'secure': [30000142, 30000144, 30000145, 30002187],
+        'insecure': [30000142, 30000144, 30002187],
+    },
+    ('30000142', '30002659'): {
+        'shortest': [30000142, 30002659],
+        'secure': [30000142, 30002659],
+        'insecure': [30000142, 30002659],
+    },
+}
+
+
+class StubESI(BaseHTTPRequestHandler):
+    '''
+    Serves /latest/route/{start}/{end}/ from ESI_ROUTES, failing the first request with 420 when asked
+    and every request of the routes in `failing` with 503.
+    '''
+    requests = []
+    failing = set()
+    in_flight = 0
+    max_in_flight = 0
+    error_limited = 0
+    lock = threading.Lock()
+
+    def do_GET(self): # pylint: disable=invalid-name
+        '''
+        Answer a route request.
+        '''
+        url = urlparse(self.path)
+        _, _, _, start, end, _ = url.path.split('/')
+        flag = parse_qs(url.query)['flag'][0]
+
+        with StubESI.lock:
+            StubESI.requests.append((start, end, flag))
+            StubESI.in_flight += 1
+            StubESI.max_in_flight = max(StubESI.max_in_flight, StubESI.in_flight)
+            limited = StubESI.error_limited > 0
+            StubESI.error_limited -= 1
+        time.sleep(0.02)
+
+        route = ESI_ROUTES.get((start, end), {}).get(flag)
+        if limited:
+            status, body = 420, {'error': 'Error limited'}
+        elif (start, end) in StubESI.failing:
+            status, body = 503, {'error': 'Service unavailable'}
+        elif route is None:
+            status, body = 404, {'error': 'No route found'}
+        else:
+            status, body = 200, route
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('X-ESI-Error-Limit-Remain', '0' if limited else '100')
+        self.send_header('X-ESI-Error-Limit-Reset', '0')
+        self.end_headers()
+        self.wfile.write(json.dumps(body).encode('utf-8'))
+
+        with StubESI.lock:
+            StubESI.in_flight -= 1
+
+    def log_message(self, format, *args): # pylint: disable=redefined-builtin
+        pass
+
+
+class FakeElasticsearch:
+    '''
+    Elasticsearch stand-in recording bulk requests, with one route stored under a generated ID.
+    '''
+    def __init__(self):
+        self.bulk_bodies = []
+
+    def search(self, index, size, _source, body): # pylint: disable=unused-argument
+        '''
+        Find documents by exact route.
+        '''
+        routes = body['query']['terms']['route.keyword']
+        hits = [{'_id': 'generated-id', '_source': {'route': '30002187-30000142'}}]
+        return {'hits': {'hits': [hit for hit in hits if hit['_source']['route'] in routes]}}
+
+    def bulk(self, body):
+        '''
+        Record a bulk request.
+        '''
+        self.bulk_bodies.append(body)
+        return {'errors': False, 'items': []}
+
+
+@pytest.fixture()
+def processor(monkeypatch):
+    '''
+    Import the processor against a local ESI stub and an Elasticsearch stand-in.
+    '''
+    monkeypatch.setenv('ES_HOST', 'http://localhost:9200')
+    module = importlib.import_module('event_driven_lambdas.jump_count_processor')
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubESI)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    StubESI.requests, StubESI.in_flight, StubESI.max_in_flight, StubESI.error_limited = [], 0, 0, 0
+    StubESI.failing = set()
+
+    monkeypatch.setattr(module, 'ESI_BASE_URL', f'http://127.0.0.1:{server.server_address[1]}')
+    monkeypatch.setattr(module, 'es', FakeElasticsearch())
+    monkeypatch.setattr(module, 'esi_error_limit', {'paused_until': 0.0})
+    yield module
+    server.shutdown()
+
+
+def sqs_event(*pairs) -> dict:
+    '''
+    Build an SQS event with one record per route.
+    '''
+    return {'Records': [{'body': json.dumps({'start': start, 'end': end})} for start, end in pairs]}
+
+
+def test_batch_fetches_routes_concurrently(processor, monkeypatch) -> None:
+    '''
+    Each distinct route is fetched once per flag, several at a time, and written in one bulk request.
+    '''
+    # ASSIGN
+    monkeypatch.setattr(processor, 'ESI_CONCURRENCY', 4)
+    monkeypatch.setattr(processor, 'ROUTE_REUSE', False)
+    event = sqs_event((30000142, 30002187), (30000142, 30002659), (30000142, 30002187), (30000142, 30000001))
+
+    # ACT
+    processor.lambda_handler(event, None)
+
+    # ASSERT
+    assert len(StubESI.requests) == 9
+    assert 1 < StubESI.max_in_flight <= 4
+    assert len(processor.es.bulk_bodies) == 1
+
+    body = processor.es.bulk_bodies[0]
+    updates = {body[idx]['update']['_id']: body[idx + 1]['doc'] for idx in range(0, len(body), 2)}
+    assert updates['30000142-30002187']['secure'] == 4
+    assert updates['30002187-30000142']['shortest'] == 3
+    assert updates['generated-id']['route'] == '30002187-30000142'
+    assert updates['30000142-30002659']['insecure'] == 2
+    assert updates['30000142-30000001']['shortest'] == -1
+    assert len(updates) == 7
+
+
+def test_reuse_fills_sub_paths(processor, monkeypatch) -> None:
+    '''
+    Flags matching the shortest route are not fetched and every part of a route is written.
+    '''
+    # ASSIGN
+    monkeypatch.setattr(processor, 'system_security', {'high_sec': {30000142, 30002187, 30000145, 30002659}})
+    event = sqs_event((30002187, 30000142), (30000142, 30002659), (30000142, 30000001))
+
+    # ACT
+    processor.lambda_handler(event, None)
+
+    # ASSERT
+    assert len(StubESI.requests) == 6
+    assert ('30000142', '30002659', 'secure') not in StubESI.requests
+
+    body = processor.es.bulk_bodies[0]
+    updates = {body[idx]['update']['_id']: body[idx + 1] for idx in range(0, len(body), 2)}
+    assert updates['30002187-30000142']['doc']['secure'] == 4
+    assert updates['30000144-30002187']['doc'] == {
+        'route': '30000144-30002187', 'shortest': 2, 'secure': 3, 'insecure': 2,
+        'last_modified': updates['30000144-30002187']['doc']['last_modified'],
+    }
+    assert updates['30000145-30000142']['doc'] == {'route': '30000145-30000142', 'secure': 3}
+    assert updates['30000145-30000142']['upsert']['shortest'] == -1
+    assert updates['30000142-30002659']['doc']['secure'] == 2
+    assert updates['30000001-30000142']['doc']['insecure'] == -1
+    assert updates['generated-id']['doc']['route'] == '30002187-30000142'
+
+
+def test_error_limit_pauses_and_retries(processor) -> None:
+    '''
+    An error limited response pauses the requests and the route is fetched again.
+    '''
+    # ASSIGN
+    StubESI.error_limited = 1
+
+    # ACT
+    jumps = processor.fetch_route_length('30000142', '30002659', 'secure')
+
+    # ASSERT
+    assert jumps == 2
+    assert len(StubESI.requests) == 2
+
+
+def test_failed_routes_are_not_written(processor, monkeypatch) -> None:
+    '''
+    Routes ESI fails to answer keep their stored counts, and counts found on other routes are still written.
+    '''
+    # ASSIGN
+    monkeypatch.setattr(processor, 'system_security', {'high_sec': {30000142, 30002187, 30000145, 30002659}})
+    StubESI.failing = {('30000144', '30002187'), ('30000142', '30002813')}
+    event = sqs_event((30000142, 30002187), (30000144, 30002187), (30000142, 30002813))
+
+    # ACT
+    processor.lambda_handler(event, None)
+
+    # ASSERT
+    body = processor.es.bulk_bodies[0]
+    updates = {body[idx]['update']['_id']: body[idx + 1] for idx in range(0, len(body), 2)}
+    assert updates['30000144-30002187']['doc']['shortest'] == 2
+    assert updates['30000144-30002187']['doc']['secure'] == 3
+    assert '30000142-30002813' not in updates
+    assert '30002813-30000142' not in updates
+
+
+def test_no_route_does_not_replace_known_length(processor) -> None:
+    '''
+    A length found on another route is kept over a pair ESI found no route for, in either order.
+    '''
+    # ASSIGN
+    found = {('30000142', '30002187'): {'shortest': [30000142, 30000144, 30002187]}}
+    no_route = {('30000144', '30002187'): {'shortest': None}}
+
+    # ACT
+    routes = [processor.collect_route_lengths({**first, **second})
+              for first, second in [(found, no_route), (no_route, found)]]
+
+    # ASSERT
+    assert routes[0][('30000144', '30002187')] == routes[1][('30000144', '30002187')] == {'shortest': 2}
@@ -0,0 +1,45 @@
+'''
+Tests for the bounded in-process cache.
+'''
+from api.utils import lru_cache
+from api.utils.lru_cache import LRUCache
+
+
+def test_least_recently_used_entry_is_evicted() -> None:
+    '''
+    The cache never holds more than its maximum size and keeps recently read entries.
+    '''
+    # ASSIGN
+    cache = LRUCache(2, 60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+
+    # ACT
+    cache.get('a')
+    cache.set('c', 3)
+
+    # ASSERT
+    assert len(cache) == 2
+    assert cache.get('a') == 1
+    assert 'b' not in cache
+    assert cache.get('c') == 3
+
+
+def test_expired_entries_are_missing(monkeypatch) -> None:
+    '''
+    Entries are dropped once their TTL has passed.
+    '''
+    # ASSIGN
+    now = [1000.0]
+    monkeypatch.setattr(lru_cache.time, 'monotonic', lambda: now[0])
+    cache = LRUCache(10, 60)
+    cache.set('a', 1)
+    cache.set('b', 2, ttl=600)
+
+    # ACT
+    now[0] += 120
+
+    # ASSERT
+    assert cache.get('a') is None
+    assert cache.get('b') == 2
+    assert len(cache) == 1
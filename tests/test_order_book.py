@@ -0,0 +1,73 @@
+'''
+Tests for the compact order book.
+'''
+from api.utils.helpers import remove_mismatch_type_ids
+from api.utils.order_book import OrderBook
+
+FIELDS = ['volume_remain', 'price', 'region_id', 'type_id']
+
+
+def test_order_book_groups_hits_by_type_id() -> None:
+    '''
+    Hits are grouped by type ID and materialize back into the original documents.
+    '''
+    # ASSIGN
+    hits = [
+        {'_source': {'type_id': 34, 'price': 5.5, 'volume_remain': 100, 'region_id': 10000002}},
+        {'_source': {'type_id': 35, 'price': 12.25, 'volume_remain': 7, 'region_id': 10000002}},
+        {'_source': {'type_id': 34, 'price': 4.75, 'volume_remain': 30, 'region_id': 10000043}},
+    ]
+
+    # ACT
+    book = OrderBook.from_hits(hits, FIELDS)
+
+    # ASSERT
+    assert list(book) == [34, 35]
+    assert book.order_count() == 3
+    assert list(book[34]) == [hits[0]['_source'], hits[2]['_source']]
+    assert book[35][0] == hits[1]['_source']
+    assert book[34].column('price').tolist() == [5.5, 4.75]
+
+
+def test_remove_mismatch_type_ids() -> None:
+    '''
+    Only type IDs present in both order books are kept.
+    '''
+    # ASSIGN
+    book_one = OrderBook.from_hits([
+        {'_source': {'type_id': 34, 'price': 5.5, 'volume_remain': 100, 'region_id': 10000002}},
+        {'_source': {'type_id': 35, 'price': 12.25, 'volume_remain': 7, 'region_id': 10000002}},
+    ], FIELDS)
+    book_two = OrderBook.from_hits([
+        {'_source': {'type_id': 35, 'price': 13.0, 'volume_remain': 1, 'region_id': 10000002}},
+        {'_source': {'type_id': 36, 'price': 40.0, 'volume_remain': 2, 'region_id': 10000002}},
+    ], FIELDS)
+
+    # ACT
+    orders = remove_mismatch_type_ids(book_one, book_two)
+
+    # ASSERT
+    assert list(orders['from']) == [35]
+    assert list(orders['to']) == [35]
+
+
+def test_order_book_bytes_round_trip() -> None:
+    '''
+    An encoded order book decodes to the same orders.
+    '''
+    # ASSIGN
+    book = OrderBook.from_hits([
+        {'_source': {'type_id': 34, 'price': 5.5, 'volume_remain': 100, 'region_id': 10000002}},
+        {'_source': {'type_id': 35, 'price': 12.25, 'volume_remain': 7, 'region_id': 10000043}},
+        {'_source': {'type_id': 34, 'price': 4.75, 'volume_remain': 3, 'region_id': 10000002}},
+    ], FIELDS)
+
+    # ACT
+    decoded = OrderBook.from_bytes(book.to_bytes())
+    empty = OrderBook.from_bytes(OrderBook(FIELDS).to_bytes())
+
+    # ASSERT
+    assert decoded.fields == book.fields
+    assert list(decoded) == [34, 35]
+    assert [list(decoded[type_id]) for type_id in decoded] == [list(book[type_id]) for type_id in book]
+    assert len(empty) == 0
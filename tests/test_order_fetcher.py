@@ -0,0 +1,108 @@
+'''
+Tests for the paginated Elasticsearch order fetcher.
+'''
+import pytest
+
+from api.utils import order_fetcher
+
+FIELDS = ['volume_remain', 'price', 'region_id', 'type_id']
+
+
+class FakeElasticsearch:
+    '''
+    Minimal stand-in for the Elasticsearch client serving hits by point in time.
+    '''
+    def __init__(self, documents: list, fail_on_page: int = None):
+        self.documents = documents
+        self.fail_on_page = fail_on_page
+        self.searches = []
+        self.open_pits = set()
+
+    def open_point_in_time(self, index, keep_alive):
+        '''
+        Opens a new point in time.
+        '''
+        pit_id = f'pit-{index}-{keep_alive}'
+        self.open_pits.add(pit_id)
+        return {'id': pit_id}
+
+    def close_point_in_time(self, body):
+        '''
+        Closes a point in time.
+        '''
+        self.open_pits.remove(body['id'])
+
+    def search(self, body):
+        '''
+        Returns the next page of documents sorted by order ID.
+        '''
+        self.searches.append(body)
+        if len(self.searches) == self.fail_on_page:
+            raise ConnectionError('Lost connection to Elasticsearch')
+
+        after = body.get('search_after', [-1])[0]
+        page = [doc for doc in self.documents if doc['order_id'] > after][:body['size']]
+        return {
+            'pit_id': body['pit']['id'],
+            'hits': {'hits': [{'_source': doc, 'sort': [doc['order_id']]} for doc in page]},
+        }
+
+
+def generate_documents(count: int) -> list:
+    '''
+    Generate order documents spread over a few type IDs.
+    '''
+    return [
+        {'order_id': idx, 'type_id': 34 + idx % 3, 'price': float(idx), 'volume_remain': idx, 'region_id': 10000002}
+        for idx in range(count)
+    ]
+
+
+def test_fetch_orders_pages_with_search_after() -> None:
+    '''
+    All pages are retrieved with search_after and the point in time is released.
+    '''
+    # ASSIGN
+    es_client = FakeElasticsearch(generate_documents(25))
+
+    # ACT
+    book = order_fetcher.fetch_orders(es_client, {'match_all': {}}, FIELDS, page_size=10)
+
+    # ASSERT
+    assert book.order_count() == 25
+    assert sorted(book) == [34, 35, 36]
+    assert [search.get('search_after') for search in es_client.searches] == [None, [9], [19]]
+    assert not es_client.open_pits
+
+
+def test_fetch_orders_releases_point_in_time_on_error() -> None:
+    '''
+    The point in time is closed even if a page fails to load.
+    '''
+    # ASSIGN
+    es_client = FakeElasticsearch(generate_documents(25), fail_on_page=2)
+
+    # ACT
+    with pytest.raises(ConnectionError):
+        order_fetcher.fetch_orders(es_client, {'match_all': {}}, FIELDS, page_size=10)
+
+    # ASSERT
+    assert not es_client.open_pits
+
+
+def test_prefetch_pages_releases_point_in_time_when_stopped_early() -> None:
+    '''
+    Stopping a prefetched stream early still closes the point in time.
+    '''
+    # ASSIGN
+    es_client = FakeElasticsearch(generate_documents(100))
+    pages = order_fetcher.stream_order_pages(es_client, {'match_all': {}}, FIELDS, page_size=10)
+
+    # ACT
+    first_page = next(pages)
+    pages.close()
+
+    # ASSERT
+    assert len(first_page) == 10
+    assert len(es_client.searches) < 10
+    assert not es_client.open_pits
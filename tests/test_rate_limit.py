@@ -0,0 +1,170 @@
+'''
+Tests for the single round trip rate limiter.
+'''
+import fakeredis
+import pytest
+
+from api.utils import rate_limit
+
+LIMIT = 5
+INTERVAL = 60
+
+
+@pytest.fixture()
+def redis_client(monkeypatch):
+    '''
+    Local stand-in for the Redis server, with an empty local denylist.
+    '''
+    monkeypatch.setattr(rate_limit, 'denied', {})
+    return fakeredis.FakeRedis()
+
+
+def check_sequentially(redis_client, ip_address: str) -> int:
+    '''
+    Rate limit decision made with one Redis command per step, as the gateway used to.
+    '''
+    rate_limit_key, concurrent_limit_key, daily_count_key = rate_limit.get_keys(ip_address)
+
+    current_count = redis_client.incr(rate_limit_key)
+    if current_count == 1:
+        redis_client.expire(rate_limit_key, INTERVAL)
+
+    concurrent_count = int(redis_client.get(concurrent_limit_key) or 0)
+    if current_count > LIMIT:
+        concurrent_count = redis_client.incr(concurrent_limit_key)
+        if concurrent_count == 1:
+            redis_client.expire(concurrent_limit_key, INTERVAL * 60 * 24)
+        if concurrent_count == 10:
+            redis_client.expire(concurrent_limit_key, INTERVAL * 60 * 24 * 7)
+            return 403
+
+    daily_count = redis_client.incr(daily_count_key)
+    if daily_count == 1:
+        redis_client.expire(daily_count_key, INTERVAL * 60 * 24)
+
+    if daily_count > LIMIT * INTERVAL:
+        redis_client.expire(concurrent_limit_key, INTERVAL * 60 * 24)
+        return 429
+    if concurrent_count >= 10:
+        return 403
+    if current_count > LIMIT:
+        return 429
+    return 200
+
+
+def test_check_matches_sequential_decisions(redis_client) -> None:
+    '''
+    The script returns the same 200 / 429 / 403 decisions as the sequential commands.
+    '''
+    # ASSIGN
+    reference_client = fakeredis.FakeRedis()
+
+    # ACT
+    statuses = [rate_limit.check(redis_client, '1.2.3.4', LIMIT, INTERVAL).status for _ in range(20)]
+    expected = [check_sequentially(reference_client, '1.2.3.4') for _ in range(20)]
+
+    # ASSERT
+    assert statuses == expected
+    assert statuses[:LIMIT] == [200] * LIMIT
+    assert statuses[LIMIT] == 429
+    assert statuses[-1] == 403
+
+
+def test_check_sets_expiry_on_counters(redis_client) -> None:
+    '''
+    The counters expire after the interval, one day and one week.
+    '''
+    # ACT
+    for _ in range(LIMIT + 10):
+        rate_limit.check(redis_client, '1.2.3.4', LIMIT, INTERVAL)
+
+    # ASSERT
+    rate_limit_key, concurrent_limit_key, daily_count_key = rate_limit.get_keys('1.2.3.4')
+    assert 0 < redis_client.ttl(rate_limit_key) <= INTERVAL
+    assert INTERVAL * 60 * 24 < redis_client.ttl(concurrent_limit_key) <= INTERVAL * 60 * 24 * 7
+    assert 0 < redis_client.ttl(daily_count_key) <= INTERVAL * 60 * 24
+
+
+def test_check_is_one_round_trip(mocker, redis_client) -> None:
+    '''
+    Once the script is loaded each request is a single Redis command.
+    '''
+    # ASSIGN
+    rate_limit.check(redis_client, '1.2.3.4', LIMIT, INTERVAL)
+    command = mocker.spy(redis_client, 'execute_command')
+    reference_client = fakeredis.FakeRedis()
+    reference_command = mocker.spy(reference_client, 'execute_command')
+
+    # ACT
+    for _ in range(LIMIT + 1):
+        rate_limit.check(redis_client, '1.2.3.4', LIMIT, INTERVAL)
+        check_sequentially(reference_client, '1.2.3.4')
+
+    # ASSERT
+    assert command.call_count == LIMIT + 1
+    assert reference_command.call_count > 3 * (LIMIT + 1)
+
+
+def test_throttled_ip_is_rejected_locally(mocker, redis_client) -> None:
+    '''
+    Once Redis throttles an IP, its requests in the same window skip Redis.
+    '''
+    # ASSIGN
+    for _ in range(LIMIT + 1):
+        rate_limit.check(redis_client, '1.2.3.4', LIMIT, INTERVAL, local=True)
+    command = mocker.spy(redis_client, 'execute_command')
+
+    # ACT
+    results = [rate_limit.check(redis_client, '1.2.3.4', LIMIT, INTERVAL, local=True) for _ in range(3)]
+    other = rate_limit.check(redis_client, '5.6.7.8', LIMIT, INTERVAL, local=True)
+
+    # ASSERT
+    assert [result.status for result in results] == [429, 429, 429]
+    assert all(result.local for result in results)
+    assert other.status == 200
+    assert command.call_count == 1
+
+
+def test_local_rejections_are_synced_to_redis(redis_client) -> None:
+    '''
+    Requests rejected locally are added to the Redis counters with the next check.
+    '''
+    # ASSIGN
+    reference_client = fakeredis.FakeRedis()
+    for _ in range(LIMIT + 4):
+        rate_limit.check(redis_client, '1.2.3.4', LIMIT, INTERVAL, local=True)
+        check_sequentially(reference_client, '1.2.3.4')
+    rate_limit.denied['1.2.3.4']['until'] = 0
+    check_sequentially(reference_client, '1.2.3.4')
+
+    # ACT
+    result = rate_limit.check(redis_client, '1.2.3.4', LIMIT, INTERVAL, local=True)
+
+    # ASSERT
+    _, concurrent_limit_key, daily_count_key = rate_limit.get_keys('1.2.3.4')
+    assert result.status == 429
+    assert not result.local
+    assert redis_client.get(concurrent_limit_key) == reference_client.get(concurrent_limit_key)
+    assert redis_client.get(daily_count_key) == reference_client.get(daily_count_key)
+
+
+def test_local_denylist_forbids_like_sequential(redis_client) -> None:
+    '''
+    A throttled IP rejected locally is still forbidden at the strike limit, with the week long expiry.
+    '''
+    # ASSIGN
+    reference_client = fakeredis.FakeRedis()
+
+    # ACT
+    statuses = [rate_limit.check(redis_client, '1.2.3.4', LIMIT, INTERVAL, local=True).status for _ in range(40)]
+    expected = [check_sequentially(reference_client, '1.2.3.4') for _ in range(40)]
+    rate_limit.denied['1.2.3.4']['until'] = 0
+    rate_limit.check(redis_client, '1.2.3.4', LIMIT, INTERVAL, local=True)
+    check_sequentially(reference_client, '1.2.3.4')
+
+    # ASSERT
+    _, concurrent_limit_key, _ = rate_limit.get_keys('1.2.3.4')
+    assert statuses == expected
+    assert statuses.index(403) == LIMIT + rate_limit.STRIKE_LIMIT - 1
+    assert redis_client.get(concurrent_limit_key) == reference_client.get(concurrent_limit_key)
+    assert redis_client.ttl(concurrent_limit_key) > INTERVAL * 60 * 24
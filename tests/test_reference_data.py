@@ -0,0 +1,227 @@
+'''
+Tests for the lazily loaded reference data cache.
+'''
+import json
+import mmap
+
+import pytest
+import requests
+
+from api.utils import reference_data
+from api.utils.compact_table import COMPACT_COLUMNS, encode_table
+
+
+@pytest.fixture()
+def empty_reference_data(monkeypatch, tmp_path):
+    '''
+    Start from an empty in-memory cache with snapshots written to a temporary directory.
+    The resource manifest is unavailable unless a test publishes one.
+    '''
+    monkeypatch.setattr(reference_data, 'resource_cache', {})
+    monkeypatch.setattr(reference_data, 'SNAPSHOT_DIRECTORY', str(tmp_path))
+    monkeypatch.setattr(reference_data, 'manifest_state', {'unavailable_until': float('inf')})
+    return reference_data
+
+
+def mock_response(mocker, status_code: int, body: bytes = b'', headers: dict = None):
+    '''
+    Build a mocked requests response.
+    '''
+    response = mocker.MagicMock()
+    response.status_code = status_code
+    response.content = body
+    response.json.side_effect = lambda: json.loads(body)
+    response.headers = headers or {}
+    return response
+
+
+def test_resource_is_downloaded_once(mocker, empty_reference_data) -> None:
+    '''
+    A resource is downloaded on first use and then served from memory.
+    '''
+    # ASSIGN
+    get = mocker.patch('requests.get', return_value=mock_response(
+        mocker, 200, b'{"34": {"name": "Tritanium"}}', {'ETag': '"abc"'}
+    ))
+
+    # ACT
+    first = empty_reference_data.get_resource('typeIDToName')
+    second = empty_reference_data.get_resource('typeIDToName')
+
+    # ASSERT
+    assert first == second == {'34': {'name': 'Tritanium'}}
+    assert get.call_count == 1
+
+
+def test_resource_is_revalidated_after_ttl(mocker, monkeypatch, empty_reference_data) -> None:
+    '''
+    Once the TTL expires the resource is revalidated with its ETag and kept on a 304.
+    '''
+    # ASSIGN
+    get = mocker.patch('requests.get', return_value=mock_response(
+        mocker, 200, b'{"34": {"name": "Tritanium"}}', {'ETag': '"abc"'}
+    ))
+    empty_reference_data.get_resource('typeIDToName')
+    monkeypatch.setattr(empty_reference_data, 'REVALIDATE_SECONDS', 0)
+    get.return_value = mock_response(mocker, 304)
+
+    # ACT
+    data = empty_reference_data.get_resource('typeIDToName')
+
+    # ASSERT
+    assert data == {'34': {'name': 'Tritanium'}}
+    assert get.call_args.kwargs['headers'] == {'If-None-Match': '"abc"'}
+
+
+def test_resource_is_loaded_from_snapshot(mocker, monkeypatch, empty_reference_data) -> None:
+    '''
+    A new container reads the local snapshot instead of downloading the resource again.
+    '''
+    # ASSIGN
+    get = mocker.patch('requests.get', return_value=mock_response(
+        mocker, 200, b'{"30000142": {"security_code": "high_sec"}}', {'ETag': '"abc"'}
+    ))
+    empty_reference_data.get_resource('systemIdToSecurity')
+    monkeypatch.setattr(empty_reference_data, 'resource_cache', {})
+
+    # ACT
+    data = empty_reference_data.get_resource('systemIdToSecurity')
+
+    # ASSERT
+    assert data == {'30000142': {'security_code': 'high_sec'}}
+    assert get.call_count == 1
+
+
+def test_compact_resource_is_memory_mapped_from_snapshot(mocker, empty_reference_data) -> None:
+    '''
+    A compact table is read straight from its memory mapped snapshot with integer keys.
+    '''
+    # ASSIGN
+    body = encode_table({'34': {'name': 'Tritanium', 'volume': 0.01}}, COMPACT_COLUMNS['typeIDToName'])
+    mocker.patch('requests.get', return_value=mock_response(mocker, 200, body, {'ETag': '"abc"'}))
+
+    # ACT
+    table = empty_reference_data.get_compact_resource('typeIDToName')
+
+    # ASSERT
+    assert isinstance(table.buffer, mmap.mmap)
+    assert table.value(34, 'name') == 'Tritanium'
+    assert table.value(34, 'volume') == 0.01
+    assert 35 not in table
+
+
+def test_compact_resource_falls_back_to_json(mocker, empty_reference_data) -> None:
+    '''
+    If the compact table is not published it is compiled from the JSON resource.
+    '''
+    # ASSIGN
+    def get(url, headers, timeout): # pylint: disable=unused-argument
+        if url.endswith('.bin'):
+            response = mock_response(mocker, 403)
+            response.raise_for_status.side_effect = requests.exceptions.HTTPError('Forbidden')
+            return response
+        return mock_response(mocker, 200, b'{"30000142": {"security_code": "high_sec", "rating": 0.9}}')
+
+    mocker.patch('requests.get', side_effect=get)
+
+    # ACT
+    table = empty_reference_data.get_compact_resource('systemIdToSecurity')
+
+    # ASSERT
+    assert table.value(30000142, 'security_code') == 'high_sec'
+    assert table.value(30000142, 'rating') == 0.9
+
+
+def serve_manifest(mocker, monkeypatch, reference_data, files: dict):
+    '''
+    Publish a manifest and serve files by URL, returning the mocked requests.get.
+    '''
+    monkeypatch.setattr(reference_data, 'manifest_state', {'unavailable_until': 0.0})
+
+    def get(url, headers, timeout): # pylint: disable=unused-argument
+        file_name = url.rsplit('/resources/', 1)[1]
+        if file_name not in files:
+            response = mock_response(mocker, 304 if headers else 404)
+            response.raise_for_status.side_effect = requests.exceptions.HTTPError('Not Found')
+            return response
+        return mock_response(mocker, 200, files[file_name], {'ETag': f'"{file_name}"'})
+
+    return mocker.patch('requests.get', side_effect=get)
+
+
+def get_manifest(digest: str) -> bytes:
+    '''
+    Build a manifest listing typeIDToName.json under a content hashed key.
+    '''
+    key = f'hashed/typeIDToName.{digest}.json'
+    return json.dumps({'resources': {'typeIDToName.json': {
+        'key': key, 'sha256': digest, 'size': 1, 'encodings': {'gzip': f'{key}.gz'},
+    }}}).encode('utf-8')
+
+
+def test_hashed_resource_is_not_revalidated(mocker, monkeypatch, empty_reference_data) -> None:
+    '''
+    A resource listed in the manifest is downloaded from its hashed key and only the manifest is revalidated.
+    '''
+    # ASSIGN
+    get = serve_manifest(mocker, monkeypatch, empty_reference_data, {
+        'manifest.json': get_manifest('aaaa'),
+        'hashed/typeIDToName.aaaa.json.gz': b'{"34": {"name": "Tritanium"}}',
+    })
+    empty_reference_data.get_resource('typeIDToName')
+    monkeypatch.setattr(empty_reference_data, 'REVALIDATE_SECONDS', 0)
+
+    # ACT
+    data = empty_reference_data.get_resource('typeIDToName')
+
+    # ASSERT
+    assert data == {'34': {'name': 'Tritanium'}}
+    urls = [call.args[0].rsplit('/resources/', 1)[1] for call in get.call_args_list]
+    assert urls == ['manifest.json', 'hashed/typeIDToName.aaaa.json.gz', 'manifest.json']
+
+
+def test_hashed_resource_is_downloaded_when_manifest_changes(mocker, monkeypatch, empty_reference_data) -> None:
+    '''
+    A new content hashed key in the manifest replaces the cached resource and its snapshot.
+    '''
+    # ASSIGN
+    serve_manifest(mocker, monkeypatch, empty_reference_data, {
+        'manifest.json': get_manifest('aaaa'),
+        'hashed/typeIDToName.aaaa.json.gz': b'{"34": {"name": "Tritanium"}}',
+    })
+    empty_reference_data.get_resource('typeIDToName')
+    monkeypatch.setattr(empty_reference_data, 'REVALIDATE_SECONDS', 0)
+    serve_manifest(mocker, monkeypatch, empty_reference_data, {
+        'manifest.json': get_manifest('bbbb'),
+        'hashed/typeIDToName.bbbb.json.gz': b'{"35": {"name": "Pyerite"}}',
+    })
+
+    # ACT
+    data = empty_reference_data.get_resource('typeIDToName')
+
+    # ASSERT
+    assert data == {'35': {'name': 'Pyerite'}}
+    assert empty_reference_data.load_snapshot('typeIDToName.json', json.loads)['key'] == 'hashed/typeIDToName.bbbb.json.gz'
+
+
+def test_failed_hashed_download_is_not_retried_until_stale(mocker, monkeypatch, empty_reference_data) -> None:
+    '''
+    If the new hashed key of a resource cannot be downloaded the cached copy is served until its TTL expires.
+    '''
+    # ASSIGN
+    serve_manifest(mocker, monkeypatch, empty_reference_data, {
+        'manifest.json': get_manifest('aaaa'),
+        'hashed/typeIDToName.aaaa.json.gz': b'{"34": {"name": "Tritanium"}}',
+    })
+    empty_reference_data.get_resource('typeIDToName')
+    empty_reference_data.resource_cache['manifest.json']['checked_at'] = 0
+    get = serve_manifest(mocker, monkeypatch, empty_reference_data, {'manifest.json': get_manifest('bbbb')})
+
+    # ACT
+    first = empty_reference_data.get_resource('typeIDToName')
+    second = empty_reference_data.get_resource('typeIDToName')
+
+    # ASSERT
+    assert first == second == {'34': {'name': 'Tritanium'}}
+    urls = [call.args[0].rsplit('/resources/', 1)[1] for call in get.call_args_list]
+    assert urls == ['manifest.json', 'hashed/typeIDToName.bbbb.json.gz']
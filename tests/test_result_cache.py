@@ -0,0 +1,166 @@
+'''
+Tests for the result cache of the hauling and station routes.
+'''
+import threading
+
+import fakeredis
+import pytest
+
+from api.utils import result_cache
+
+DEFAULTS = {'from': None, 'to': None, 'tax': 0.075, 'minProfit': 500000, 'limit': None}
+VERSION = 'market_data:10:0'
+
+
+class FakeMarketIndex:
+    '''
+    Elasticsearch stand-in reporting the indexing statistics of the market data index.
+    '''
+    def __init__(self):
+        self.index_total = 10
+        self.calls = 0
+        self.indices = self
+
+    def stats(self, index, metric): # pylint: disable=unused-argument
+        '''
+        Return the indexing statistics of the index.
+        '''
+        self.calls += 1
+        return {'indices': {index: {'primaries': {'indexing': {'index_total': self.index_total, 'delete_total': 0}}}}}
+
+
+@pytest.fixture()
+def redis_client(monkeypatch):
+    '''
+    Local stand-in for Redis with fast polling.
+    '''
+    monkeypatch.setattr(result_cache, 'POLL_SECONDS', 0.01)
+    return fakeredis.FakeRedis()
+
+
+def test_equivalent_queries_share_a_key() -> None:
+    '''
+    Defaults, number spellings, whitespace and unused parameters do not change the key.
+    '''
+    # ACT
+    explicit = result_cache.get_key('/hauling', {
+        'from': '10000002', 'to': '10000043', 'tax': '0.0750', 'minProfit': '500000.0', '_': '123'
+    }, DEFAULTS, VERSION)
+    implicit = result_cache.get_key('/hauling', {'from': ' 10000002', 'to': '10000043'}, DEFAULTS, VERSION)
+    different = result_cache.get_key('/hauling', {'from': '10000002', 'to': '10000043', 'tax': '0.08'}, DEFAULTS, VERSION)
+    station = result_cache.get_key('/station', {'from': '10000002', 'to': '10000043'}, DEFAULTS, VERSION)
+    refreshed = result_cache.get_key('/hauling', {'from': '10000002', 'to': '10000043'}, DEFAULTS, 'market_data:11:0')
+    unknown = result_cache.get_key('/hauling', {'from': '10000002', 'to': '10000043'}, DEFAULTS, None)
+
+    # ASSERT
+    assert explicit == implicit
+    assert different != implicit
+    assert station != implicit
+    assert refreshed != implicit
+    assert unknown is None
+
+
+def test_market_version_follows_writes(monkeypatch) -> None:
+    '''
+    The market data version changes once orders are written and is re-read at most every few seconds.
+    '''
+    # ASSIGN
+    monkeypatch.setattr(result_cache, 'market_version_state', {'version': None, 'checked_at': 0.0})
+    es_client = FakeMarketIndex()
+
+    # ACT
+    first = result_cache.get_market_version(es_client)
+    es_client.index_total += 5
+    cached = result_cache.get_market_version(es_client)
+    monkeypatch.setattr(result_cache, 'MARKET_VERSION_TTL', 0)
+    refreshed = result_cache.get_market_version(es_client)
+
+    # ASSERT
+    assert first == cached == VERSION
+    assert refreshed == 'market_data:15:0'
+    assert es_client.calls == 2
+
+
+def test_result_without_key_is_not_cached(mocker, redis_client) -> None:
+    '''
+    Without a market data version results are computed every time.
+    '''
+    # ASSIGN
+    compute = mocker.MagicMock(return_value=[])
+
+    # ACT
+    result_cache.get_or_compute(redis_client, None, compute)
+    result_cache.get_or_compute(redis_client, None, compute)
+
+    # ASSERT
+    assert compute.call_count == 2
+    assert not redis_client.keys()
+
+
+def test_result_is_computed_once(mocker, redis_client) -> None:
+    '''
+    A stored result is served without computing it again and expires after the TTL.
+    '''
+    # ASSIGN
+    compute = mocker.MagicMock(return_value=[{'Item': 'Rifter', 'Net Profit': 1000.5}])
+
+    # ACT
+    first = result_cache.get_or_compute(redis_client, 'result:/hauling:key', compute)
+    second = result_cache.get_or_compute(redis_client, 'result:/hauling:key', compute)
+
+    # ASSERT
+    assert first == second == [{'Item': 'Rifter', 'Net Profit': 1000.5}]
+    assert compute.call_count == 1
+    assert 0 < redis_client.ttl('result:/hauling:key') <= result_cache.RESULT_CACHE_TTL
+    assert not redis_client.exists('result:/hauling:key:lock')
+
+
+def test_concurrent_requests_wait_for_the_first(mocker, redis_client) -> None:
+    '''
+    A request arriving while an identical one is computed waits for its result.
+    '''
+    # ASSIGN
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow_compute():
+        started.set()
+        release.wait(5)
+        return [{'Item': 'Rifter'}]
+
+    waiting_compute = mocker.MagicMock(return_value=[])
+    results = {}
+    first = threading.Thread(target=lambda: results.update(
+        first=result_cache.get_or_compute(redis_client, 'result:/station:key', slow_compute)
+    ))
+
+    # ACT
+    first.start()
+    started.wait(5)
+    second = threading.Thread(target=lambda: results.update(
+        second=result_cache.get_or_compute(redis_client, 'result:/station:key', waiting_compute)
+    ))
+    second.start()
+    release.set()
+    first.join(5)
+    second.join(5)
+
+    # ASSERT
+    assert results['first'] == results['second'] == [{'Item': 'Rifter'}]
+    assert waiting_compute.call_count == 0
+
+
+def test_redis_errors_do_not_fail_requests(mocker, redis_client) -> None:
+    '''
+    The result is computed directly when Redis is unavailable.
+    '''
+    # ASSIGN
+    mocker.patch.object(redis_client, 'get', side_effect=ConnectionError())
+    compute = mocker.MagicMock(return_value=[1])
+
+    # ACT
+    result = result_cache.get_or_compute(redis_client, 'result:/hauling:key', compute)
+
+    # ASSERT
+    assert result == [1]
+    assert compute.call_count == 1
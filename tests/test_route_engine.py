@@ -0,0 +1,101 @@
+'''
+Tests for the local stargate route engine.
+'''
+import heapq
+import random
+
+import pytest
+
+from api.utils.route_engine import JumpGraph
+
+# 1 - 2 - 3 is the shortest route but 2 is low security, 1 - 4 - 5 - 3 stays in high security
+SYSTEM_JUMPS = {
+    '1': [2, 4],
+    '2': [1, 3],
+    '3': [2, 5],
+    '4': [1, 5],
+    '5': [4, 3],
+    '6': [7],
+    '7': [6],
+}
+HIGH_SEC = [1, 3, 4, 5, 6, 7]
+
+
+@pytest.mark.parametrize('route_safety, expected', [
+    ('shortest', 3),
+    ('secure', 4),
+    ('insecure', 3),
+])
+def test_count_jumps_per_route_safety(route_safety, expected) -> None:
+    '''
+    Jump counts follow the route safety and include the origin like ESI routes.
+    '''
+    # ASSIGN
+    graph = JumpGraph(SYSTEM_JUMPS, HIGH_SEC)
+
+    # ACT
+    jumps = graph.count_jumps(1, 3, route_safety)
+
+    # ASSERT
+    assert jumps == expected
+
+
+def test_count_jumps_edge_cases() -> None:
+    '''
+    Routes to the same system, unreachable systems and unknown systems.
+    '''
+    # ASSIGN
+    graph = JumpGraph(SYSTEM_JUMPS, HIGH_SEC)
+
+    # ACT / ASSERT
+    assert graph.count_jumps(1, 1, 'secure') == 1
+    assert graph.count_jumps(1, 6, 'shortest') == -1
+    assert graph.count_jumps(1, 99, 'shortest') is None
+
+
+def reference_jumps(adjacency: dict, high_sec: set, start: int, end: int, route_safety: str) -> int:
+    '''
+    Route length found with a plain Dijkstra over (avoided systems, jumps).
+    '''
+    def avoided(system_id):
+        if route_safety == 'secure':
+            return system_id not in high_sec
+        if route_safety == 'insecure':
+            return system_id in high_sec
+        return False
+
+    best = {start: (0, 0)}
+    heap = [(0, 0, start)]
+    while heap:
+        penalty, hops, system_id = heapq.heappop(heap)
+        if (penalty, hops) > best[system_id]:
+            continue
+        for neighbor in adjacency[system_id]:
+            cost = (penalty + avoided(neighbor), hops + 1)
+            if cost < best.get(neighbor, (float('inf'), 0)):
+                best[neighbor] = cost
+                heapq.heappush(heap, (*cost, neighbor))
+    return best[end][1] + 1 if end in best else -1
+
+
+def test_count_jumps_matches_reference_search() -> None:
+    '''
+    The vectorized search finds routes as long as a plain Dijkstra on a random graph.
+    '''
+    # ASSIGN
+    generator = random.Random(7)
+    adjacency = {system_id: set() for system_id in range(200)}
+    for _ in range(300):
+        start, end = generator.sample(range(200), 2)
+        adjacency[start].add(end)
+        adjacency[end].add(start)
+    high_sec = {system_id for system_id in adjacency if generator.random() < 0.6}
+    graph = JumpGraph({str(key): sorted(value) for key, value in adjacency.items()}, high_sec)
+    pairs = [tuple(generator.sample(range(200), 2)) for _ in range(100)]
+
+    for route_safety in ['shortest', 'secure', 'insecure']:
+        # ACT
+        jumps = [graph.count_jumps(start, end, route_safety) for start, end in pairs]
+
+        # ASSERT
+        assert jumps == [reference_jumps(adjacency, high_sec, start, end, route_safety) for start, end in pairs]
@@ -0,0 +1,79 @@
+'''
+Tests for the de-duplicated, batched route refresh publisher.
+'''
+import json
+
+import fakeredis
+import pytest
+
+from api.utils import route_refresh, startup
+
+
+@pytest.fixture()
+def sqs_client(mocker, monkeypatch):
+    '''
+    Stand-in SQS client with a local stand-in for Redis.
+    '''
+    sqs = mocker.MagicMock()
+    sqs.send_message_batch.return_value = {'Successful': [], 'Failed': []}
+    monkeypatch.setattr(startup, 'clients', {'redis': fakeredis.FakeRedis(), 'sqs': sqs})
+    return sqs
+
+
+def sent_routes(sqs_client) -> list:
+    '''
+    Returns the routes sent in every batch.
+    '''
+    return [
+        [json.loads(entry['MessageBody']) for entry in call.kwargs['Entries']]
+        for call in sqs_client.send_message_batch.call_args_list
+    ]
+
+
+def test_routes_are_sent_once_in_batches(sqs_client) -> None:
+    '''
+    Routes are de-duplicated and sent 10 per call.
+    '''
+    # ASSIGN
+    routes = [f'30000142-{30002000 + idx}' for idx in range(23)]
+
+    # ACT
+    sent = route_refresh.publish_routes(routes + routes[:5])
+
+    # ASSERT
+    batches = sent_routes(sqs_client)
+    assert sent == 23
+    assert [len(batch) for batch in batches] == [10, 10, 3]
+    assert batches[0][0] == {'start': '30000142', 'end': '30002000'}
+
+
+def test_routes_are_not_resent_within_window(sqs_client) -> None:
+    '''
+    A route published by an earlier request is skipped until its window ends.
+    '''
+    # ASSIGN
+    route_refresh.publish_routes(['30000142-30002187'])
+
+    # ACT
+    sent = route_refresh.publish_routes(['30000142-30002187', '30000142-30002659'])
+
+    # ASSERT
+    assert sent == 1
+    assert sent_routes(sqs_client)[-1] == [{'start': '30000142', 'end': '30002659'}]
+
+
+def test_failed_routes_are_retried(sqs_client) -> None:
+    '''
+    Routes SQS failed to accept are published again by the next request.
+    '''
+    # ASSIGN
+    sqs_client.send_message_batch.return_value = {'Failed': [{'Id': '1'}]}
+    route_refresh.publish_routes(['30000142-30002187', '30000142-30002659'])
+    sqs_client.send_message_batch.return_value = {'Failed': []}
+
+    # ACT
+    sent = route_refresh.publish_routes(['30000142-30002187', '30000142-30002659'])
+
+    # ASSERT
+    assert sent == 1
+    assert sent_routes(sqs_client)[-1] == [{'start': '30000142', 'end': '30002659'}]
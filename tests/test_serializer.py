@@ -0,0 +1,109 @@
+'''
+Tests for the size aware response serializer.
+'''
+import base64
+import json
+
+from api.utils import serializer
+
+
+def test_serialize_matches_json_dumps() -> None:
+    '''
+    Responses within the limit are encoded exactly as json.dumps would.
+    '''
+    # ASSIGN
+    trades = [{'Item': 'Rifter', 'Net Profit': 1000.5, 'Jumps': 3}, {'Item': 'Tritanium ☃', 'Net Profit': 2}]
+
+    # ACT
+    serialized = serializer.serialize(trades)
+    empty = serializer.serialize([])
+    error = serializer.serialize({'statusCode': 429, 'body': 'Too Many Requests.'})
+
+    # ASSERT
+    assert serialized.body == json.dumps(trades)
+    assert serialized.dropped_items == 0
+    assert serialized.total_items == 2
+    assert empty.body == '[]'
+    assert error.body == json.dumps({'statusCode': 429, 'body': 'Too Many Requests.'})
+
+
+def test_serialize_stops_at_byte_budget() -> None:
+    '''
+    Items that do not fit are dropped from the end and the body stays within the limit.
+    '''
+    # ASSIGN
+    trades = [{'Item ID': idx, 'Item': 'x' * 20} for idx in range(100)]
+
+    # ACT
+    serialized = serializer.serialize(trades, max_bytes=1000)
+
+    # ASSERT
+    kept = json.loads(serialized.body)
+    assert len(serialized.body.encode('utf-8')) <= 1000
+    assert len(json.dumps(trades[:len(kept) + 1])) > 1000
+    assert kept == trades[:len(kept)]
+    assert serialized.dropped_items == 100 - len(kept)
+
+
+def test_negotiate_encoding() -> None:
+    '''
+    The preferred accepted encoding is chosen and refused encodings are skipped.
+    '''
+    # ACT / ASSERT
+    assert serializer.negotiate_encoding('gzip, deflate, br') == 'br'
+    assert serializer.negotiate_encoding('gzip;q=1.0, br;q=0') == 'gzip'
+    assert serializer.negotiate_encoding('*') == 'br'
+    assert serializer.negotiate_encoding('deflate') is None
+    assert serializer.negotiate_encoding('') is None
+
+
+def test_compressed_response_holds_every_item() -> None:
+    '''
+    A response too large to send uncompressed is sent in full once compressed.
+    '''
+    # ASSIGN
+    trades = [{'Item ID': idx, 'Item': 'Tritanium', 'Net Profit': idx * 10} for idx in range(1000)]
+
+    for encoding in ['gzip', 'br']:
+        # ACT
+        response = serializer.encode_response(trades, encoding, max_bytes=20000)
+
+        # ASSERT
+        body = serializer.decompress(base64.b64decode(response['body']), encoding)
+        assert response['isBase64Encoded'] is True
+        assert response['headers']['Content-Encoding'] == encoding
+        assert response['headers']['X-Dropped-Items'] == '0'
+        assert json.loads(body) == trades
+
+
+def test_compressed_response_is_truncated_to_budget() -> None:
+    '''
+    A compressed body over the budget keeps as many leading items as fit.
+    '''
+    # ASSIGN
+    trades = [{'Item ID': idx, 'Hash': f'{idx * 7919:x}' * 8} for idx in range(2000)]
+
+    # ACT
+    response = serializer.encode_response(trades, 'gzip', max_bytes=4000)
+
+    # ASSERT
+    kept = json.loads(serializer.decompress(base64.b64decode(response['body']), 'gzip'))
+    assert len(response['body']) <= 4000
+    assert kept == trades[:len(kept)]
+    assert response['headers']['X-Dropped-Items'] == str(2000 - len(kept))
+
+
+def test_ndjson_response() -> None:
+    '''
+    Newline delimited JSON writes one item per line.
+    '''
+    # ASSIGN
+    trades = [{'Item ID': 1}, {'Item ID': 2}]
+
+    # ACT
+    response = serializer.encode_response(trades, '', serializer.NDJSON)
+
+    # ASSERT
+    assert response['headers']['Content-Type'] == serializer.NDJSON
+    assert response['body'] == '{"Item ID": 1}\n{"Item ID": 2}\n'
+    assert response['isBase64Encoded'] is False
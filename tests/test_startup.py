@@ -0,0 +1,76 @@
+'''
+Tests for the lazily created clients and start up timings.
+'''
+import pytest
+
+from api.utils import startup
+
+
+@pytest.fixture()
+def clean_startup(monkeypatch):
+    '''
+    Start without any created clients or recorded timings.
+    '''
+    monkeypatch.setattr(startup, 'clients', {})
+    monkeypatch.setattr(startup, 'phase_timings', {})
+    monkeypatch.setattr(startup, 'cold_start', True)
+    return startup
+
+
+def test_client_is_created_once(mocker, clean_startup) -> None:
+    '''
+    A shared client is created on first use only and its creation is timed.
+    '''
+    # ASSIGN
+    factory = mocker.MagicMock(return_value='client')
+
+    # ACT
+    first = clean_startup.get_client('redis', factory)
+    second = clean_startup.get_client('redis', factory)
+
+    # ASSERT
+    assert first == second == 'client'
+    assert factory.call_count == 1
+    assert 'client:redis' in clean_startup.phase_timings
+
+
+def test_report_marks_only_first_invocation_as_cold(clean_startup) -> None:
+    '''
+    Timings are reported per invocation and only the first one is a cold start.
+    '''
+    # ASSIGN
+    with clean_startup.timed('route'):
+        pass
+
+    # ACT
+    first = clean_startup.report('/hauling')
+    second = clean_startup.report('/hauling')
+
+    # ASSERT
+    assert first['cold_start'] is True
+    assert 'route' in first['phases_ms']
+    assert second['cold_start'] is False
+    assert second['phases_ms'] == {}
+
+
+def test_prewarm_is_optional(mocker, monkeypatch, clean_startup) -> None:
+    '''
+    Clients are only created during initialization when prewarming is enabled.
+    '''
+    # ASSIGN
+    loader = mocker.MagicMock(__name__='loader')
+    monkeypatch.setattr(clean_startup, 'get_redis_client', mocker.MagicMock(__name__='redis'))
+    monkeypatch.setattr(clean_startup, 'get_es_client', mocker.MagicMock(__name__='es'))
+    monkeypatch.setattr(clean_startup, 'get_sqs_client', mocker.MagicMock(__name__='sqs'))
+
+    # ACT
+    monkeypatch.delenv('PREWARM_ON_INIT', raising=False)
+    clean_startup.prewarm(loader)
+    skipped_calls = loader.call_count
+    monkeypatch.setenv('PREWARM_ON_INIT', 'true')
+    clean_startup.prewarm(loader)
+
+    # ASSERT
+    assert skipped_calls == 0
+    assert loader.call_count == 1
+    assert clean_startup.get_redis_client.call_count == 1
@@ -0,0 +1,233 @@
+'''
+Tests for the resource sync against a local S3 stand-in and a stub of the GitHub downloads.
+'''
+import bz2
+import gzip
+import hashlib
+import importlib
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import boto3
+import brotli
+import pytest
+from moto import mock_aws
+
+from api.utils import compact_table
+from api.utils.route_engine import JumpGraph
+
+# Sample value of each compact column kind, used to build a row of every published resource
+SAMPLE_VALUES = {'str': 'Jita IV - Moon 4 - Caldari Navy Assembly Plant', 'float': 0.01, 'category': 'high_sec'}
+
+# Contents of each stubbed GitHub resource file by path
+GITHUB_FILES = {
+    '/typeIDToName.json': json.dumps({'34': {'name': 'Tritanium', 'volume': 0.01}}).encode('utf-8'),
+    '/regionList.json': b'["Domain",  "The Forge"]',
+}
+
+# Stargate jumps of the static data export, one row per direction
+SYSTEM_JUMPS_CSV = (
+    'fromRegionID,fromConstellationID,fromSolarSystemID,toSolarSystemID,toConstellationID,toRegionID\n'
+    '10000002,20000020,30000142,30000144,20000020,10000002\n'
+    '10000002,20000020,30000144,30000142,20000020,10000002\n'
+    '10000002,20000020,30000144,30002187,20000322,10000043\n'
+    '10000043,20000322,30002187,30000144,20000020,10000002\n'
+)
+SDE_FILES = {'/mapSolarSystemJumps.csv.bz2': bz2.compress(SYSTEM_JUMPS_CSV.encode('utf-8'))}
+
+
+class StubGitHub(BaseHTTPRequestHandler):
+    '''
+    Serves the raw bytes of GITHUB_FILES and SDE_FILES and records each download.
+    '''
+    downloads = []
+    base_url = ''
+
+    def do_GET(self): # pylint: disable=invalid-name
+        '''
+        Answer a download request.
+        '''
+        StubGitHub.downloads.append(self.path)
+        body = {**GITHUB_FILES, **SDE_FILES}[self.path]
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args): # pylint: disable=redefined-builtin
+        pass
+
+
+@pytest.fixture()
+def sync(monkeypatch):
+    '''
+    Import the sync job against an empty moto bucket and a local GitHub stub.
+    '''
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+
+    with mock_aws():
+        module = importlib.import_module('event_driven_lambdas.synchronize_universe_resources')
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket=module.RESOURCE_BUCKET)
+        monkeypatch.setattr(module, 's3', s3)
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), StubGitHub)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        StubGitHub.downloads = []
+        StubGitHub.base_url = f'http://127.0.0.1:{server.server_address[1]}'
+        yield module
+        server.shutdown()
+
+
+def get_resources(shas: dict) -> list:
+    '''
+    Build the GitHub contents listing of the stubbed files with the given blob SHAs.
+    '''
+    return [
+        {'name': path.lstrip('/'), 'type': 'file', 'sha': shas[path], 'download_url': f'{StubGitHub.base_url}{path}'}
+        for path in GITHUB_FILES
+    ]
+
+
+def test_unchanged_resources_are_skipped(sync) -> None:
+    '''
+    Resources are uploaded byte for byte once and only downloaded again when their SHA changes.
+    '''
+    # ASSIGN
+    shas = {'/typeIDToName.json': 'a1', '/regionList.json': 'b1'}
+    bucket = sync.RESOURCE_BUCKET
+
+    # ACT
+    first = sync.sync_resources(bucket, get_resources(shas))
+    second = sync.sync_resources(bucket, get_resources(shas))
+    shas['/regionList.json'] = 'b2'
+    third = sync.sync_resources(bucket, get_resources(shas))
+
+    # ASSERT
+    assert first == [True, True]
+    assert second == [False, False]
+    assert third == [False, True]
+    assert sorted(StubGitHub.downloads) == ['/regionList.json', '/regionList.json', '/typeIDToName.json']
+
+    region_list = sync.s3.get_object(Bucket=bucket, Key='resources/regionList.json')
+    assert region_list['Body'].read() == GITHUB_FILES['/regionList.json']
+    assert region_list['ContentType'] == 'application/json'
+    assert region_list['Metadata'] == {'github-sha': 'b2'}
+    compact = sync.s3.get_object(Bucket=bucket, Key='resources/typeIDToName.bin')
+    assert compact['Body'].read().startswith(sync.COMPACT_MAGIC)
+
+
+def test_missing_compact_table_is_rebuilt(sync) -> None:
+    '''
+    A resource is synchronized again when its compact table is missing, even if the file is unchanged.
+    '''
+    # ASSIGN
+    shas = {'/typeIDToName.json': 'a1', '/regionList.json': 'b1'}
+    bucket = sync.RESOURCE_BUCKET
+    sync.sync_resources(bucket, get_resources(shas))
+    sync.s3.delete_object(Bucket=bucket, Key='resources/typeIDToName.bin')
+
+    # ACT
+    results = sync.sync_resources(bucket, get_resources(shas))
+
+    # ASSERT
+    assert results == [True, False]
+    assert sync.s3.head_object(Bucket=bucket, Key='resources/typeIDToName.bin')['Metadata'] == {'github-sha': 'a1'}
+
+
+def test_compressed_and_hashed_variants_are_published(sync) -> None:
+    '''
+    Each resource is published with compressed variants and content hashed copies listed in the manifest.
+    '''
+    # ASSIGN
+    shas = {'/typeIDToName.json': 'a1', '/regionList.json': 'b1'}
+    bucket = sync.RESOURCE_BUCKET
+
+    # ACT
+    sync.sync_resources(bucket, get_resources(shas))
+
+    # ASSERT
+    manifest = json.loads(sync.s3.get_object(Bucket=bucket, Key='resources/manifest.json')['Body'].read())
+    assert sorted(manifest['resources']) == ['regionList.json', 'typeIDToName.bin', 'typeIDToName.json']
+
+    entry = manifest['resources']['regionList.json']
+    content = GITHUB_FILES['/regionList.json']
+    assert entry['sha256'] == hashlib.sha256(content).hexdigest()
+    assert entry['key'] == f"hashed/regionList.{entry['sha256'][:16]}.json"
+
+    hashed = sync.s3.get_object(Bucket=bucket, Key=f"resources/{entry['key']}")
+    assert hashed['Body'].read() == content
+    assert hashed['CacheControl'] == 'public, max-age=31536000, immutable'
+
+    gzipped = sync.s3.get_object(Bucket=bucket, Key=f"resources/{entry['encodings']['gzip']}")
+    assert gzipped['ContentEncoding'] == 'gzip'
+    assert gzip.decompress(gzipped['Body'].read()) == content
+    brotli_variant = sync.s3.get_object(Bucket=bucket, Key='resources/regionList.json.br')
+    assert brotli_variant['ContentEncoding'] == 'br'
+    assert brotli.decompress(brotli_variant['Body'].read()) == content
+
+
+def get_sample_mapping(columns: list) -> dict:
+    '''
+    Build a resource with one complete row and one row missing every field of the given columns.
+    '''
+    if columns[0][1] is None:
+        return {'60003760': SAMPLE_VALUES[columns[0][2]], '60008494': None}
+    return {
+        '30000142': {field: SAMPLE_VALUES[kind] for _, field, kind in columns},
+        '30000144': {},
+    }
+
+
+def test_compact_tables_match_api_format(sync) -> None:
+    '''
+    The job publishes the columns the API reads, in the exact format its encoder writes.
+    The job is deployed on its own, so it keeps a copy of the encoder that must not drift.
+    '''
+    # ASSERT
+    assert sync.COMPACT_MAGIC == compact_table.MAGIC
+    assert sync.COMPACT_COLUMNS == compact_table.COMPACT_COLUMNS
+
+    for name, columns in sync.COMPACT_COLUMNS.items():
+        # ASSIGN
+        mapping = get_sample_mapping(columns)
+
+        # ACT
+        body = sync.compile_compact_table(mapping, columns)
+        table = compact_table.CompactTable(body)
+
+        # ASSERT
+        assert body == compact_table.encode_table(mapping, columns), name
+        assert len(table) == 2
+        complete, missing = sorted(int(key) for key in mapping)
+        for column, _, kind in columns:
+            assert table.value(complete, column) == SAMPLE_VALUES[kind], name
+            if kind == 'str':
+                assert table.value(missing, column) == ''
+            elif kind == 'category':
+                assert table.value(missing, column) is None
+
+
+def test_system_jumps_are_published_for_the_route_engine(sync, monkeypatch) -> None:
+    '''
+    The stargate graph is built from the static data export and published only when it changes.
+    '''
+    # ASSIGN
+    monkeypatch.setattr(sync, 'SYSTEM_JUMPS_URL', f'{StubGitHub.base_url}/mapSolarSystemJumps.csv.bz2')
+    bucket = sync.RESOURCE_BUCKET
+
+    # ACT
+    first = sync.sync_system_jumps(bucket)
+    second = sync.sync_system_jumps(bucket)
+
+    # ASSERT
+    assert (first, second) == (True, False)
+    system_jumps = json.loads(sync.s3.get_object(Bucket=bucket, Key='resources/systemJumps.json')['Body'].read())
+    assert system_jumps == {'30000142': [30000144], '30000144': [30000142, 30002187], '30002187': [30000144]}
+
+    manifest = json.loads(sync.s3.get_object(Bucket=bucket, Key='resources/manifest.json')['Body'].read())
+    assert 'gzip' in manifest['resources']['systemJumps.json']['encodings']
+    assert JumpGraph(system_jumps, [30000142, 30000144, 30002187]).count_jumps(30000142, 30002187, 'shortest') == 3